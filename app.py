@@ -1,16 +1,46 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
-from datetime import datetime, timedelta, date
+from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, make_response, g, session, has_request_context, send_from_directory, stream_with_context
+from datetime import datetime, timedelta, date, timezone
 import os
+import json
 from dotenv import load_dotenv # Carrega variáveis de ambiente
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from flask_migrate import Migrate
-import pandas as pd
+import numpy as np
+import backtest
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 import requests
 import math
 from sqlalchemy import func # Para usar funções SQL como SUM, MAX, MIN
 import click
+import functools
+from decimal import Decimal, ROUND_HALF_EVEN
+from flask.json.provider import DefaultJSONProvider
+import gzip
+import io
+import csv
+import hashlib
+import contextlib
+import shutil
+import mimetypes
+from collections import deque, OrderedDict
+import bisect
+import heapq
+import time
+import random
+import sys
+import sqlalchemy as sa
+import sqlite3
+import threading
+try:
+    import orjson # Serialização JSON rápida (opcional)
+except ImportError:
+    orjson = None
+try:
+    import brotli # Compressão 'br' (opcional; sem ele só gzip)
+except ImportError:
+    brotli = None
 
 # Carrega variáveis de ambiente do arquivo .env (se existir)
 # Ótimo para desenvolvimento local
@@ -29,17 +59,217 @@ default_db_url = 'sqlite:///' + os.path.join(app.instance_path, 'app.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', default_db_url)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False # Desativa warnings desnecessários
 
+# Réplica de leitura opcional (ex: Postgres streaming replica) para as rotas de análise
+REPLICA_BIND_KEY = 'replica'
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')
+if DATABASE_READ_URL:
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND_KEY: {'url': DATABASE_READ_URL, 'pool_pre_ping': True}}
+
 # Configurações de Sessão Permanente (mantido)
 app.config['SESSION_PERMANENT'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=365)
 
+# --- JSON Provider (orjson, se disponível) ---
+def _orjson_default(obj):
+    """ Tipos que o orjson não serializa nativamente. """
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonJSONProvider(DefaultJSONProvider):
+    """ JSON provider do Flask baseado em orjson: serializa direto para bytes, entende
+    datetime (mesmo formato de isoformat()) e tipos NumPy sem conversões em Python. """
+
+    def _options(self):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_orjson_default, option=self._options())
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+if orjson is not None:
+    app.json = OrjsonJSONProvider(app)
+
+# --- Roteamento de Leitura (réplica opcional) ---
+# Rotas marcadas com @read_replica leem da réplica (DATABASE_READ_URL). Escritas, flushes e
+# qualquer consulta depois de uma escrita na mesma request vão para o primário; por
+# DB_REPLICA_STICKY_SECONDS após uma escrita o usuário também lê do primário
+# (read-your-writes, marcado na sessão do Flask). Réplica fora do ar ou atrasada além de
+# DB_REPLICA_MAX_LAG_SECONDS -> primário, reavaliado a cada DB_REPLICA_HEALTH_SECONDS.
+
+DB_REPLICA_STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+DB_REPLICA_MAX_LAG_SECONDS = float(os.environ.get('DB_REPLICA_MAX_LAG_SECONDS', 10))
+DB_REPLICA_HEALTH_SECONDS = float(os.environ.get('DB_REPLICA_HEALTH_SECONDS', 15))
+LAST_WRITE_SESSION_KEY = '_db_last_write'
+_replica_health = {'ok': True, 'checked_at': None}
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """ Sessão que manda as leituras das rotas @read_replica para o engine da réplica. """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(clause):
+            g.db_route = 'replica'
+            return self._db.engines[REPLICA_BIND_KEY]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self, clause):
+        if not DATABASE_READ_URL or self._flushing or not has_request_context():
+            return False
+        if not g.get('db_read_replica') or g.get('db_wrote'):
+            return False
+        if isinstance(clause, sa.UpdateBase): # INSERT/UPDATE/DELETE
+            return False
+        return replica_is_healthy(self._db.engines[REPLICA_BIND_KEY])
+
+def replica_is_healthy(engine):
+    """ SELECT 1 (e atraso de replicação no Postgres), com o resultado em cache por alguns segundos. """
+    checked_at = _replica_health['checked_at']
+    if checked_at is not None and time.monotonic() - checked_at < DB_REPLICA_HEALTH_SECONDS:
+        return _replica_health['ok']
+    healthy = True
+    try:
+        with engine.connect() as connection:
+            connection.execute(sa.text('SELECT 1'))
+            if engine.dialect.name == 'postgresql':
+                lag = connection.execute(sa.text(
+                    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                )).scalar()
+                healthy = lag is None or float(lag) <= DB_REPLICA_MAX_LAG_SECONDS
+                if not healthy:
+                    print(f"[DB REPLICA WARN] Réplica atrasada {float(lag):.1f}s; lendo do primário.")
+    except Exception as e:
+        healthy = False
+        print(f"[DB REPLICA WARN] Réplica indisponível, lendo do primário: {e}")
+    if healthy and not _replica_health['ok']:
+        print("[DB REPLICA] Réplica de volta; leituras de análise voltam para ela.")
+    _replica_health.update(ok=healthy, checked_at=time.monotonic())
+    return healthy
+
+def read_replica(view):
+    """ Marca uma rota (GET) só de leitura como elegível para a réplica. """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if DATABASE_READ_URL and request.method in ('GET', 'HEAD'):
+            last_write = session.get(LAST_WRITE_SESSION_KEY, 0)
+            g.db_read_replica = time.time() - last_write > DB_REPLICA_STICKY_SECONDS
+        return view(*args, **kwargs)
+    return wrapper
+
 # --- Inicialização das Extensões ---
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush_write(db_session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+@sa.event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_bulk_write(orm_execute_state):
+    if has_request_context() and (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        g.db_wrote = True
+
+@app.after_request
+def remember_db_write(response):
+    """ Guarda o instante da última escrita do usuário (janela de read-your-writes). """
+    if DATABASE_READ_URL:
+        if g.get('db_wrote'):
+            session[LAST_WRITE_SESSION_KEY] = time.time()
+        response.headers['X-DB-Route'] = g.get('db_route', 'primary')
+    return response
 migrate = Migrate(app, db) # Inicializa o Flask-Migrate
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login' # Nome da view de login
 
+# --- Valores em Ponto Fixo (preços, quantidades, USD) ---
+# Guardados como BIGINT escalado (USD em micro-unidades etc.): SUM e rollups no banco são
+# somas inteiras exatas. O app continua lendo float (o mais próximo do decimal exato) e a
+# gravação quantiza com ROUND_HALF_EVEN na escala da coluna, sem round() espalhado pelo código.
+
+MONEY_SCALE = 6 # USD: PnL, taxas, volume
+PRICE_SCALE = 10 # Preços (cobre memecoins abaixo de US$ 0,0001)
+QUANTITY_SCALE = 8 # Tamanhos e saldos
+
+class FixedPoint(sa.types.TypeDecorator):
+    """ Decimal com 'scale' casas guardado como inteiro (valor * 10**scale). """
+    impl = sa.BigInteger
+    cache_ok = True
+
+    def __init__(self, scale):
+        super().__init__()
+        self.scale = scale
+        self.factor = 10 ** scale
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int(to_decimal(value, self.scale).scaleb(self.scale))
+
+    def process_literal_param(self, value, dialect):
+        return str(self.process_bind_param(value, dialect))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return int(value) / self.factor # int/int: arredondamento correto para o float mais próximo
+
+def to_decimal(value, scale=MONEY_SCALE):
+    """ Decimal exato de 'value' na grade de 'scale' casas (ROUND_HALF_EVEN). """
+    return Decimal(str(value)).quantize(Decimal(1).scaleb(-scale), rounding=ROUND_HALF_EVEN)
+
+def quantize(value, scale):
+    """ 'value' na grade de 'scale' casas, como float (None passa direto). """
+    return None if value is None else float(to_decimal(value, scale))
+
+def money(value):
+    """ Valor em USD na precisão da coluna (micro-dólar). """
+    return quantize(value, MONEY_SCALE)
+
+# Casas decimais de preço/tamanho por símbolo (tick e step do mercado) aplicadas aos valores
+# digitados; símbolo fora do registro usa a escala da coluna. JSON em SYMBOL_PRECISION sobrescreve.
+SYMBOL_PRECISION = {
+    'BTC': {'price': 2, 'size': 5},
+    'ETH': {'price': 2, 'size': 4},
+    'SOL': {'price': 3, 'size': 2},
+    'KMNO': {'price': 5, 'size': 1},
+    'BONK': {'price': 9, 'size': 0},
+    'USDC': {'price': 4, 'size': 2},
+    'USDT': {'price': 4, 'size': 2},
+}
+if os.environ.get('SYMBOL_PRECISION'):
+    SYMBOL_PRECISION.update(json.loads(os.environ['SYMBOL_PRECISION']))
+TRADE_PRICE_FIELDS = ('entry_price', 'exit_price', 'take_profit', 'stop_loss')
+
+def symbol_precision(symbol, kind):
+    """ Casas decimais de 'price' ou 'size' do símbolo, nunca além da escala da coluna. """
+    column_scale = PRICE_SCALE if kind == 'price' else QUANTITY_SCALE
+    return min(SYMBOL_PRECISION.get((symbol or '').upper(), {}).get(kind, column_scale), column_scale)
+
+def quantize_trade_values(symbol, values):
+    """ Ajusta (in place) preços e tamanho de um dict de campos de Trade ao tick/step do símbolo. """
+    price_places = symbol_precision(symbol, 'price')
+    for field in TRADE_PRICE_FIELDS:
+        if values.get(field) is not None:
+            values[field] = quantize(values[field], price_places)
+    if values.get('size') is not None:
+        values['size'] = quantize(values['size'], symbol_precision(symbol, 'size'))
+    return values
+
 # --- Modelos do Banco de Dados (SQLAlchemy) ---
 
 class User(UserMixin, db.Model):
@@ -48,20 +278,28 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(256), nullable=False)
 
 class Trade(db.Model):
+    # Índices compostos por dono: toda consulta do app filtra por user_id primeiro
+    __table_args__ = (
+        db.Index('ix_trade_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_trade_user_symbol', 'user_id', 'symbol'),
+        db.Index('ix_trade_user_closed_at', 'user_id', 'closed_at_timestamp'),
+    )
+
     id = db.Column(db.String(50), primary_key=True) # ID baseado em timestamp original
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), nullable=False) # Dono do trade
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     closed_at_timestamp = db.Column(db.DateTime, nullable=True, index=True) # Timestamp de fechamento
     symbol = db.Column(db.String(20), nullable=False, index=True)
     side = db.Column(db.String(10), nullable=True) # long/short
-    size = db.Column(db.Float, nullable=True)
-    entry_price = db.Column(db.Float, nullable=True)
-    exit_price = db.Column(db.Float, nullable=True)
-    pnl = db.Column(db.Float, nullable=True)
-    take_profit = db.Column(db.Float, nullable=True)
-    stop_loss = db.Column(db.Float, nullable=True)
+    size = db.Column(FixedPoint(QUANTITY_SCALE), nullable=True)
+    entry_price = db.Column(FixedPoint(PRICE_SCALE), nullable=True)
+    exit_price = db.Column(FixedPoint(PRICE_SCALE), nullable=True)
+    pnl = db.Column(FixedPoint(MONEY_SCALE), nullable=True)
+    take_profit = db.Column(FixedPoint(PRICE_SCALE), nullable=True)
+    stop_loss = db.Column(FixedPoint(PRICE_SCALE), nullable=True)
     tier = db.Column(db.String(10), nullable=True) # TIER usado no trade
-    calculated_fee = db.Column(db.Float, nullable=True, default=0.0) # Taxa calculada
-    volume_contribution = db.Column(db.Float, nullable=True, default=0.0) # Contribuição ao volume
+    calculated_fee = db.Column(FixedPoint(MONEY_SCALE), nullable=True, default=0.0) # Taxa calculada
+    volume_contribution = db.Column(FixedPoint(MONEY_SCALE), nullable=True, default=0.0) # Contribuição ao volume
 
     def to_dict(self):
         """ Helper para converter Trade em dicionário serializável. """
@@ -82,16 +320,209 @@ class Trade(db.Model):
             'volume_contribution': self.volume_contribution
         }
 
+class TradeArchive(db.Model):
+    """ Trade fechado movido da tabela quente por 'flask archive-trades' (mesmas colunas, somente leitura). """
+    __table_args__ = (
+        db.Index('ix_trade_archive_user_id', 'user_id', 'id'),
+        db.Index('ix_trade_archive_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_trade_archive_user_closed_at', 'user_id', 'closed_at_timestamp'),
+    )
+
+    id = db.Column(db.String(50), primary_key=True)
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    closed_at_timestamp = db.Column(db.DateTime, nullable=False)
+    symbol = db.Column(db.String(20), nullable=False)
+    side = db.Column(db.String(10), nullable=True)
+    size = db.Column(FixedPoint(QUANTITY_SCALE), nullable=True)
+    entry_price = db.Column(FixedPoint(PRICE_SCALE), nullable=True)
+    exit_price = db.Column(FixedPoint(PRICE_SCALE), nullable=False)
+    pnl = db.Column(FixedPoint(MONEY_SCALE), nullable=True)
+    take_profit = db.Column(FixedPoint(PRICE_SCALE), nullable=True)
+    stop_loss = db.Column(FixedPoint(PRICE_SCALE), nullable=True)
+    tier = db.Column(db.String(10), nullable=True)
+    calculated_fee = db.Column(FixedPoint(MONEY_SCALE), nullable=True)
+    volume_contribution = db.Column(FixedPoint(MONEY_SCALE), nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    to_dict = Trade.to_dict
+
 class Balance(db.Model):
     # id = db.Column(db.Integer, primary_key=True) # ID Auto-incrementável é opcional aqui
-    symbol = db.Column(db.String(20), primary_key=True, nullable=False, index=True) # Usar symbol como PK é mais direto
-    amount = db.Column(db.Float, nullable=False, default=0.0)
+    # PK composta (user_id, symbol): cada conta tem seu próprio saldo por símbolo
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), primary_key=True, nullable=False)
+    symbol = db.Column(db.String(20), primary_key=True, nullable=False, index=True)
+    amount = db.Column(FixedPoint(QUANTITY_SCALE), nullable=False, default=0.0)
 
 class ConfigValue(db.Model):
-    """ Modelo genérico para armazenar valores de configuração, como total_volume """
+    """ Modelo genérico para armazenar valores de configuração, como total_volume.
+    Valores por usuário usam a chave '<nome>:<user_id>' (ver user_config_key). """
     key = db.Column(db.String(50), primary_key=True)
     value = db.Column(db.String(200), nullable=True) # Armazena como string, converte ao usar
 
+class TradeIdAlias(db.Model):
+    """ ID antigo de um trade (timestamp em float, 'bp-<fill>') -> ID atual (ULID). """
+    legacy_id = db.Column(db.String(50), primary_key=True)
+    trade_id = db.Column(db.String(50), nullable=False, index=True) # Sem FK: como TradeEvent
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), nullable=False)
+
+class SyncChange(db.Model):
+    """ Sequência de mudanças por usuário (trades, saldos, config) para o delta de /api/sync.
+    O id é a versão monotônica; op 'delete' é a lápide de um registro removido. """
+    __table_args__ = (
+        db.Index('ix_sync_change_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), nullable=False)
+    entity = db.Column(db.String(20), nullable=False) # trade/balance/config
+    entity_key = db.Column(db.String(50), nullable=False) # ID do trade, símbolo ou nome da config
+    op = db.Column(db.String(10), nullable=False) # upsert/delete
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class VolumeDaily(db.Model):
+    """ Volume (volume_contribution) do usuário por dia de entrada dos trades — base da janela móvel. """
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    volume = db.Column(FixedPoint(MONEY_SCALE), nullable=False, default=0.0)
+
+class FeeSchedule(db.Model):
+    """ Taxa de um TIER/lado (maker/taker) vigente a partir de effective_from (até a próxima vigência). """
+    __table_args__ = (
+        db.UniqueConstraint('tier', 'side', 'effective_from', name='uq_fee_schedule_tier_side_from'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tier = db.Column(db.String(10), nullable=False)
+    side = db.Column(db.String(10), nullable=False) # maker/taker
+    rate = db.Column(db.Float, nullable=False)
+    effective_from = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    note = db.Column(db.String(200), nullable=True)
+
+class ExchangeFill(db.Model):
+    """ Fill bruto importado da Backpack (flask sync-fills). Fills são agregados em posições (Trade). """
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'fill_id', name='uq_exchange_fill_user_fill'),
+        db.Index('ix_exchange_fill_user_market_ts', 'user_id', 'market', 'timestamp'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), nullable=False)
+    fill_id = db.Column(db.String(64), nullable=False) # tradeId da Backpack
+    order_id = db.Column(db.String(64), nullable=True)
+    market = db.Column(db.String(40), nullable=False) # Ex: SOL_USDC_PERP
+    side = db.Column(db.String(10), nullable=False) # Bid/Ask
+    price = db.Column(FixedPoint(PRICE_SCALE), nullable=False)
+    quantity = db.Column(FixedPoint(QUANTITY_SCALE), nullable=False)
+    fee = db.Column(FixedPoint(MONEY_SCALE), nullable=True, default=0.0) # Taxa em USD
+    is_maker = db.Column(db.Boolean, nullable=True)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    # Posição (Trade) à qual o fill foi alocado e a quantidade alocada nela
+    # (um fill que inverte a posição é dividido: o restante fica na posição nova)
+    trade_id = db.Column(db.String(50), nullable=True, index=True) # Sem FK: o trade pode estar no TradeArchive
+    allocated_qty = db.Column(FixedPoint(QUANTITY_SCALE), nullable=True)
+
+class TradeFill(db.Model):
+    """ Lote de entrada/saída de um Trade manual (aumentos de posição e saídas parciais). """
+    __table_args__ = (
+        db.Index('ix_trade_fill_trade_ts', 'trade_id', 'timestamp', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), nullable=False)
+    trade_id = db.Column(db.String(50), nullable=False) # Sem FK: o trade pode estar no TradeArchive
+    kind = db.Column(db.String(10), nullable=False) # entry/exit
+    price = db.Column(FixedPoint(PRICE_SCALE), nullable=False)
+    quantity = db.Column(FixedPoint(QUANTITY_SCALE), nullable=False)
+    fee = db.Column(FixedPoint(MONEY_SCALE), nullable=False, default=0.0) # USD
+    realized_pnl = db.Column(FixedPoint(MONEY_SCALE), nullable=True) # Só saídas; recalculado pelo casamento de lotes
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        """ Helper para converter TradeFill em dicionário serializável. """
+        return {
+            'id': self.id,
+            'trade_id': self.trade_id,
+            'kind': self.kind,
+            'price': self.price,
+            'quantity': self.quantity,
+            'fee': self.fee,
+            'realized_pnl': self.realized_pnl,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+        }
+
+class TradeEvent(db.Model):
+    """ Log append-only do ciclo de vida dos trades, gravado na mesma transação da mudança. """
+    __table_args__ = (
+        db.Index('ix_trade_event_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True) # Sequência global (ordem de replay)
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), nullable=False)
+    trade_id = db.Column(db.String(50), nullable=False, index=True) # Sem FK: eventos sobrevivem ao delete
+    event_type = db.Column(db.String(20), nullable=False) # Ver TRADE_EVENT_TYPES
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    volume_delta = db.Column(FixedPoint(MONEY_SCALE), nullable=False, default=0.0) # Variação causada no total_volume
+    payload = db.Column(db.Text, nullable=True) # JSON do trade após o evento (None em 'deleted')
+
+class TradeSnapshot(db.Model):
+    """ Estado derivado (volume, estatísticas, rollups diários) após o evento last_event_id. """
+    __table_args__ = (
+        db.Index('ix_trade_snapshot_user_last_event', 'user_id', 'last_event_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), nullable=False)
+    last_event_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    state = db.Column(db.Text, nullable=False) # JSON de TradeLedgerState
+
+class Job(db.Model):
+    """ Job de recomputação pesada processado pelo 'flask worker' (fila local no próprio DB). """
+    __table_args__ = (
+        db.Index('ix_job_status_id', 'status', 'id'),
+        db.Index('ix_job_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(50), db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(50), nullable=False) # Ver JOB_HANDLERS
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued/running/done/failed
+    params = db.Column(db.Text, nullable=True) # JSON
+    checkpoint = db.Column(db.Text, nullable=True) # JSON: onde retomar se o worker cair
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.Text, nullable=True) # JSON
+    error = db.Column(db.Text, nullable=True)
+    worker_id = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        """ Helper para converter Job em dicionário serializável (progresso em %). """
+        percent = None
+        if self.status == 'done':
+            percent = 100.0
+        elif self.total:
+            percent = round(min(self.progress / self.total, 1.0) * 100, 1)
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'params': json.loads(self.params) if self.params else {},
+            'progress': self.progress,
+            'total': self.total,
+            'percent': percent,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
 # --- User Loader (Flask-Login) ---
 @login_manager.user_loader
 def load_user(user_id):
@@ -140,6 +571,10 @@ TIER_FEES_TAKER = {
 DEFAULT_TIER = '1'
 DEFAULT_MAKER_FEE_RATE = TIER_FEES_MAKER[DEFAULT_TIER]
 DEFAULT_TAKER_FEE_RATE = TIER_FEES_TAKER[DEFAULT_TIER]
+# Base da API da CoinMarketCap (o kit de carga em loadtest/ aponta para um servidor falso local)
+COINMARKETCAP_API_URL = os.environ.get('COINMARKETCAP_API_URL', 'https://pro-api.coinmarketcap.com')
+# Base da API pública da CoinGecko (listagem da página de Cryptomoedas, ver /api/markets)
+COINGECKO_API_URL = os.environ.get('COINGECKO_API_URL', 'https://api.coingecko.com/api/v3')
 # Mapeamento Símbolo -> ID API CoinGecko (Mantido para referência, mas usado ao contrário agora)
 symbol_to_id_map = {
     'btc': 'bitcoin', 'eth': 'ethereum', 'bnb': 'binancecoin', 'xrp': 'ripple',
@@ -155,30 +590,369 @@ symbol_to_id_map = {
 id_to_symbol_map = {v: k.upper() for k, v in symbol_to_id_map.items()} # Converte para MAIÚSCULAS
 
 # --- Helper Functions ---
-def get_total_volume_from_db():
-    """ Busca o valor de 'total_volume' do banco de dados (tabela ConfigValue). """
-    config = db.session.get(ConfigValue, 'total_volume')
+def user_config_key(name, user_id):
+    """ Monta a chave de ConfigValue de um valor por usuário (ex: 'total_volume:1'). """
+    return f"{name}:{user_id}"
+
+def get_total_volume_from_db(user_id):
+    """ Busca o 'total_volume' do usuário no banco de dados (tabela ConfigValue). """
+    config = db.session.get(ConfigValue, user_config_key('total_volume', user_id))
     if config and config.value:
         try:
             return float(config.value)
         except (ValueError, TypeError):
-            print(f"[WARN] Valor inválido para total_volume no DB: {config.value}")
+            print(f"[WARN] Valor inválido para total_volume do usuário {user_id} no DB: {config.value}")
             return 0.0
     # Se a chave não existe, inicializa no DB e retorna 0
-    print("[INFO] Chave 'total_volume' não encontrada no DB, inicializando com 0.0")
-    save_total_volume_to_db(0.0)
+    print(f"[INFO] Chave 'total_volume' do usuário {user_id} não encontrada no DB, inicializando com 0.0")
+    save_total_volume_to_db(user_id, 0.0)
     return 0.0
 
-def save_total_volume_to_db(volume):
-    """ Salva/Atualiza o valor de 'total_volume' no banco de dados (tabela ConfigValue). """
-    config = db.session.get(ConfigValue, 'total_volume')
+def save_total_volume_to_db(user_id, volume):
+    """ Salva/Atualiza o 'total_volume' do usuário no banco de dados (tabela ConfigValue). """
+    key = user_config_key('total_volume', user_id)
+    value = format(to_decimal(volume).normalize(), 'f') # Decimal exato: somas repetidas não acumulam erro
+    config = db.session.get(ConfigValue, key)
     if config:
-        config.value = str(volume)
+        config.value = value
     else:
-        config = ConfigValue(key='total_volume', value=str(volume))
+        config = ConfigValue(key=key, value=value)
         db.session.add(config)
     # O commit será feito pela função que chama esta helper
 
+# --- IDs de Trades (ULID) ---
+# 48 bits de tempo (ms) + 80 bits aleatórios em base32 Crockford (26 caracteres). A ordem das
+# strings é a ordem de criação, então a PK serve para range scans e paginação por keyset.
+# Cada worker gera IDs sem coordenação; no mesmo ms a parte aleatória é incrementada
+# (monotônico no processo). IDs antigos (timestamp em float, 'bp-<fill>') foram convertidos
+# pela migração e continuam resolvendo via TradeIdAlias.
+
+ULID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ULID_LENGTH = 26
+_ULID_CHARS = frozenset(ULID_ALPHABET)
+_ulid_lock = threading.Lock()
+_ulid_last = [0, 0] # (ms, parte aleatória) do último ID gerado neste processo
+
+if hasattr(os, 'register_at_fork'):
+    # Workers do gunicorn nascem por fork: cada um recomeça com aleatoriedade própria
+    os.register_at_fork(after_in_child=lambda: _ulid_last.__setitem__(slice(None), [0, 0]))
+
+def encode_ulid(timestamp_ms, randomness):
+    """ Codifica (ms, 80 bits) nos 26 caracteres do ULID. """
+    value = (timestamp_ms << 80) | randomness
+    chars = []
+    for _ in range(ULID_LENGTH):
+        chars.append(ULID_ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+def is_ulid(value):
+    return isinstance(value, str) and len(value) == ULID_LENGTH and _ULID_CHARS.issuperset(value)
+
+def new_trade_id():
+    """ ULID novo, sempre maior que o anterior gerado por este processo. """
+    timestamp_ms = int(time.time() * 1000)
+    with _ulid_lock:
+        last_ms, last_randomness = _ulid_last
+        if timestamp_ms <= last_ms: # Mesmo ms (ou relógio voltou): continua a sequência
+            timestamp_ms, randomness = last_ms, last_randomness + 1
+        else:
+            randomness = int.from_bytes(os.urandom(10), 'big')
+        _ulid_last[:] = [timestamp_ms, randomness]
+    return encode_ulid(timestamp_ms, randomness)
+
+def deterministic_trade_id(timestamp, seed):
+    """ ULID estável: tempo de 'timestamp' (datetime UTC) e parte aleatória derivada de 'seed'. """
+    timestamp_ms = round(timestamp.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    randomness = int.from_bytes(hashlib.sha256(seed.encode()).digest()[:10], 'big')
+    return encode_ulid(timestamp_ms, randomness)
+
+def synced_trade_id(fill_id, opened_at):
+    """ ID da posição aberta pelo fill da Backpack (o mesmo a cada sincronização). """
+    return deterministic_trade_id(opened_at, SYNCED_TRADE_PREFIX + fill_id)
+
+def resolve_trade_ids(user_id, trade_ids):
+    """ {ID recebido: ID atual}; IDs antigos são traduzidos pelo TradeIdAlias (um SELECT só). """
+    mapping = {trade_id: trade_id for trade_id in trade_ids}
+    legacy_ids = [trade_id for trade_id in mapping if not is_ulid(trade_id)]
+    if legacy_ids:
+        aliases = db.session.query(TradeIdAlias.legacy_id, TradeIdAlias.trade_id).filter(
+            TradeIdAlias.user_id == user_id, TradeIdAlias.legacy_id.in_(legacy_ids)
+        )
+        for legacy_id, trade_id in aliases:
+            mapping[legacy_id] = trade_id
+    return mapping
+
+@app.url_value_preprocessor
+def resolve_legacy_trade_id(endpoint, values):
+    """ Links/abas antigos com o ID antigo no path continuam funcionando. """
+    if values and 'trade_id' in values and not is_ulid(values['trade_id']) and current_user.is_authenticated:
+        values['trade_id'] = resolve_trade_ids(current_user.id, [values['trade_id']])[values['trade_id']]
+
+# --- Tabela de Taxas com Vigência (fee_schedule) ---
+# As taxas de cada TIER/lado ficam em FeeSchedule com data de vigência; um trade usa a taxa
+# vigente no momento da entrada (maker) e do fechamento (taker). A tabela é carregada num
+# índice em memória (datas ordenadas por TIER/lado, busca binária) e recarregada quando a
+# versão em ConfigValue muda — conferida no máximo a cada FEE_SCHEDULE_CHECK_SECONDS.
+# TIER_FEES_MAKER/TIER_FEES_TAKER continuam como fallback (TIER sem linhas ou antes da 1ª vigência).
+
+FEE_SIDES = ('maker', 'taker')
+FEE_SCHEDULE_VERSION_KEY = 'fee_schedule_version'
+FEE_SCHEDULE_CHECK_SECONDS = float(os.environ.get('FEE_SCHEDULE_CHECK_SECONDS', 5))
+
+class FeeScheduleIndex:
+    """ (tier, side) -> (datas de vigência ordenadas, taxas); rate_at é O(log n). """
+
+    def __init__(self, rows=(), version=None):
+        self.version = version
+        self.checked_at = time.monotonic()
+        intervals = {}
+        for tier, side, rate, effective_from in sorted(rows, key=lambda row: row[3]):
+            dates, rates = intervals.setdefault((str(tier), side), ([], []))
+            dates.append(effective_from)
+            rates.append(rate)
+        self.intervals = intervals
+
+    def rate_at(self, tier, side, at):
+        fallback = TIER_FEES_MAKER if side == 'maker' else TIER_FEES_TAKER
+        default = DEFAULT_MAKER_FEE_RATE if side == 'maker' else DEFAULT_TAKER_FEE_RATE
+        interval = self.intervals.get((str(tier), side))
+        if interval is not None:
+            position = bisect.bisect_right(interval[0], at or datetime.utcnow()) - 1
+            if position >= 0:
+                return interval[1][position]
+        return fallback.get(str(tier), default)
+
+    def next_change(self, tier, side, after):
+        """ Próxima vigência depois de 'after' (None se for a última) — fim do intervalo afetado. """
+        interval = self.intervals.get((str(tier), side))
+        if interval is None:
+            return None
+        position = bisect.bisect_right(interval[0], after)
+        return interval[0][position] if position < len(interval[0]) else None
+
+_fee_schedule_index = None
+
+def get_fee_schedule_version():
+    config = db.session.get(ConfigValue, FEE_SCHEDULE_VERSION_KEY)
+    return config.value if config else None
+
+def bump_fee_schedule_version():
+    """ Sinaliza mudança na tabela para todos os processos (o commit fica com quem chama). """
+    global _fee_schedule_index
+    config = db.session.get(ConfigValue, FEE_SCHEDULE_VERSION_KEY)
+    new_version = str(int(config.value or 0) + 1) if config else '1'
+    if config:
+        config.value = new_version
+    else:
+        db.session.add(ConfigValue(key=FEE_SCHEDULE_VERSION_KEY, value=new_version))
+    _fee_schedule_index = None # Este processo recarrega na próxima consulta
+    return new_version
+
+def get_fee_schedule():
+    """ Índice de taxas em memória, recarregado se a versão no DB mudou. """
+    global _fee_schedule_index
+    index = _fee_schedule_index
+    if index is not None and time.monotonic() - index.checked_at < FEE_SCHEDULE_CHECK_SECONDS:
+        return index
+    try:
+        version = get_fee_schedule_version()
+        if index is not None and index.version == version:
+            index.checked_at = time.monotonic()
+            return index
+        rows = db.session.query(
+            FeeSchedule.tier, FeeSchedule.side, FeeSchedule.rate, FeeSchedule.effective_from
+        ).all()
+        index = FeeScheduleIndex(rows, version)
+        print(f"[FEES] Tabela de taxas carregada (versão {version}, {len(rows)} vigências).")
+    except Exception as e:
+        # Tabela ainda não migrada: usa só as constantes
+        print(f"[FEES WARN] Não foi possível carregar fee_schedule, usando taxas fixas: {e}")
+        db.session.rollback()
+        index = FeeScheduleIndex()
+    _fee_schedule_index = index
+    return index
+
+def fee_rate(tier, side, at=None):
+    """ Taxa vigente do TIER/lado no instante 'at' (agora se None). """
+    return get_fee_schedule().rate_at(tier if tier is not None else DEFAULT_TIER, side, at)
+
+def fee_recalculable_filter():
+    """ Trades cuja taxa vem da tabela: exclui sincronizados (taxa da corretora) e com lotes (soma dos fills). """
+    return db.and_(
+        db.not_(db.exists().where(ExchangeFill.trade_id == Trade.id)),
+        db.not_(db.exists().where(TradeFill.trade_id == Trade.id)),
+    )
+
+def recompute_schedule_window_fees(tier, side, start, end=None, chunk_size=500):
+    """ Recalcula calculated_fee só dos trades afetados por uma vigência de tier/lado em [start, end).
+
+    maker depende do instante de entrada e taker do fechamento. Commit a cada bloco (keyset pela PK).
+    Retorna (trades_verificados, trades_alterados).
+    """
+    column = Trade.timestamp if side == 'maker' else Trade.closed_at_timestamp
+    tier_filter = Trade.tier == tier
+    if tier == DEFAULT_TIER:
+        tier_filter = db.or_(tier_filter, Trade.tier.is_(None))
+    query = Trade.query.filter(tier_filter, column >= start, fee_recalculable_filter())
+    if end is not None:
+        query = query.filter(column < end)
+    checked = changed = 0
+    last_id = ''
+    while True:
+        trades = query.filter(Trade.id > last_id).order_by(Trade.id).limit(chunk_size).all()
+        if not trades:
+            break
+        for trade in trades:
+            new_fee = calculate_trade_fee(trade_fee_inputs(trade))
+            if new_fee != trade.calculated_fee:
+                trade.calculated_fee = new_fee
+                record_trade_event(trade, 'edited')
+                changed += 1
+        checked += len(trades)
+        last_id = trades[-1].id
+        db.session.commit()
+    return checked, changed
+
+# --- Volume Móvel (30 dias) e TIER Automático ---
+# Os TIERs da Backpack são definidos pelo volume dos últimos 30 dias. Toda variação de
+# volume_contribution passa por adjust_user_volume, que atualiza o balde do dia de entrada
+# do trade (VolumeDaily) e o total_volume vitalício; a janela móvel soma no máximo N baldes.
+
+ROLLING_VOLUME_DAYS = 30
+# Volume mínimo em 30 dias (USD) para cada TIER; ajuste conforme a tabela vigente da corretora
+# (ou defina TIER_VOLUME_THRESHOLDS com um JSON {"TIER": volume}).
+TIER_VOLUME_THRESHOLDS = json.loads(os.environ['TIER_VOLUME_THRESHOLDS']) if os.environ.get('TIER_VOLUME_THRESHOLDS') else {
+    '1': 0, '2': 1_000_000, '3': 5_000_000, '4': 10_000_000, '5': 25_000_000, '6': 50_000_000,
+    'VIP1': 100_000_000, 'VIP2': 250_000_000, 'VIP3': 500_000_000, 'VIP4': 1_000_000_000,
+    'VIP5': 2_500_000_000,
+}
+_TIER_LADDER = sorted((volume, tier) for tier, volume in TIER_VOLUME_THRESHOLDS.items())
+_TIER_LADDER_VOLUMES = [volume for volume, _ in _TIER_LADDER]
+
+def volume_day(dt):
+    """ Dia (UTC) em que o volume de um trade é contabilizado: o da entrada. """
+    return (dt or datetime.utcnow()).date()
+
+def adjust_user_volume(user_id, moves):
+    """ Aplica variações de volume [(dia, delta), ...] nos baldes diários e no total_volume.
+
+    Um trade que muda de dia entra como (dia_antigo, -volume_antigo), (dia_novo, volume_novo).
+    Retorna a variação líquida. O commit fica com quem chama.
+    """
+    by_day = {}
+    for day, delta in moves:
+        if delta:
+            by_day[day] = by_day.get(day, Decimal(0)) + to_decimal(delta)
+    for day, delta in by_day.items():
+        if not delta:
+            continue
+        # Soma feita no banco (inteiros em micro-USD), sem ler o balde antes
+        updated = db.session.execute(
+            db.update(VolumeDaily)
+            .where(VolumeDaily.user_id == user_id, VolumeDaily.day == day)
+            .values(volume=VolumeDaily.volume + float(delta))
+        ).rowcount
+        if not updated:
+            db.session.add(VolumeDaily(user_id=user_id, day=day, volume=float(delta)))
+    net = sum(by_day.values(), Decimal(0))
+    if net:
+        save_total_volume_to_db(user_id, to_decimal(get_total_volume_from_db(user_id)) + net)
+    return float(net)
+
+def rebuild_volume_daily(user_id):
+    """ Recria os baldes diários do usuário a partir dos trades (um GROUP BY por tabela, quente e
+    arquivo). O commit fica com quem chama. """
+    volumes = {}
+    for model in trade_models_for_range(user_id):
+        day_column = func.date(model.timestamp)
+        rows = db.session.query(day_column, func.sum(model.volume_contribution)).filter(
+            model.user_id == user_id
+        ).group_by(day_column).all()
+        for day, volume in rows:
+            if day is not None:
+                day = day if isinstance(day, date) else date.fromisoformat(day)
+                volumes[day] = volumes.get(day, Decimal(0)) + to_decimal(volume or 0)
+    VolumeDaily.query.filter_by(user_id=user_id).delete()
+    buckets = [{'user_id': user_id, 'day': day, 'volume': float(volume)} for day, volume in volumes.items()]
+    if buckets:
+        db.session.execute(db.insert(VolumeDaily), buckets)
+    return len(buckets)
+
+def rolling_volume(user_id, days=ROLLING_VOLUME_DAYS, today=None):
+    """ Volume dos últimos 'days' dias (incluindo hoje, UTC). """
+    start = (today or datetime.utcnow().date()) - timedelta(days=days - 1)
+    total = db.session.query(func.sum(VolumeDaily.volume)).filter(
+        VolumeDaily.user_id == user_id, VolumeDaily.day >= start
+    ).scalar()
+    return total or 0.0
+
+def tier_for_volume(volume):
+    """ Maior TIER cujo volume mínimo foi atingido; retorna (tier, próximo_tier, volume_do_próximo). """
+    position = max(bisect.bisect_right(_TIER_LADDER_VOLUMES, volume) - 1, 0)
+    tier = _TIER_LADDER[position][1]
+    if position + 1 < len(_TIER_LADDER):
+        next_volume, next_tier = _TIER_LADDER[position + 1]
+        return tier, next_tier, next_volume
+    return tier, None, None
+
+def current_volume_tier(user_id):
+    """ TIER atual do usuário pelo volume móvel de 30 dias. """
+    return tier_for_volume(rolling_volume(user_id))[0]
+
+# --- Consultas por Usuário ---
+# Todas as consultas de Trade/Balance passam por aqui para sempre filtrar por user_id
+# e usar os índices compostos (user_id, timestamp), (user_id, symbol) e (user_id, closed_at_timestamp).
+
+def user_trades_query(user_id):
+    """ Query base de trades do usuário. """
+    return Trade.query.filter(Trade.user_id == user_id)
+
+def open_positions_query(user_id):
+    """ Posições abertas do usuário, mais recentes primeiro (índice user_id, timestamp). """
+    return user_trades_query(user_id).filter(
+        Trade.entry_price.isnot(None),
+        Trade.size.isnot(None),
+        Trade.size != 0,
+        Trade.exit_price.is_(None) # Verifica se exit_price é NULL
+    ).order_by(Trade.timestamp.desc())
+
+def closed_trades_query(user_id):
+    """ Trades fechados (histórico) do usuário, mais recentes primeiro. """
+    return user_trades_query(user_id).filter(
+        Trade.exit_price.isnot(None)
+    ).order_by(Trade.timestamp.desc())
+
+def closed_trades_page_query(user_id, limit, before=None):
+    """ Página do histórico por keyset na PK (ULID = ordem de criação), mais recentes primeiro. """
+    query = user_trades_query(user_id).filter(Trade.exit_price.isnot(None))
+    if before:
+        query = query.filter(Trade.id < before)
+    return query.order_by(Trade.id.desc()).limit(limit)
+
+def closed_between_filter(user_id, start, end, model=Trade):
+    """ Filtros para trades do usuário fechados em [start, end] (índice user_id, closed_at_timestamp). """
+    return (
+        model.user_id == user_id,
+        model.closed_at_timestamp >= start,
+        model.closed_at_timestamp <= end,
+    )
+
+def get_user_trade(user_id, trade_id):
+    """ Busca um trade pelo ID, retornando None se não existir ou pertencer a outro usuário. """
+    trade = db.session.get(Trade, trade_id)
+    if trade is None or trade.user_id != user_id:
+        return None
+    return trade
+
+def user_balances_query(user_id):
+    """ Query base de saldos spot do usuário. """
+    return Balance.query.filter(Balance.user_id == user_id)
+
+def user_balances_dict(user_id):
+    """ Retorna os saldos do usuário no formato {symbol: amount}. """
+    return {bal.symbol: bal.amount for bal in user_balances_query(user_id).all()}
+
 def is_today(dt_object):
     """Verifica se um objeto datetime representa a data de hoje."""
     if not isinstance(dt_object, datetime):
@@ -189,33 +963,484 @@ def is_today(dt_object):
         print(f"[is_today ERROR] Erro inesperado ao processar datetime {dt_object}: {e}")
         return False
 
+@functools.lru_cache(maxsize=8192)
+def _parse_iso_seconds(prefix):
+    """ 'YYYY-MM-DDTHH:MM:SS' -> datetime. Cacheado: o mesmo segundo se repete muito (fills, lotes). """
+    return datetime.fromisoformat(prefix)
+
 def parse_datetime_safe(timestamp_str):
     """ Converte string ISO para datetime UTC, retornando None em caso de erro. """
     if not timestamp_str or not isinstance(timestamp_str, str):
         return None
     try:
         # Remove 'Z' e outros offsets comuns para tratar como UTC
-        # Tenta lidar com precisão variável de frações de segundo
         if 'Z' in timestamp_str:
             ts = timestamp_str.replace('Z', '')
         elif '+' in timestamp_str:
-             ts = timestamp_str.split('+')[0]
+            ts = timestamp_str.split('+', 1)[0]
         else:
-             ts = timestamp_str
-        
-        if '.' in ts:
-             ts_main, ts_frac = ts.split('.', 1)
-             # Trunca fração para 6 dígitos (microsegundos)
-             ts_frac = ts_frac[:6]
-             ts = f"{ts_main}.{ts_frac}"
-             dt = datetime.strptime(ts, '%Y-%m-%dT%H:%M:%S.%f')
-        else:
-             dt = datetime.strptime(ts, '%Y-%m-%dT%H:%M:%S')
-        return dt # Retorna como UTC implícito
+            ts = timestamp_str
+
+        # Caminho rápido: prefixo até os segundos (cacheado) + fração truncada em microsegundos
+        if len(ts) == 19:
+            return _parse_iso_seconds(ts)
+        if len(ts) > 20 and ts[19] == '.' and ts[20:].isdigit():
+            return _parse_iso_seconds(ts[:19]).replace(microsecond=int(ts[20:26].ljust(6, '0')))
+        # Formatos menos comuns (só a data, separador ' ', offset '-03:00'): sempre devolvidos em UTC naive
+        dt = datetime.fromisoformat(ts)
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        return dt
     except (ValueError, TypeError) as e:
         print(f"[parse_datetime_safe WARN] Formato de timestamp inválido: {timestamp_str}, Erro: {e}")
         return None
 
+# --- Serialização de Trades por Colunas ---
+# Listas grandes (histórico/posições) são lidas como tuplas de colunas, sem hidratar objetos ORM.
+TRADE_FIELDS = (
+    'id', 'timestamp', 'closed_at_timestamp', 'symbol', 'side', 'size', 'entry_price',
+    'exit_price', 'pnl', 'take_profit', 'stop_loss', 'tier', 'calculated_fee', 'volume_contribution',
+)
+TRADE_COLUMNS = tuple(getattr(Trade, field) for field in TRADE_FIELDS)
+TRADES_PAGE_MAX = 1000 # Maior ?limit aceito em GET /api/trades
+
+def trade_rows(query):
+    """ Executa uma query de Trade projetando só as colunas serializadas (tuplas, sem ORM). """
+    return query.with_entities(*TRADE_COLUMNS).all()
+
+def serialize_trade_rows(rows):
+    """ Converte tuplas de TRADE_COLUMNS em dicts no formato de Trade.to_dict().
+
+    Com o provider orjson os datetimes vão direto para o encoder (mesmo formato de
+    isoformat()), então cada linha é só um zip; sem ele convertemos as duas datas aqui.
+    """
+    fields = TRADE_FIELDS
+    if isinstance(app.json, OrjsonJSONProvider):
+        return [dict(zip(fields, row)) for row in rows]
+    serialized = []
+    for row in rows:
+        item = dict(zip(fields, row))
+        if item['timestamp'] is not None:
+            item['timestamp'] = item['timestamp'].isoformat()
+        if item['closed_at_timestamp'] is not None:
+            item['closed_at_timestamp'] = item['closed_at_timestamp'].isoformat()
+        serialized.append(item)
+    return serialized
+
+def columnar_trade_payload(rows):
+    """ Layout colunar: um array por campo, montado transpondo as tuplas (sem dict por linha). """
+    columns = list(zip(*rows)) if rows else [()] * len(TRADE_FIELDS)
+    data = dict(zip(TRADE_FIELDS, columns))
+    if not isinstance(app.json, OrjsonJSONProvider):
+        for field in ('timestamp', 'closed_at_timestamp'):
+            data[field] = [value.isoformat() if value is not None else None for value in data[field]]
+    return {'layout': 'columnar', 'count': len(rows), 'fields': list(TRADE_FIELDS), 'columns': data}
+
+def columnar_trade_arrow(rows):
+    """ Serializa as linhas como Arrow IPC (stream). Retorna None se pyarrow não estiver instalado. """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+    columns = list(zip(*rows)) if rows else [()] * len(TRADE_FIELDS)
+    arrow_types = {'timestamp': pa.timestamp('us'), 'closed_at_timestamp': pa.timestamp('us'),
+                   'id': pa.string(), 'symbol': pa.string(), 'side': pa.string(), 'tier': pa.string()}
+    table = pa.table({
+        field: pa.array(column, type=arrow_types.get(field, pa.float64()))
+        for field, column in zip(TRADE_FIELDS, columns)
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def columnar_trades_response(rows):
+    """ Resposta de ?layout=columnar: JSON ou Arrow IPC com ?format=arrow (compressão fica no after_request). """
+    if request.args.get('format') == 'arrow':
+        body = columnar_trade_arrow(rows)
+        if body is None:
+            return jsonify({'error': "Formato 'arrow' indisponível (pyarrow não instalado)"}), 406
+        return app.response_class(body, mimetype='application/vnd.apache.arrow.stream')
+    return jsonify(columnar_trade_payload(rows))
+
+def trade_fee_inputs(trade):
+    """ Campos usados por calculate_trade_fee/calculate_volume_contribution (sem serializar o trade todo). """
+    return {
+        'tier': trade.tier if trade.tier is not None else DEFAULT_TIER,
+        'entry_price': trade.entry_price,
+        'exit_price': trade.exit_price,
+        'size': trade.size,
+        'timestamp': trade.timestamp,
+        'closed_at_timestamp': trade.closed_at_timestamp,
+    }
+
+# --- Arquivo Frio de Trades (hot/cold) ---
+# 'flask archive-trades' move trades fechados há mais de N dias para TradeArchive: a tabela
+# quente (posições, edição, sync, estatísticas do dia) fica só com o histórico recente. As
+# leituras de histórico só consultam o arquivo quando o intervalo pedido chega antes da marca
+# d'água do usuário. VolumeDaily, total_volume e o log de eventos não mudam com o arquivamento.
+
+ARCHIVE_MIN_AGE_DAYS = 1 # O dia corrente nunca é arquivado (PnL/taxas do dia leem só a tabela quente)
+ARCHIVE_COLUMNS = tuple(getattr(TradeArchive, field) for field in TRADE_FIELDS)
+
+def trade_archive_state(user_id):
+    """ Marca d'água do arquivo do usuário: {'before': datetime, 'max_id': str} ou None.
+
+    Todo trade arquivado fechou antes de 'before' e tem ID <= 'max_id'.
+    """
+    config = db.session.get(ConfigValue, user_config_key('trade_archive', user_id))
+    if not config or not config.value:
+        return None
+    state = json.loads(config.value)
+    return {'before': datetime.fromisoformat(state['before']), 'max_id': state['max_id']}
+
+def trade_models_for_range(user_id, start=None):
+    """ Tabelas com trades fechados a partir de 'start' (None = todo o histórico). """
+    state = trade_archive_state(user_id)
+    if state is None or (start is not None and start >= state['before']):
+        return (Trade,)
+    return (Trade, TradeArchive)
+
+def archived_trades_query(user_id):
+    """ Query base de trades arquivados do usuário. """
+    return TradeArchive.query.filter(TradeArchive.user_id == user_id)
+
+def closed_trade_rows(user_id):
+    """ Histórico completo (quente + arquivo) como tuplas de TRADE_COLUMNS, mais recentes primeiro. """
+    rows = trade_rows(closed_trades_query(user_id))
+    if TradeArchive not in trade_models_for_range(user_id):
+        return rows
+    archived = archived_trades_query(user_id).order_by(TradeArchive.timestamp.desc()).with_entities(*ARCHIVE_COLUMNS).all()
+    return list(heapq.merge(rows, archived, key=lambda row: row[1], reverse=True)) # row[1] = timestamp
+
+def closed_trade_page_rows(user_id, limit, before=None):
+    """ Página do histórico (keyset pela PK); o arquivo só é lido se puder ter IDs desta página. """
+    rows = trade_rows(closed_trades_page_query(user_id, limit, before))
+    state = trade_archive_state(user_id)
+    if state is None or (len(rows) == limit and rows[-1][0] > state['max_id']):
+        return rows
+    query = archived_trades_query(user_id)
+    if before:
+        query = query.filter(TradeArchive.id < before)
+    archived = query.order_by(TradeArchive.id.desc()).limit(limit).with_entities(*ARCHIVE_COLUMNS).all()
+    return list(heapq.merge(rows, archived, key=lambda row: row[0], reverse=True))[:limit]
+
+def sum_closed_between(user_id, field, start, end):
+    """ SUM de um campo dos trades fechados em [start, end], incluindo o arquivo só se o intervalo pedir. """
+    total = 0.0
+    for model in trade_models_for_range(user_id, start):
+        column = getattr(model, field)
+        total += db.session.query(func.sum(column)).filter(
+            *closed_between_filter(user_id, start, end, model), column.isnot(None)
+        ).scalar() or 0.0
+    return total
+
+def archive_closed_trades(user_id, cutoff, batch_size=1000):
+    """ Move os trades do usuário fechados antes de 'cutoff' para TradeArchive, em lotes pela PK.
+
+    Cada lote (INSERT ... SELECT, DELETE e marca d'água) é uma transação. Retorna quantos foram movidos.
+    """
+    key = user_config_key('trade_archive', user_id)
+    moved = 0
+    while True:
+        ids = [trade_id for (trade_id,) in db.session.query(Trade.id).filter(
+            Trade.user_id == user_id,
+            Trade.exit_price.isnot(None),
+            Trade.closed_at_timestamp < cutoff,
+        ).order_by(Trade.id).limit(batch_size)]
+        if not ids:
+            break
+        db.session.execute(db.insert(TradeArchive).from_select(
+            ['user_id', *TRADE_FIELDS, 'archived_at'],
+            db.select(Trade.user_id, *TRADE_COLUMNS, sa.literal(datetime.utcnow(), sa.DateTime)).where(Trade.id.in_(ids))
+        ))
+        db.session.execute(db.delete(Trade).where(Trade.id.in_(ids)))
+        # Os espelhos offline (/api/sync) ficam só com a parte quente; o dashboard pagina o
+        # restante do histórico de GET /api/trades (quente + arquivo) a partir do mais antigo espelhado
+        record_sync_changes(user_id, 'trade', ids, op='delete')
+
+        state = trade_archive_state(user_id) or {'before': cutoff, 'max_id': ''}
+        value = json.dumps({'before': max(state['before'], cutoff).isoformat(), 'max_id': max(state['max_id'], ids[-1])})
+        config = db.session.get(ConfigValue, key)
+        if config:
+            config.value = value
+        else:
+            db.session.add(ConfigValue(key=key, value=value))
+        db.session.commit()
+        moved += len(ids)
+        print(f"[ARCHIVE TRADES] Usuário {user_id}: +{len(ids)} trades arquivados (total {moved})")
+    return moved
+
+# --- Export de Trades Fechados (GET /api/trades/export, streaming) ---
+# Histórico inteiro (arquivo frio + quente, cada um na ordem da PK/ULID) em CSV ou NDJSON, lido
+# em blocos e enviado conforme sai do banco: memória constante seja qual for o tamanho. O modo
+# ASGI (asgi.py) serve a mesma rota com driver async usando estas mesmas funções.
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_BATCH_ROWS = 1000
+
+def export_trades_statements(user_id):
+    """ SELECTs (arquivo, depois quente) das colunas de TRADE_FIELDS dos trades fechados do usuário. """
+    return [
+        db.select(*(getattr(model, field) for field in TRADE_FIELDS))
+        .where(model.user_id == user_id, model.exit_price.isnot(None))
+        .order_by(model.id)
+        for model in (TradeArchive, Trade)
+    ]
+
+def export_header(fmt):
+    return ','.join(TRADE_FIELDS) + '\r\n' if fmt == 'csv' else ''
+
+def format_export_rows(rows, fmt):
+    """ Um bloco de linhas (tuplas de TRADE_FIELDS) como texto do export. """
+    if fmt == 'ndjson':
+        # Uma linha por trade: json padrão (o provider do app pode indentar em debug), datas em isoformat()
+        return ''.join(json.dumps(dict(zip(TRADE_FIELDS, row)), default=datetime.isoformat) + '\n' for row in rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if value is None else value.isoformat() if isinstance(value, datetime) else value for value in row])
+    return buffer.getvalue()
+
+def export_trades_chunks(user_id, fmt):
+    """ Gera o export em pedaços de EXPORT_BATCH_ROWS linhas (yield_per: sem carregar tudo). """
+    yield export_header(fmt)
+    for statement in export_trades_statements(user_id):
+        result = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        for rows in result.partitions():
+            yield format_export_rows(rows, fmt)
+
+# --- Snapshot Colunar de Trades Fechados (memmap) ---
+# Um arquivo binário por coluna em instance/analytics/<user>/g<geração>/, lido com np.memmap:
+# as rotas de análise não hidratam ORM nem montam DataFrame, e todos os workers do gunicorn
+# compartilham as mesmas páginas do page cache. meta.json (trocado atomicamente) diz a
+# geração, quantas linhas valem e até qual SyncChange o snapshot está atualizado. Trades que
+# fecham depois são anexados; edição/remoção de um trade já no snapshot gera nova geração.
+
+ANALYTICS_DIR = os.environ.get('ANALYTICS_SNAPSHOT_DIR') or os.path.join(app.instance_path, 'analytics')
+SNAPSHOT_COLUMNS = {
+    'id': 'S26', # ULID
+    'timestamp': '<i8', # ms
+    'closed_at': '<i8', # ms (-1 se o trade antigo não tem closed_at_timestamp)
+    'symbol': '<i4', # Índice em meta['symbols']
+    'pnl': '<f8', # NaN = sem PnL
+    'calculated_fee': '<f8',
+    'volume_contribution': '<f8',
+}
+
+try:
+    import fcntl # Trava entre processos (gunicorn); sem ela (Windows) só há a trava por processo
+except ImportError:
+    fcntl = None
+_snapshot_locks = {}
+_snapshot_locks_guard = threading.Lock()
+
+def _snapshot_user_dir(user_id):
+    return os.path.join(ANALYTICS_DIR, str(user_id))
+
+def read_snapshot_meta(user_id):
+    """ meta.json do snapshot do usuário, ou None se ainda não existe. """
+    try:
+        with open(os.path.join(_snapshot_user_dir(user_id), 'meta.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _write_snapshot_meta(user_id, meta):
+    path = os.path.join(_snapshot_user_dir(user_id), 'meta.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.tmp', path) # Leitores veem o meta antigo ou o novo, nunca metade
+
+@contextlib.contextmanager
+def _snapshot_lock(user_id):
+    with _snapshot_locks_guard:
+        lock = _snapshot_locks.setdefault(user_id, threading.Lock())
+    with lock:
+        os.makedirs(_snapshot_user_dir(user_id), exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(_snapshot_user_dir(user_id), 'lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _snapshot_columns(meta, rows):
+    """ Tuplas de TRADE_COLUMNS -> arrays no layout do snapshot (meta['symbols'] cresce se preciso). """
+    codes = {symbol: code for code, symbol in enumerate(meta['symbols'])}
+    symbol_codes = []
+    for row in rows:
+        symbol = row[3] or '-'
+        if symbol not in codes:
+            codes[symbol] = len(meta['symbols'])
+            meta['symbols'].append(symbol)
+        symbol_codes.append(codes[symbol])
+    as_float = lambda value: np.nan if value is None else value
+    return {
+        'id': np.array([row[0] for row in rows], dtype=SNAPSHOT_COLUMNS['id']),
+        'timestamp': np.array([_epoch_ms(row[1]) for row in rows], dtype=SNAPSHOT_COLUMNS['timestamp']),
+        'closed_at': np.array([_epoch_ms(row[2]) if row[2] else -1 for row in rows], dtype=SNAPSHOT_COLUMNS['closed_at']),
+        'symbol': np.array(symbol_codes, dtype=SNAPSHOT_COLUMNS['symbol']),
+        'pnl': np.array([as_float(row[8]) for row in rows], dtype=SNAPSHOT_COLUMNS['pnl']),
+        'calculated_fee': np.array([as_float(row[12]) for row in rows], dtype=SNAPSHOT_COLUMNS['calculated_fee']),
+        'volume_contribution': np.array([as_float(row[13]) for row in rows], dtype=SNAPSHOT_COLUMNS['volume_contribution']),
+    }
+
+def _append_snapshot_rows(user_id, meta, rows):
+    """ Anexa linhas à geração atual; arquivos maiores que meta['count'] (escrita interrompida) são cortados antes. """
+    generation_dir = os.path.join(_snapshot_user_dir(user_id), f"g{meta['generation']}")
+    columns = _snapshot_columns(meta, rows)
+    for name, dtype in SNAPSHOT_COLUMNS.items():
+        with open(os.path.join(generation_dir, f'{name}.bin'), 'a+b') as f:
+            f.truncate(meta['count'] * np.dtype(dtype).itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(columns[name].tobytes())
+    meta['count'] += len(rows)
+
+def _rebuild_snapshot(user_id, meta, version):
+    """ Nova geração com todos os trades fechados (quente + arquivo); a anterior é apagada depois da troca. """
+    previous = meta['generation'] if meta else None
+    meta = {'generation': (previous or 0) + 1, 'count': 0, 'version': version, 'symbols': []}
+    generation_dir = os.path.join(_snapshot_user_dir(user_id), f"g{meta['generation']}")
+    shutil.rmtree(generation_dir, ignore_errors=True)
+    os.makedirs(generation_dir)
+    _append_snapshot_rows(user_id, meta, closed_trade_rows(user_id))
+    _write_snapshot_meta(user_id, meta)
+    if previous is not None:
+        # Quem já mapeou os arquivos antigos continua lendo (o inode só some ao desmapear)
+        shutil.rmtree(os.path.join(_snapshot_user_dir(user_id), f'g{previous}'), ignore_errors=True)
+    return meta
+
+def _closed_rows_by_id(user_id, ids):
+    """ Estado atual (quente ou arquivo) dos trades fechados entre 'ids': {id: tupla de TRADE_COLUMNS}. """
+    rows = {}
+    for start in range(0, len(ids), 500): # IN em blocos
+        chunk = ids[start:start + 500]
+        for row in trade_rows(user_trades_query(user_id).filter(Trade.id.in_(chunk), Trade.exit_price.isnot(None))):
+            rows[row[0]] = row
+        for row in archived_trades_query(user_id).filter(TradeArchive.id.in_(chunk)).with_entities(*ARCHIVE_COLUMNS):
+            rows[row[0]] = row
+    return rows
+
+def _snapshot_row_matches(meta, snapshot, position, row):
+    """ A linha 'position' do snapshot tem os valores atuais do trade? (mudança já refletida/relida) """
+    expected = _snapshot_columns({'symbols': list(meta['symbols'])}, [row])
+    return all(
+        np.array_equal(expected[name], snapshot[name][position:position + 1], equal_nan=dtype.endswith('f8'))
+        for name, dtype in SNAPSHOT_COLUMNS.items()
+    )
+
+def refresh_analytics_snapshot(user_id, rebuild=False):
+    """ Atualiza o snapshot até a última mudança de trades do usuário e retorna o meta.
+
+    Trades novos no histórico são anexados. Um trade já no snapshot que mudou (editado, reaberto,
+    deletado) força uma geração nova. Mudanças dentro de SYNC_SETTLE_SECONDS são relidas no
+    próximo refresh (commits fora de ordem), como em sync_delta.
+    """
+    latest = db.session.query(func.max(SyncChange.id)).filter(
+        SyncChange.user_id == user_id, SyncChange.entity == 'trade'
+    ).scalar() or 0
+    meta = read_snapshot_meta(user_id)
+    if meta and not rebuild and meta['version'] >= latest:
+        return meta
+    with _snapshot_lock(user_id):
+        meta = read_snapshot_meta(user_id) # Outro processo pode ter atualizado enquanto esperávamos
+        if meta is None or rebuild:
+            return _rebuild_snapshot(user_id, meta, latest)
+        changes = db.session.query(SyncChange.id, SyncChange.entity_key, SyncChange.created_at).filter(
+            SyncChange.user_id == user_id, SyncChange.entity == 'trade', SyncChange.id > meta['version']
+        ).order_by(SyncChange.id).all()
+        if not changes:
+            return meta
+        changed_ids = sorted({trade_id for _, trade_id, _ in changes})
+        current = _closed_rows_by_id(user_id, changed_ids)
+        snapshot = load_analytics_snapshot(user_id, meta=meta)
+        snapshot_ids = snapshot['id']
+        appended = []
+        for trade_id in changed_ids:
+            positions = np.flatnonzero(snapshot_ids == trade_id.encode())
+            row = current.get(trade_id)
+            if len(positions) == 0:
+                if row is not None:
+                    appended.append(row)
+                continue
+            if row is None or not _snapshot_row_matches(meta, snapshot, positions[0], row):
+                return _rebuild_snapshot(user_id, meta, latest)
+        settle_cutoff = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+        recent_ids = [change_id for change_id, _, created_at in changes if created_at > settle_cutoff]
+        if appended:
+            _append_snapshot_rows(user_id, meta, sorted(appended, key=lambda row: row[0]))
+        meta['version'] = max(meta['version'], min(recent_ids) - 1) if recent_ids else changes[-1][0]
+        _write_snapshot_meta(user_id, meta)
+        return meta
+
+def load_analytics_snapshot(user_id, meta=None):
+    """ Colunas do snapshot como np.memmap somente leitura (zero-cópia) + 'symbols' e 'count'.
+
+    Sem 'meta' o snapshot é atualizado antes (no máximo um SELECT quando já está em dia).
+    """
+    for _ in range(3):
+        meta = meta or refresh_analytics_snapshot(user_id)
+        generation_dir = os.path.join(_snapshot_user_dir(user_id), f"g{meta['generation']}")
+        try:
+            columns = {
+                name: np.memmap(os.path.join(generation_dir, f'{name}.bin'), dtype=dtype, mode='r', shape=(meta['count'],))
+                if meta['count'] else np.empty(0, dtype=dtype)
+                for name, dtype in SNAPSHOT_COLUMNS.items()
+            }
+        except FileNotFoundError:
+            meta = None # Geração trocada entre ler o meta e abrir os arquivos: relê
+            continue
+        columns['symbols'] = meta['symbols']
+        columns['count'] = meta['count']
+        return columns
+    raise RuntimeError(f"snapshot analítico do usuário {user_id} indisponível")
+
+def trade_statistics(user_id):
+    """ Estatísticas vitalícias (formato de /api/statistics): fechados do snapshot + abertos do banco. """
+    snapshot = load_analytics_snapshot(user_id)
+    symbols = list(snapshot['symbols'])
+    codes = {symbol: code for code, symbol in enumerate(symbols)}
+    open_rows = user_trades_query(user_id).filter(Trade.exit_price.is_(None)).with_entities(Trade.symbol, Trade.pnl).all()
+    for symbol, _ in open_rows:
+        codes.setdefault(symbol or '-', len(codes))
+    symbols = sorted(codes, key=codes.get)
+
+    pnl = np.concatenate((np.nan_to_num(snapshot['pnl']), [pnl or 0.0 for _, pnl in open_rows]))
+    symbol_codes = np.concatenate((snapshot['symbol'], [codes[symbol or '-'] for symbol, _ in open_rows])).astype(np.int64)
+    if len(pnl) == 0:
+        return {
+            'total_pnl': 0.0, 'best_trade': {'pnl': 0.0, 'symbol': '-'}, 'worst_trade': {'pnl': 0.0, 'symbol': '-'},
+            'best_symbol_pnl': 0.0, 'worst_symbol_pnl': 0.0, 'best_symbol': '-', 'worst_symbol': '-',
+            'total_trades': 0, 'symbol_pnl': {}, 'total_fees': 0.0,
+            'winning_trades_count': 0, 'losing_trades_count': 0
+        }
+
+    best, worst = int(np.argmax(pnl)), int(np.argmin(pnl))
+    per_symbol = np.bincount(symbol_codes, weights=pnl, minlength=len(symbols))
+    present = np.bincount(symbol_codes, minlength=len(symbols)) > 0
+    symbol_pnl = {symbols[code]: float(per_symbol[code]) for code in np.flatnonzero(present)}
+    ordered = sorted(symbol_pnl.items()) # Mesmo desempate do groupby (ordem alfabética)
+    best_symbol, best_symbol_pnl = max(ordered, key=lambda item: item[1])
+    worst_symbol, worst_symbol_pnl = min(ordered, key=lambda item: item[1])
+    return {
+        'total_pnl': round(float(pnl.sum()), 2),
+        'best_trade': {'pnl': round(float(pnl[best]), 2), 'symbol': symbols[symbol_codes[best]]},
+        'worst_trade': {'pnl': round(float(pnl[worst]), 2), 'symbol': symbols[symbol_codes[worst]]},
+        'best_symbol_pnl': round(best_symbol_pnl, 2),
+        'worst_symbol_pnl': round(worst_symbol_pnl, 2),
+        'best_symbol': best_symbol if best_symbol_pnl != 0 else '-',
+        'worst_symbol': worst_symbol if worst_symbol_pnl != 0 else '-',
+        'total_trades': len(pnl),
+        'symbol_pnl': {symbol: round(value, 2) for symbol, value in ordered},
+        'total_fees': round(float(np.nan_to_num(snapshot['calculated_fee']).sum()), 2), # Somente fechados
+        'winning_trades_count': int((pnl > 0).sum()),
+        'losing_trades_count': int((pnl < 0).sum()),
+    }
+
 # --- Funções de Cálculo (Reutilizadas/Adaptadas) ---
 
 def calculate_trade_fee(trade_data):
@@ -228,8 +1453,10 @@ def calculate_trade_fee(trade_data):
     calculated_trade_fee = 0.0
     try:
         selected_tier = str(trade_data.get('tier', DEFAULT_TIER))
-        maker_fee_rate = TIER_FEES_MAKER.get(selected_tier, DEFAULT_MAKER_FEE_RATE)
-        taker_fee_rate = TIER_FEES_TAKER.get(selected_tier, DEFAULT_TAKER_FEE_RATE)
+        # Taxas vigentes na entrada e no fechamento (agora, para trades novos/abertos)
+        fee_schedule = get_fee_schedule()
+        maker_fee_rate = fee_schedule.rate_at(selected_tier, 'maker', trade_data.get('timestamp'))
+        taker_fee_rate = fee_schedule.rate_at(selected_tier, 'taker', trade_data.get('closed_at_timestamp'))
 
         # Tenta converter para float, retorna 0.0 em erro
         def safe_float(value, default=None):
@@ -258,7 +1485,7 @@ def calculate_trade_fee(trade_data):
             exit_value = abs(exit_price * size)
             calculated_trade_fee += exit_value * taker_fee_rate
 
-        return round(calculated_trade_fee, 4)
+        return money(calculated_trade_fee)
 
     except Exception as e:
         print(f"[Fee Calculation ERROR] Erro ao calcular taxa: {e}")
@@ -289,7 +1516,7 @@ def calculate_volume_contribution(trade_data):
 
         if entry_price is not None and size is not None:
             volume_contribution = abs(entry_price * size * 2)
-            return round(volume_contribution, 4)
+            return money(volume_contribution)
         else:
             print("[Volume Calc WARN] Entry price ou size inválido/ausente para cálculo.")
             return 0.0
@@ -299,6 +1526,2300 @@ def calculate_volume_contribution(trade_data):
         traceback.print_exc()
         return 0.0
 
+# --- Log de Eventos de Trades (append-only) + Snapshot/Replay ---
+# Toda mutação de Trade grava um TradeEvent na mesma transação. O replay reconstrói
+# total_volume, estatísticas e rollups diários partindo do último snapshot salvo.
+
+TRADE_EVENT_TYPES = ('created', 'edited', 'closed', 'reopened', 'deleted', 'trigger_closed')
+SNAPSHOT_EVERY_EVENTS = 500 # Grava um snapshot a cada N eventos aplicados no replay
+REPLAY_CHUNK_SIZE = 1000
+
+def trade_event_values(user_id, trade_dict, event_type, volume_delta=0.0):
+    """ Colunas de um TradeEvent a partir do trade já serializado (formato de Trade.to_dict()). """
+    if event_type not in TRADE_EVENT_TYPES:
+        raise ValueError(f"Tipo de evento inválido: {event_type}")
+    return {
+        'user_id': user_id,
+        'trade_id': trade_dict['id'],
+        'event_type': event_type,
+        'volume_delta': volume_delta or 0.0,
+        'payload': None if event_type == 'deleted' else json.dumps(trade_dict),
+    }
+
+def record_trade_event(trade, event_type, volume_delta=0.0):
+    """ Adiciona um evento à sessão atual (commitado junto com a mudança do trade). """
+    trade_dict = {'id': trade.id} if event_type == 'deleted' else trade.to_dict()
+    event = TradeEvent(**trade_event_values(trade.user_id, trade_dict, event_type, volume_delta))
+    db.session.add(event)
+    return event
+
+class TradeLedgerState:
+    """ Estado derivado do log de eventos, atualizado incrementalmente evento a evento. """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.last_event_id = data.get('last_event_id', 0)
+        self.total_volume = data.get('total_volume', 0.0)
+        # Por trade só guardamos o necessário para desfazer sua contribuição
+        self.trades = data.get('trades', {})
+        self.total_pnl = data.get('total_pnl', 0.0)
+        self.total_fees = data.get('total_fees', 0.0) # Somente trades fechados
+        self.winning_trades_count = data.get('winning_trades_count', 0)
+        self.losing_trades_count = data.get('losing_trades_count', 0)
+        self.symbol_pnl = data.get('symbol_pnl', {})
+        self.symbol_trades = data.get('symbol_trades', {}) # Nº de trades vivos por símbolo
+        self.daily = data.get('daily', {}) # {data_iso: {'pnl': x, 'fees': y, 'trades': n}}
+
+    def to_dict(self):
+        return {
+            'last_event_id': self.last_event_id, 'total_volume': self.total_volume,
+            'trades': self.trades, 'total_pnl': self.total_pnl, 'total_fees': self.total_fees,
+            'winning_trades_count': self.winning_trades_count,
+            'losing_trades_count': self.losing_trades_count,
+            'symbol_pnl': self.symbol_pnl, 'symbol_trades': self.symbol_trades, 'daily': self.daily,
+        }
+
+    def _contribute(self, trade, sign):
+        pnl = trade['pnl'] or 0.0
+        fee = trade['fee'] or 0.0
+        self.total_pnl += sign * pnl
+        symbol = trade['symbol']
+        self.symbol_pnl[symbol] = self.symbol_pnl.get(symbol, 0.0) + sign * pnl
+        self.symbol_trades[symbol] = self.symbol_trades.get(symbol, 0) + sign
+        if self.symbol_trades[symbol] == 0: # Último trade do símbolo removido
+            del self.symbol_trades[symbol]
+            del self.symbol_pnl[symbol]
+        if pnl > 0:
+            self.winning_trades_count += sign
+        elif pnl < 0:
+            self.losing_trades_count += sign
+        if trade['closed']:
+            self.total_fees += sign * fee
+        # Rollup diário segue get_daily_pnl_history: fechado, com PnL e taxa
+        if trade['closed_at'] and trade['pnl'] is not None and trade['fee'] is not None:
+            day_key = trade['closed_at'][:10]
+            day = self.daily.setdefault(day_key, {'pnl': 0.0, 'fees': 0.0, 'trades': 0})
+            day['pnl'] += sign * trade['pnl']
+            day['fees'] += sign * trade['fee']
+            day['trades'] += sign
+            if day['trades'] == 0:
+                del self.daily[day_key]
+
+    def apply(self, event_id, trade_id, volume_delta, payload):
+        """ Aplica um evento: remove a contribuição antiga do trade e soma a nova. """
+        previous = self.trades.pop(trade_id, None)
+        if previous is not None:
+            self._contribute(previous, -1)
+        if payload is not None:
+            data = json.loads(payload) if isinstance(payload, str) else payload
+            current = {
+                'symbol': data.get('symbol') or '-',
+                'pnl': data.get('pnl'),
+                'fee': data.get('calculated_fee'),
+                'closed': data.get('exit_price') is not None,
+                'closed_at': data.get('closed_at_timestamp'),
+            }
+            self.trades[trade_id] = current
+            self._contribute(current, 1)
+        self.total_volume += volume_delta or 0.0
+        self.last_event_id = event_id
+
+    def to_statistics(self):
+        """ Estatísticas no mesmo formato de /api/statistics. """
+        if not self.trades:
+            best_trade = worst_trade = {'pnl': 0.0, 'symbol': '-'}
+        else:
+            best = max(self.trades.values(), key=lambda t: t['pnl'] or 0.0)
+            worst = min(self.trades.values(), key=lambda t: t['pnl'] or 0.0)
+            best_trade = {'pnl': round(best['pnl'] or 0.0, 2), 'symbol': best['symbol']}
+            worst_trade = {'pnl': round(worst['pnl'] or 0.0, 2), 'symbol': worst['symbol']}
+        symbol_pnl = self.symbol_pnl
+        best_symbol = max(symbol_pnl, key=symbol_pnl.get) if symbol_pnl else '-'
+        worst_symbol = min(symbol_pnl, key=symbol_pnl.get) if symbol_pnl else '-'
+        best_symbol_pnl = symbol_pnl[best_symbol] if symbol_pnl else 0.0
+        worst_symbol_pnl = symbol_pnl[worst_symbol] if symbol_pnl else 0.0
+        return {
+            'total_pnl': round(self.total_pnl, 2),
+            'best_trade': best_trade,
+            'worst_trade': worst_trade,
+            'best_symbol_pnl': round(best_symbol_pnl, 2),
+            'worst_symbol_pnl': round(worst_symbol_pnl, 2),
+            'best_symbol': best_symbol if best_symbol_pnl != 0 else '-',
+            'worst_symbol': worst_symbol if worst_symbol_pnl != 0 else '-',
+            'total_trades': len(self.trades),
+            'symbol_pnl': {symbol: round(pnl, 2) for symbol, pnl in symbol_pnl.items()},
+            'total_fees': round(self.total_fees, 2),
+            'winning_trades_count': self.winning_trades_count,
+            'losing_trades_count': self.losing_trades_count,
+        }
+
+    def to_daily_history(self):
+        """ Histórico de PnL líquido diário no mesmo formato de /api/daily_pnl_history. """
+        return [
+            {'date': day, 'net_pnl': round(values['pnl'] - values['fees'], 2)}
+            for day, values in sorted(self.daily.items(), reverse=True)
+        ]
+
+def latest_trade_snapshot(user_id, up_to_event_id=None):
+    """ Snapshot mais recente do usuário (opcionalmente até um evento específico). """
+    query = TradeSnapshot.query.filter(TradeSnapshot.user_id == user_id)
+    if up_to_event_id is not None:
+        query = query.filter(TradeSnapshot.last_event_id <= up_to_event_id)
+    return query.order_by(TradeSnapshot.last_event_id.desc()).first()
+
+def replay_trade_events(user_id, from_scratch=False, save_snapshots=True, max_events=None):
+    """ Reconstrói o estado derivado do usuário a partir do último snapshot + eventos seguintes.
+
+    Eventos são lidos em blocos pela PK (índice user_id, id). Com save_snapshots, grava um
+    snapshot a cada SNAPSHOT_EVERY_EVENTS eventos e um ao final, para o próximo replay partir dali.
+    max_events limita quantos eventos são aplicados nesta chamada (replay em etapas).
+    Retorna (state, eventos_aplicados).
+    """
+    snapshot = None if from_scratch else latest_trade_snapshot(user_id)
+    state = TradeLedgerState(json.loads(snapshot.state) if snapshot else None)
+    applied = 0
+    since_snapshot = 0
+    while max_events is None or applied < max_events:
+        chunk_size = REPLAY_CHUNK_SIZE if max_events is None else min(REPLAY_CHUNK_SIZE, max_events - applied)
+        chunk = db.session.query(
+            TradeEvent.id, TradeEvent.trade_id, TradeEvent.volume_delta, TradeEvent.payload
+        ).filter(
+            TradeEvent.user_id == user_id,
+            TradeEvent.id > state.last_event_id,
+        ).order_by(TradeEvent.id).limit(chunk_size).all()
+        if not chunk:
+            break
+        for event_id, trade_id, volume_delta, payload in chunk:
+            state.apply(event_id, trade_id, volume_delta, payload)
+            applied += 1
+            since_snapshot += 1
+            if save_snapshots and since_snapshot >= SNAPSHOT_EVERY_EVENTS:
+                save_trade_snapshot(user_id, state)
+                since_snapshot = 0
+    if save_snapshots and since_snapshot:
+        save_trade_snapshot(user_id, state)
+    return state, applied
+
+def save_trade_snapshot(user_id, state):
+    """ Adiciona um snapshot do estado à sessão (o commit fica com quem chama). """
+    db.session.add(TradeSnapshot(
+        user_id=user_id,
+        last_event_id=state.last_event_id,
+        state=json.dumps(state.to_dict()),
+    ))
+
+# --- Sincronização de Fills da Backpack (flask sync-fills) ---
+# Fills são buscados a partir de uma marca d'água (high-water mark) salva em ConfigValue,
+# gravados em ExchangeFill (únicos por fill_id, então reexecutar é idempotente) e
+# agregados em posições (Trade) por mercado: a posição abre quando o saldo líquido sai
+# de zero e fecha quando volta a zero (preço médio de custo para o PnL realizado).
+
+BACKPACK_API_URL = os.environ.get('BACKPACK_API_URL', 'https://api.backpack.exchange')
+FILLS_PAGE_LIMIT = 1000 # Máximo aceito pela API da Backpack
+SYNCED_TRADE_PREFIX = 'bp-' # Semente dos IDs de trades criados pela sincronização (e prefixo dos IDs antigos)
+QTY_EPSILON = 1e-12
+
+class BackpackFillSource:
+    """ Busca o histórico de fills da conta na API da Backpack (requests assinados com ED25519). """
+
+    def __init__(self, api_key, api_secret, base_url=BACKPACK_API_URL, window_ms=5000):
+        try:
+            from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+        except ImportError:
+            raise click.ClickException("Pacote 'cryptography' é necessário para assinar requests da Backpack.")
+        import base64
+        self._b64encode = base64.b64encode
+        self._private_key = Ed25519PrivateKey.from_private_bytes(base64.b64decode(api_secret))
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.window_ms = window_ms
+        self.http = requests.Session()
+
+    def _signed_headers(self, instruction, params):
+        timestamp_ms = int(datetime.utcnow().timestamp() * 1000)
+        query = '&'.join(f"{k}={params[k]}" for k in sorted(params))
+        message = f"instruction={instruction}&{query}&timestamp={timestamp_ms}&window={self.window_ms}"
+        signature = self._private_key.sign(message.encode())
+        return {
+            'X-API-Key': self.api_key,
+            'X-Signature': self._b64encode(signature).decode(),
+            'X-Timestamp': str(timestamp_ms),
+            'X-Window': str(self.window_ms),
+        }
+
+    def fetch_page(self, from_ms, offset, limit=FILLS_PAGE_LIMIT):
+        """ Retorna uma página de fills (ordem crescente) com timestamp >= from_ms. """
+        params = {'from': from_ms, 'limit': limit, 'offset': offset, 'sortDirection': 'Asc'}
+        response = self.http.get(
+            f"{self.base_url}/wapi/v1/history/fills",
+            params=params,
+            headers=self._signed_headers('fillHistoryQueryAll', params),
+            timeout=15,
+        )
+        response.raise_for_status()
+        return response.json()
+
+class FixtureFillSource:
+    """ Substituto local da API: lê fills gravados de um arquivo JSON (mesmo formato da Backpack). """
+
+    def __init__(self, path):
+        with open(path) as f:
+            fills = json.load(f)
+        self.fills = sorted(fills, key=lambda fill: (fill_timestamp_ms(fill), str(fill['tradeId'])))
+
+    def fetch_page(self, from_ms, offset, limit=FILLS_PAGE_LIMIT):
+        matching = [fill for fill in self.fills if fill_timestamp_ms(fill) >= from_ms]
+        return matching[offset:offset + limit]
+
+def fill_timestamp_ms(fill):
+    """ Timestamp (ms) de um fill da Backpack; aceita string ISO ou número em ms. """
+    value = fill.get('timestamp')
+    if isinstance(value, (int, float)):
+        return int(value)
+    dt = parse_datetime_safe(value)
+    return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000) if dt else 0
+
+def market_base_symbol(market):
+    """ 'SOL_USDC_PERP' -> 'SOL' """
+    return (market or 'UNKNOWN').split('_')[0].upper()
+
+def fill_fee_usd(fill, price, quantity):
+    """ Converte a taxa do fill para USD (a Backpack cobra em USDC ou no ativo base). """
+    fee = float(fill.get('fee') or 0.0)
+    fee_symbol = (fill.get('feeSymbol') or 'USDC').upper()
+    if fee_symbol in ('USDC', 'USDT', 'USD'):
+        return fee
+    if fee_symbol == market_base_symbol(fill.get('symbol')):
+        return fee * price
+    print(f"[SYNC FILLS WARN] Taxa em {fee_symbol} não convertida (fill {fill.get('tradeId')}).")
+    return fee
+
+def net_fills_into_positions(fills):
+    """ Agrega fills (em ordem cronológica) de um mercado em posições.
+
+    Cada fill é um dict com fill_id, side (Bid/Ask), price, qty, fee e timestamp.
+    Retorna (positions, allocations): posições na ordem em que abriram e, por fill_id,
+    a tupla (position_id, quantidade alocada) da última posição tocada pelo fill.
+    """
+    positions = []
+    allocations = {}
+    current = None
+    for fill in fills:
+        direction = 1 if fill['side'] == 'Bid' else -1
+        remaining = fill['qty']
+        fee_per_unit = fill['fee'] / fill['qty'] if fill['qty'] else 0.0
+        while remaining > QTY_EPSILON:
+            if current is None:
+                current = {
+                    'id': synced_trade_id(fill['fill_id'], fill['timestamp']), 'direction': direction,
+                    'opened_at': fill['timestamp'], 'closed_at': None,
+                    'open_qty': 0.0, 'cost': 0.0, 'entry_qty': 0.0, 'entry_notional': 0.0,
+                    'exit_qty': 0.0, 'exit_notional': 0.0, 'realized': 0.0, 'fee': 0.0,
+                }
+                positions.append(current)
+            if direction == current['direction']:
+                traded = remaining # Aumenta a posição
+                current['open_qty'] += traded
+                current['cost'] += traded * fill['price']
+                current['entry_qty'] += traded
+                current['entry_notional'] += traded * fill['price']
+            else:
+                traded = min(remaining, current['open_qty']) # Reduz/fecha a posição
+                avg_cost = current['cost'] / current['open_qty']
+                current['realized'] += (fill['price'] - avg_cost) * traded * current['direction']
+                current['cost'] -= avg_cost * traded
+                current['open_qty'] -= traded
+                current['exit_qty'] += traded
+                current['exit_notional'] += traded * fill['price']
+            current['fee'] += fee_per_unit * traded
+            allocations[fill['fill_id']] = (current['id'], traded)
+            remaining -= traded
+            if current['open_qty'] <= QTY_EPSILON:
+                current['closed_at'] = fill['timestamp']
+                current = None
+    return positions, allocations
+
+def position_to_trade_fields(position):
+    """ Converte uma posição agregada nos campos do modelo Trade. """
+    is_closed = position['closed_at'] is not None
+    if is_closed:
+        size = position['entry_qty']
+        entry_price = position['entry_notional'] / position['entry_qty']
+        exit_price = position['exit_notional'] / position['exit_qty']
+    else:
+        size = position['open_qty']
+        entry_price = position['cost'] / position['open_qty']
+        exit_price = None
+    return {
+        'side': 'long' if position['direction'] > 0 else 'short',
+        'size': quantize(size, QUANTITY_SCALE),
+        'entry_price': quantize(entry_price, PRICE_SCALE),
+        'exit_price': quantize(exit_price, PRICE_SCALE),
+        # PnL realizado (parcial enquanto aberta); None se nada foi realizado ainda
+        'pnl': money(position['realized']) if position['exit_qty'] > 0 else None,
+        'timestamp': position['opened_at'],
+        'closed_at_timestamp': position['closed_at'],
+        'calculated_fee': money(position['fee']),
+        'volume_contribution': money(abs(position['entry_notional']) * 2),
+    }
+
+def _insert_new_fills(user_id, page):
+    """ Grava os fills ainda não importados da página. Retorna os mercados tocados. """
+    page_ids = [str(fill['tradeId']) for fill in page]
+    existing_ids = {
+        row.fill_id for row in db.session.query(ExchangeFill.fill_id).filter(
+            ExchangeFill.user_id == user_id, ExchangeFill.fill_id.in_(page_ids)
+        )
+    }
+    new_rows = []
+    for fill in page:
+        fill_id = str(fill['tradeId'])
+        if fill_id in existing_ids:
+            continue
+        existing_ids.add(fill_id) # Protege contra duplicatas dentro da própria página
+        price = float(fill['price'])
+        quantity = float(fill['quantity'])
+        new_rows.append({
+            'user_id': user_id,
+            'fill_id': fill_id,
+            'order_id': str(fill.get('orderId')) if fill.get('orderId') is not None else None,
+            'market': fill['symbol'],
+            'side': fill['side'],
+            'price': price,
+            'quantity': quantity,
+            'fee': fill_fee_usd(fill, price, quantity),
+            'is_maker': fill.get('isMaker'),
+            'timestamp': datetime.utcfromtimestamp(fill_timestamp_ms(fill) / 1000),
+        })
+    if new_rows:
+        db.session.execute(db.insert(ExchangeFill), new_rows)
+    return {row['market'] for row in new_rows}, len(new_rows)
+
+def _rebuild_open_market_positions(user_id, market):
+    """ Reagrega os fills ainda não fechados de um mercado e faz upsert dos Trades resultantes.
+
+    Só a posição aberta (se houver) e os fills novos são reprocessados; posições já fechadas
+    nunca são tocadas. Retorna as variações de volume [(dia, delta), ...] para adjust_user_volume.
+    """
+    last_allocated = ExchangeFill.query.filter(
+        ExchangeFill.user_id == user_id,
+        ExchangeFill.market == market,
+        ExchangeFill.trade_id.isnot(None),
+    ).order_by(ExchangeFill.timestamp.desc(), ExchangeFill.id.desc()).first()
+    open_trade_id = None
+    if last_allocated is not None:
+        last_trade = db.session.get(Trade, last_allocated.trade_id)
+        if last_trade is not None and last_trade.exit_price is None:
+            open_trade_id = last_trade.id
+
+    pending_filter = ExchangeFill.trade_id.is_(None)
+    if open_trade_id:
+        pending_filter = db.or_(pending_filter, ExchangeFill.trade_id == open_trade_id)
+    pending_fills = ExchangeFill.query.filter(
+        ExchangeFill.user_id == user_id, ExchangeFill.market == market, pending_filter
+    ).order_by(ExchangeFill.timestamp, ExchangeFill.id).all()
+    if not pending_fills:
+        return []
+
+    fill_rows = {fill.fill_id: fill for fill in pending_fills}
+    netting_input = []
+    for fill in pending_fills:
+        # Fills já alocados à posição aberta entram só com a parte alocada a ela
+        qty = fill.allocated_qty if fill.trade_id and fill.allocated_qty is not None else fill.quantity
+        fee = (fill.fee or 0.0) * (qty / fill.quantity if fill.quantity else 0.0)
+        netting_input.append({
+            'fill_id': fill.fill_id, 'side': fill.side, 'price': fill.price,
+            'qty': qty, 'fee': fee, 'timestamp': fill.timestamp,
+        })
+    positions, allocations = net_fills_into_positions(netting_input)
+    if open_trade_id and positions and positions[0]['id'] != open_trade_id:
+        # Mantém o ID da posição aberta existente (a primeira posição reagregada é ela)
+        renamed_id = positions[0]['id']
+        positions[0]['id'] = open_trade_id
+        allocations = {
+            fill_id: (open_trade_id if position_id == renamed_id else position_id, qty)
+            for fill_id, (position_id, qty) in allocations.items()
+        }
+
+    existing_trades = {
+        trade.id: trade for trade in Trade.query.filter(Trade.id.in_([p['id'] for p in positions]))
+    }
+    volume_moves = []
+    symbol = market_base_symbol(market)
+    for position in positions:
+        fields = position_to_trade_fields(position)
+        trade = existing_trades.get(position['id'])
+        if trade is None:
+            trade = Trade(id=position['id'], user_id=user_id, symbol=symbol, tier=DEFAULT_TIER)
+            db.session.add(trade)
+            old_volume = 0.0
+            event_type = 'created'
+        else:
+            old_volume = trade.volume_contribution or 0.0
+            volume_moves.append((volume_day(trade.timestamp), -old_volume))
+            was_open = trade.exit_price is None
+            event_type = 'closed' if was_open and fields['exit_price'] is not None else 'edited'
+        for field, value in fields.items():
+            setattr(trade, field, value)
+        trade_volume_diff = fields['volume_contribution'] - old_volume
+        volume_moves.append((volume_day(trade.timestamp), fields['volume_contribution']))
+        record_trade_event(trade, event_type, volume_delta=trade_volume_diff)
+    db.session.flush() # Garante que os Trades existam antes de apontar os fills para eles
+
+    for fill_id, (position_id, qty) in allocations.items():
+        fill = fill_rows[fill_id]
+        fill.trade_id = position_id
+        fill.allocated_qty = qty
+    return volume_moves
+
+def sync_fills(user_id, source, batch_size=500, reset_cursor=False):
+    """ Importa fills a partir da marca d'água do usuário, em lotes, commitando a cada lote.
+
+    A marca d'água (timestamp em ms do último fill importado) é salva em ConfigValue na mesma
+    transação dos dados, então uma interrupção no meio nunca pula nem duplica fills.
+    """
+    cursor_key = user_config_key('fills_cursor', user_id)
+    cursor = db.session.get(ConfigValue, cursor_key)
+    if cursor is None:
+        cursor = ConfigValue(key=cursor_key, value='0')
+        db.session.add(cursor)
+    if reset_cursor:
+        cursor.value = '0'
+    high_water_mark = int(cursor.value or 0)
+    page_limit = min(batch_size, FILLS_PAGE_LIMIT)
+
+    offset = 0
+    totals = {'fetched': 0, 'inserted': 0, 'batches': 0}
+    while True:
+        page = source.fetch_page(high_water_mark, offset, page_limit)
+        if not page:
+            break
+        totals['fetched'] += len(page)
+        touched_markets, inserted = _insert_new_fills(user_id, page)
+        totals['inserted'] += inserted
+
+        volume_moves = []
+        for market in sorted(touched_markets):
+            volume_moves.extend(_rebuild_open_market_positions(user_id, market))
+        adjust_user_volume(user_id, volume_moves)
+
+        # A próxima página parte do último timestamp visto (fills repetidos são ignorados)
+        last_ms = max(fill_timestamp_ms(fill) for fill in page)
+        if last_ms > high_water_mark:
+            high_water_mark = last_ms
+            offset = sum(1 for fill in page if fill_timestamp_ms(fill) == last_ms)
+        else:
+            offset += len(page)
+        cursor.value = str(high_water_mark)
+        db.session.commit()
+        totals['batches'] += 1
+        print(f"[SYNC FILLS] Lote {totals['batches']}: {len(page)} fills ({inserted} novos), cursor={high_water_mark}")
+        if len(page) < page_limit:
+            break
+    totals['cursor'] = high_water_mark
+    return totals
+
+# --- Lotes de Trades Manuais (FIFO / preço médio) ---
+# Um Trade pode ter vários TradeFill: entradas (aumentos de posição) e saídas parciais.
+# As saídas casam com os lotes de entrada em aberto (FIFO por padrão ou preço médio) e o
+# resultado é agregado nos campos do próprio Trade, então as rotas existentes não mudam.
+
+LOT_MATCHING_METHOD = os.environ.get('LOT_MATCHING_METHOD', 'fifo') # fifo ou average
+FILL_KINDS = ('entry', 'exit')
+
+class LotBook:
+    """ Lotes em aberto de uma posição. add/reduce são O(1) amortizado: cada lote entra
+    uma vez no deque e sai uma vez pela frente quando é totalmente consumido. """
+
+    def __init__(self, direction, method='fifo'):
+        if method not in ('fifo', 'average'):
+            raise ValueError(f"Método de casamento inválido: {method}")
+        self.direction = direction # 1 = long, -1 = short
+        self.method = method
+        self.lots = deque() # [quantidade, preço]
+        self.open_qty = 0.0
+        self.cost = 0.0
+
+    def add(self, quantity, price):
+        if self.method == 'average' and self.lots:
+            # Preço médio: um único lote com o custo médio ponderado
+            lot = self.lots[0]
+            lot[1] = (lot[0] * lot[1] + quantity * price) / (lot[0] + quantity)
+            lot[0] += quantity
+        else:
+            self.lots.append([quantity, price])
+        self.open_qty += quantity
+        self.cost += quantity * price
+
+    def reduce(self, quantity, price):
+        """ Consome lotes da frente; retorna o PnL realizado. Levanta ValueError se exceder a posição. """
+        if quantity > self.open_qty + QTY_EPSILON:
+            raise ValueError(f"saída de {quantity} maior que a posição aberta ({round(self.open_qty, 8)})")
+        remaining = min(quantity, self.open_qty)
+        matched_cost = 0.0
+        while remaining > QTY_EPSILON:
+            lot = self.lots[0]
+            taken = min(remaining, lot[0])
+            matched_cost += taken * lot[1]
+            lot[0] -= taken
+            remaining -= taken
+            if lot[0] <= QTY_EPSILON:
+                self.lots.popleft()
+        matched_qty = min(quantity, self.open_qty)
+        self.open_qty -= matched_qty
+        self.cost -= matched_cost
+        if self.open_qty <= QTY_EPSILON:
+            self.open_qty, self.cost = 0.0, 0.0
+            self.lots.clear()
+        return (matched_qty * price - matched_cost) * self.direction
+
+    def open_lots(self):
+        return [{'quantity': quantize(qty, QUANTITY_SCALE), 'price': price} for qty, price in self.lots]
+
+def trade_fills_query(trade_id):
+    """ Fills do trade em ordem cronológica (índice trade_id, timestamp, id). """
+    return TradeFill.query.filter_by(trade_id=trade_id).order_by(TradeFill.timestamp, TradeFill.id)
+
+def default_fill_fee(tier, kind, price, quantity, at=None):
+    """ Taxa do fill pela tabela do TIER vigente em 'at': entrada maker, saída taker (mesma regra de calculate_trade_fee). """
+    rate = fee_rate(tier, 'maker' if kind == 'entry' else 'taker', at)
+    return money(abs(price * quantity) * rate)
+
+def seed_trade_fills(trade):
+    """ Converte um trade sem fills (tudo-ou-nada) em lotes equivalentes: uma entrada e, se fechado, uma saída. """
+    if trade.entry_price is None or not trade.size:
+        raise ValueError("trade sem entry_price/size não pode receber fills")
+    fills = [TradeFill(
+        user_id=trade.user_id, trade_id=trade.id, kind='entry', price=trade.entry_price,
+        quantity=trade.size, timestamp=trade.timestamp or datetime.utcnow(),
+        fee=default_fill_fee(trade.tier, 'entry', trade.entry_price, trade.size, trade.timestamp),
+    )]
+    if trade.exit_price is not None:
+        fills.append(TradeFill(
+            user_id=trade.user_id, trade_id=trade.id, kind='exit', price=trade.exit_price,
+            quantity=trade.size, timestamp=trade.closed_at_timestamp or datetime.utcnow(),
+            fee=default_fill_fee(trade.tier, 'exit', trade.exit_price, trade.size, trade.closed_at_timestamp),
+        ))
+    db.session.add_all(fills)
+    return fills
+
+def rollup_trade_fills(trade, fills, method=None):
+    """ Casa os fills (em ordem cronológica) e grava o agregado nos campos do Trade.
+
+    Atualiza realized_pnl de cada saída. Retorna (volume_diff, book) — book com os lotes
+    que continuam abertos. Levanta ValueError se uma saída exceder a posição ou houver
+    fills depois de a posição ter sido zerada.
+    """
+    book = LotBook(-1 if trade.side == 'short' else 1, method or LOT_MATCHING_METHOD)
+    position = {
+        'direction': book.direction, 'opened_at': fills[0].timestamp if fills else trade.timestamp,
+        'closed_at': None, 'open_qty': 0.0, 'cost': 0.0, 'entry_qty': 0.0, 'entry_notional': 0.0,
+        'exit_qty': 0.0, 'exit_notional': 0.0, 'realized': 0.0, 'fee': 0.0,
+    }
+    for fill in fills:
+        if position['closed_at'] is not None:
+            raise ValueError(f"posição já zerada em {position['closed_at'].isoformat()}")
+        if fill.kind == 'entry':
+            book.add(fill.quantity, fill.price)
+            position['entry_qty'] += fill.quantity
+            position['entry_notional'] += fill.quantity * fill.price
+        else:
+            fill.realized_pnl = money(book.reduce(fill.quantity, fill.price))
+            position['realized'] += fill.realized_pnl
+            position['exit_qty'] += fill.quantity
+            position['exit_notional'] += fill.quantity * fill.price
+            if book.open_qty <= QTY_EPSILON:
+                position['closed_at'] = fill.timestamp
+        position['fee'] += fill.fee or 0.0
+    if position['entry_qty'] <= QTY_EPSILON:
+        raise ValueError("o trade precisa de ao menos um fill de entrada")
+    position['open_qty'], position['cost'] = book.open_qty, book.cost
+
+    old_volume = trade.volume_contribution or 0.0
+    fields = position_to_trade_fields(position)
+    fields.pop('side') # O lado é do trade; os fills só têm entry/exit
+    for field, value in fields.items():
+        setattr(trade, field, value)
+    return fields['volume_contribution'] - old_volume, book
+
+def close_trade_fills(trade, exit_price, at=None):
+    """ Fecha um trade com fills: adiciona uma saída da quantidade ainda aberta em exit_price.
+
+    Usado pelo fechamento por TP/SL (POST trigger_close e PATCH), que não pode sobrescrever
+    os campos agregados dos lotes. Ajusta o volume do usuário e retorna o volume_diff.
+    """
+    at = at or datetime.utcnow()
+    old_volume = trade.volume_contribution or 0.0
+    fills = trade_fills_query(trade.id).all()
+    _, book = rollup_trade_fills(trade, fills)
+    if book.open_qty > QTY_EPSILON:
+        fill = TradeFill(
+            user_id=trade.user_id, trade_id=trade.id, kind='exit', price=exit_price,
+            quantity=quantize(book.open_qty, QUANTITY_SCALE), timestamp=at,
+            fee=default_fill_fee(trade.tier, 'exit', exit_price, book.open_qty, at),
+        )
+        db.session.add(fill)
+        db.session.flush() # ID desempata com fills do mesmo timestamp
+        rollup_trade_fills(trade, sorted(fills + [fill], key=lambda f: (f.timestamp, f.id)))
+    volume_diff = (trade.volume_contribution or 0.0) - old_volume
+    adjust_user_volume(trade.user_id, [(volume_day(trade.timestamp), volume_diff)])
+    return volume_diff
+
+# --- Delta Sync (/api/sync) ---
+# Toda alteração de Trade/Balance/ConfigValue por usuário gera um SyncChange no mesmo flush
+# (listener before_flush); operações em lote que não passam pelo ORM chamam
+# record_sync_changes. O dashboard guarda uma cópia em IndexedDB e pede só o que mudou
+# depois da última versão vista.
+
+SYNC_PAGE_LIMIT = 5000
+SYNC_SETTLE_SECONDS = 5 # Mudanças mais novas que isso são reenviadas no próximo sync (commits fora de ordem)
+SYNCED_CONFIG_NAMES = ('total_volume',)
+
+def sync_change_target(obj):
+    """ (user_id, entity, entity_key) de um objeto sincronizado, ou None. """
+    if isinstance(obj, Trade):
+        return obj.user_id, 'trade', obj.id
+    if isinstance(obj, Balance):
+        return obj.user_id, 'balance', obj.symbol
+    if isinstance(obj, ConfigValue):
+        name, _, user_id = (obj.key or '').rpartition(':')
+        if name in SYNCED_CONFIG_NAMES and user_id:
+            return user_id, 'config', name
+    return None
+
+@sa.event.listens_for(RoutingSession, 'before_flush')
+def _record_flush_sync_changes(db_session, flush_context, instances):
+    changes = {}
+    for obj in db_session.new:
+        target = sync_change_target(obj)
+        if target:
+            changes[target] = 'upsert'
+    for obj in db_session.dirty:
+        target = sync_change_target(obj)
+        if target and db_session.is_modified(obj, include_collections=False):
+            changes[target] = 'upsert'
+    for obj in db_session.deleted:
+        target = sync_change_target(obj)
+        if target:
+            changes[target] = 'delete'
+    for (user_id, entity, entity_key), op in changes.items():
+        db_session.add(SyncChange(user_id=user_id, entity=entity, entity_key=entity_key, op=op))
+
+def record_sync_changes(user_id, entity, keys, op='upsert'):
+    """ Registra mudanças feitas por UPDATE/DELETE em lote (fora do ORM). O commit fica com quem chama. """
+    rows = [{'user_id': user_id, 'entity': entity, 'entity_key': key, 'op': op} for key in keys]
+    if rows:
+        db.session.execute(db.insert(SyncChange), rows)
+        if entity == 'config':
+            mark_result_cache_tags(user_id, *(f'config:{key}' for key in keys))
+        else:
+            mark_result_cache_tags(user_id, f'{entity}s') # 'trades' / 'balances'
+
+def sync_delta(user_id, since, limit=SYNC_PAGE_LIMIT):
+    """ Estado atual de tudo que mudou depois de 'since' (só a última mudança de cada registro). """
+    latest_version = db.session.query(func.max(SyncChange.id)).filter(SyncChange.user_id == user_id).scalar() or 0
+    reset = since > latest_version # Versão do cliente não existe aqui (ex: banco recriado)
+    if reset:
+        since = 0
+    rows = db.session.query(
+        SyncChange.id, SyncChange.entity, SyncChange.entity_key, SyncChange.op, SyncChange.created_at
+    ).filter(
+        SyncChange.user_id == user_id, SyncChange.id > since
+    ).order_by(SyncChange.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    version = rows[-1][0] if rows else since
+    if not has_more:
+        # Um ID menor pode ser commitado depois de um maior; a versão devolvida fica antes das
+        # mudanças recentes para que o próximo sync as releia (reaplicar é idempotente)
+        settle_cutoff = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+        recent_ids = [row[0] for row in rows if row[4] > settle_cutoff]
+        if recent_ids:
+            version = max(since, min(recent_ids) - 1)
+    latest = {}
+    for _, entity, entity_key, op, _ in rows:
+        latest[(entity, entity_key)] = op # Mais recente vence
+    keys = {'trade': set(), 'balance': set(), 'config': set()}
+    deleted = {'trade': [], 'balance': [], 'config': []}
+    for (entity, entity_key), op in latest.items():
+        if op == 'delete':
+            deleted[entity].append(entity_key)
+        else:
+            keys[entity].add(entity_key)
+
+    trades = []
+    trade_keys = sorted(keys['trade'])
+    for start in range(0, len(trade_keys), 500): # IN em blocos
+        chunk = trade_keys[start:start + 500]
+        trades.extend(trade_rows(user_trades_query(user_id).filter(Trade.id.in_(chunk))))
+    deleted['trade'].extend(keys['trade'] - {row[0] for row in trades})
+
+    balances = {}
+    if keys['balance']:
+        balances = {
+            balance.symbol: balance.amount
+            for balance in user_balances_query(user_id).filter(Balance.symbol.in_(keys['balance']))
+        }
+    deleted['balance'].extend(keys['balance'] - set(balances))
+
+    config = {}
+    for name in keys['config']:
+        value = db.session.get(ConfigValue, user_config_key(name, user_id))
+        config[name] = value.value if value else None
+
+    return {
+        'version': version,
+        'since': since,
+        'reset': reset,
+        'has_more': has_more,
+        'trades': serialize_trade_rows(trades),
+        'trades_deleted': deleted['trade'],
+        'balances': balances,
+        'balances_deleted': deleted['balance'],
+        'config': config,
+    }
+
+# --- Mutação de Trades em Lote (PATCH /api/trades) ---
+# Fecha/edita várias posições numa transação: um SELECT das linhas, cálculo em Python,
+# UPDATE em lote pela PK, INSERT em lote dos eventos e um único ajuste de total_volume.
+
+BATCH_MAX_ITEMS = 500
+BATCH_ACTIONS = ('update', 'close', 'trigger_close')
+BATCH_NUMERIC_FIELDS = ('pnl', 'entry_price', 'exit_price', 'size', 'take_profit', 'stop_loss')
+
+def parse_optional_float(value):
+    """ float(value), ou None para vazio/NaN. Levanta ValueError para valores inválidos. """
+    if value is None or value == '':
+        return None
+    try:
+        float_value = float(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"valor numérico inválido: {value}")
+    return None if math.isnan(float_value) else float_value
+
+def trade_dict_isoformat(trade_dict):
+    """ Cópia do dict de trade com as datas em ISO (formato de Trade.to_dict()). """
+    item = dict(trade_dict)
+    for field in ('timestamp', 'closed_at_timestamp'):
+        if isinstance(item[field], datetime):
+            item[field] = item[field].isoformat()
+    return item
+
+def compute_close_pnl(trade_dict, exit_price):
+    """ PnL realizado ao fechar em exit_price (mesma regra do fechamento por TP/SL). """
+    entry_price, size, side = trade_dict['entry_price'], trade_dict['size'], trade_dict['side']
+    if entry_price is None or size is None or side is None:
+        return None
+    price_diff = exit_price - entry_price
+    return money(price_diff * size if side == 'long' else -price_diff * size)
+
+def batch_exit_price(trade_dict, item, mark_price, mark_prices):
+    """ Preço de saída de um item close/trigger_close: o do item ou o mark_price do símbolo. """
+    exit_price = parse_optional_float(item.get('exit_price'))
+    if exit_price is None:
+        exit_price = mark_prices.get((trade_dict['symbol'] or '').upper(), mark_price)
+    if exit_price is None:
+        raise ValueError("exit_price ausente e sem mark_price para o símbolo")
+    return exit_price
+
+def apply_batch_item(trade_dict, item, mark_price, mark_prices, now):
+    """ Aplica uma alteração do lote sobre o dict do trade (in place).
+
+    Retorna (event_type, volume_diff) ou None se nada mudou; levanta ValueError se o item é inválido.
+    """
+    action = item.get('action', 'update')
+    if action not in BATCH_ACTIONS:
+        raise ValueError(f"ação inválida: {action}")
+    was_open = trade_dict['exit_price'] is None
+    old_volume = trade_dict['volume_contribution'] or 0.0
+
+    if action == 'update':
+        if 'symbol' in item:
+            trade_dict['symbol'] = str(item['symbol']).upper()
+        if 'side' in item:
+            trade_dict['side'] = item['side']
+        typed = {field: parse_optional_float(item[field]) for field in BATCH_NUMERIC_FIELDS if field in item}
+        trade_dict.update(quantize_trade_values(trade_dict['symbol'], typed))
+    else:
+        if not was_open:
+            return None # Já fechado: nada a fazer (mesmo comportamento do trigger_close)
+        exit_price = batch_exit_price(trade_dict, item, mark_price, mark_prices)
+        trade_dict['exit_price'] = quantize(exit_price, symbol_precision(trade_dict['symbol'], 'price'))
+        pnl = parse_optional_float(item.get('pnl'))
+        trade_dict['pnl'] = pnl if pnl is not None else compute_close_pnl(trade_dict, exit_price)
+        if action == 'trigger_close':
+            trade_dict['take_profit'] = None
+            trade_dict['stop_loss'] = None
+
+    is_closing_now = was_open and trade_dict['exit_price'] is not None
+    is_reopening_now = not was_open and trade_dict['exit_price'] is None
+    if is_closing_now:
+        trade_dict['closed_at_timestamp'] = now
+    elif is_reopening_now:
+        trade_dict['closed_at_timestamp'] = None
+        trade_dict['pnl'] = None
+
+    fee_inputs = {
+        'tier': trade_dict['tier'] if trade_dict['tier'] is not None else DEFAULT_TIER,
+        'entry_price': trade_dict['entry_price'],
+        'exit_price': trade_dict['exit_price'],
+        'size': trade_dict['size'],
+        'timestamp': trade_dict['timestamp'],
+        'closed_at_timestamp': trade_dict['closed_at_timestamp'],
+    }
+    trade_dict['calculated_fee'] = calculate_trade_fee(fee_inputs)
+    new_volume = calculate_volume_contribution(fee_inputs) or 0.0
+    volume_diff = new_volume - old_volume
+    trade_dict['volume_contribution'] = new_volume
+
+    if action == 'trigger_close':
+        event_type = 'trigger_closed'
+    else:
+        event_type = 'closed' if is_closing_now else 'reopened' if is_reopening_now else 'edited'
+    return event_type, volume_diff
+
+# --- Fila de Jobs em Background (flask worker) ---
+# Recomputações que varrem todo o histórico rodam fora das requests: a API só enfileira
+# (tabela Job) e o 'flask worker' processa em blocos, salvando checkpoint e progresso a cada
+# bloco. Um job de worker que morreu (heartbeat velho) volta para a fila e retoma do checkpoint.
+
+JOB_CHUNK_SIZE = int(os.environ.get('JOB_CHUNK_SIZE', 500))
+JOB_MAX_CONCURRENT = int(os.environ.get('JOB_MAX_CONCURRENT', 2)) # Jobs rodando ao mesmo tempo (todos os workers)
+JOB_CLAIM_LOCK_KEY = 0x6a6f6273 # Advisory lock (Postgres) que serializa claim_next_job entre workers
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 300))
+
+def _job_recalculate_fees(job, params, checkpoint):
+    """ Recalcula calculated_fee dos trades do usuário com taxa da tabela (keyset pela PK). """
+    last_id = checkpoint.get('last_id', '')
+    changed = checkpoint.get('changed', 0)
+    # Sincronizados (taxa da corretora) e com lotes (soma dos fills) ficam de fora já na query do bloco
+    trades = user_trades_query(job.user_id).filter(Trade.id > last_id, fee_recalculable_filter()).order_by(Trade.id).limit(JOB_CHUNK_SIZE).all()
+    for trade in trades:
+        new_fee = calculate_trade_fee(trade_fee_inputs(trade))
+        if new_fee != trade.calculated_fee:
+            trade.calculated_fee = new_fee
+            record_trade_event(trade, 'edited')
+            changed += 1
+    done = len(trades) < JOB_CHUNK_SIZE
+    new_checkpoint = {'last_id': trades[-1].id if trades else last_id, 'changed': changed}
+    return new_checkpoint, len(trades), ({'trades_changed': changed} if done else None)
+
+def _job_reconcile_volume(job, params, checkpoint):
+    """ Soma volume_contribution em blocos e, ao final, corrige o total_volume armazenado. """
+    last_id = checkpoint.get('last_id', '')
+    computed = to_decimal(checkpoint.get('computed', 0)) # Decimal exato (string no checkpoint)
+    rows = user_trades_query(job.user_id).filter(Trade.id > last_id).order_by(Trade.id).with_entities(
+        Trade.id, Trade.volume_contribution
+    ).limit(JOB_CHUNK_SIZE).all()
+    computed += sum((to_decimal(volume) for _, volume in rows if volume), Decimal(0))
+    new_checkpoint = {'last_id': rows[-1].id if rows else last_id, 'computed': str(computed)}
+    if len(rows) == JOB_CHUNK_SIZE:
+        return new_checkpoint, len(rows), None
+    archived_volume = db.session.query(func.sum(TradeArchive.volume_contribution)).filter(
+        TradeArchive.user_id == job.user_id
+    ).scalar()
+    computed = float(computed + to_decimal(archived_volume or 0))
+    stored = get_total_volume_from_db(job.user_id)
+    if not params.get('dry_run'):
+        save_total_volume_to_db(job.user_id, computed)
+        rebuild_volume_daily(job.user_id) # Baldes da janela móvel também voltam a bater com os trades
+    result = {'stored_before': stored, 'computed': money(computed), 'drift': money(stored - computed),
+              'applied': not params.get('dry_run')}
+    return new_checkpoint, len(rows), result
+
+def _job_rebuild_stats(job, params, checkpoint):
+    """ Replay do log de eventos em etapas; cada etapa grava um snapshot (o próprio checkpoint). """
+    if params.get('from_scratch') and not checkpoint.get('started'):
+        # Snapshots antigos são só derivados; sem eles as próximas etapas retomam desta cadeia
+        TradeSnapshot.query.filter_by(user_id=job.user_id).delete()
+    state, applied = replay_trade_events(job.user_id, max_events=JOB_CHUNK_SIZE)
+    new_checkpoint = {'started': True, 'last_event_id': state.last_event_id}
+    if applied == JOB_CHUNK_SIZE:
+        return new_checkpoint, applied, None
+    stored = get_total_volume_from_db(job.user_id)
+    result = {
+        'last_event_id': state.last_event_id,
+        'statistics': state.to_statistics(),
+        'daily_rollup_days': len(state.daily),
+        'total_volume': money(state.total_volume),
+        'total_volume_drift': money(stored - state.total_volume),
+    }
+    return new_checkpoint, applied, result
+
+def _job_total_trades(job):
+    return user_trades_query(job.user_id).count()
+
+def _job_total_fee_trades(job):
+    return user_trades_query(job.user_id).filter(fee_recalculable_filter()).count()
+
+def _job_total_events(job):
+    snapshot = latest_trade_snapshot(job.user_id)
+    params = json.loads(job.params) if job.params else {}
+    since = 0 if params.get('from_scratch') or snapshot is None else snapshot.last_event_id
+    return TradeEvent.query.filter(TradeEvent.user_id == job.user_id, TradeEvent.id > since).count()
+
+# kind -> (função que processa um bloco, função que estima o total de itens)
+# Cada função de bloco recebe (job, params, checkpoint) e retorna
+# (novo_checkpoint, itens_processados, resultado); resultado != None encerra o job.
+JOB_HANDLERS = {
+    'recalculate_fees': (_job_recalculate_fees, _job_total_fee_trades),
+    'reconcile_volume': (_job_reconcile_volume, _job_total_trades),
+    'rebuild_stats': (_job_rebuild_stats, _job_total_events),
+}
+
+def enqueue_job(user_id, kind, params=None):
+    """ Enfileira um job (ou devolve o mesmo job se já houver um igual pendente). Faz commit. """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Tipo de job desconhecido: {kind}")
+    params_json = json.dumps(params or {}, sort_keys=True)
+    pending = Job.query.filter(
+        Job.user_id == user_id, Job.kind == kind, Job.params == params_json,
+        Job.status.in_(('queued', 'running')),
+    ).first()
+    if pending:
+        return pending, False
+    job = Job(user_id=user_id, kind=kind, params=params_json, status='queued')
+    db.session.add(job)
+    db.session.commit()
+    return job, True
+
+def requeue_stale_jobs():
+    """ Devolve para a fila jobs 'running' cujo worker parou de dar sinal de vida. """
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    stale = db.session.execute(
+        db.update(Job).where(Job.status == 'running', Job.heartbeat_at < cutoff)
+        .values(status='queued', worker_id=None)
+    ).rowcount
+    db.session.commit()
+    if stale:
+        print(f"[JOBS] {stale} job(s) parados devolvidos para a fila.")
+    return stale
+
+def claim_next_job(worker_id):
+    """ Reserva atomicamente o próximo job da fila, respeitando JOB_MAX_CONCURRENT.
+
+    O limite é checado dentro do próprio UPDATE (subquery de 'running'). No SQLite as escritas
+    já são serializadas; no Postgres um advisory lock da transação serializa as reservas, senão
+    dois workers poderiam ver a mesma contagem e passar juntos do limite.
+    """
+    if Job.query.filter(Job.status == 'running').count() >= JOB_MAX_CONCURRENT:
+        return None # Atalho; a checagem que vale é a do UPDATE
+    candidates = db.session.query(Job.id).filter(Job.status == 'queued').order_by(Job.id).limit(5).all()
+    running_jobs = sa.orm.aliased(Job) # Alias: a subquery não pode se correlacionar com a linha do UPDATE
+    running = db.select(db.func.count()).select_from(running_jobs).where(running_jobs.status == 'running').scalar_subquery()
+    now = datetime.utcnow()
+    for (job_id,) in candidates:
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(sa.text('SELECT pg_advisory_xact_lock(:key)').bindparams(key=JOB_CLAIM_LOCK_KEY))
+        # UPDATE condicional: só um worker consegue trocar 'queued' -> 'running', e só abaixo do limite
+        claimed = db.session.execute(
+            db.update(Job).where(Job.id == job_id, Job.status == 'queued', running < JOB_MAX_CONCURRENT)
+            .values(status='running', worker_id=worker_id, heartbeat_at=now,
+                    started_at=db.func.coalesce(Job.started_at, now))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+    return None
+
+def run_job(job_id):
+    """ Executa um job já reservado, bloco a bloco, com checkpoint e heartbeat após cada bloco. """
+    job = db.session.get(Job, job_id)
+    step, estimate_total = JOB_HANDLERS[job.kind]
+    params = json.loads(job.params) if job.params else {}
+    print(f"[JOBS] Iniciando job {job.id} ({job.kind}) do usuário {job.user_id}.")
+    try:
+        if job.total is None:
+            job.total = estimate_total(job)
+            db.session.commit()
+        while True:
+            checkpoint = json.loads(job.checkpoint) if job.checkpoint else {}
+            new_checkpoint, processed, result = step(job, params, checkpoint)
+            # Dados do bloco + checkpoint + progresso no mesmo commit
+            job.checkpoint = json.dumps(new_checkpoint)
+            job.progress += processed
+            job.heartbeat_at = datetime.utcnow()
+            if result is not None:
+                job.status = 'done'
+                job.result = json.dumps(result)
+                job.finished_at = datetime.utcnow()
+            db.session.commit()
+            if result is not None:
+                print(f"[JOBS] Job {job.id} ({job.kind}) concluído: {result}")
+                return
+    except Exception as e:
+        db.session.rollback()
+        print(f"[JOBS ERROR] Job {job_id} falhou: {e}")
+        import traceback
+        traceback.print_exc()
+        job = db.session.get(Job, job_id)
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+# --- Backtest de TP/SL (flask backtest) ---
+# Monta os arrays do módulo backtest a partir dos trades fechados (quente + arquivo) e das
+# séries de preço: um JSON {símbolo: [[timestamp, preço], ...]} ou, sem ele, os preços dos
+# fills importados da Backpack (ExchangeFill) como ticks reais de mercado.
+
+def _epoch_ms(value):
+    """ datetime (UTC ingênuo), string ISO ou número em ms -> ms desde a época. """
+    if isinstance(value, (int, float)):
+        return int(value)
+    dt = value if isinstance(value, datetime) else parse_datetime_safe(value)
+    return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000) if dt else 0
+
+def backtest_price_series(user_id, prices_path=None):
+    """ {símbolo: (times_ms, preços)} ordenado por tempo. """
+    points = {}
+    if prices_path:
+        with open(prices_path) as f:
+            for symbol, rows in json.load(f).items():
+                points[symbol.upper()] = [(_epoch_ms(ts), float(price)) for ts, price in rows]
+    else:
+        fills = db.session.query(ExchangeFill.market, ExchangeFill.timestamp, ExchangeFill.price).filter(
+            ExchangeFill.user_id == user_id
+        )
+        for market, ts, price in fills:
+            points.setdefault(market_base_symbol(market), []).append((_epoch_ms(ts), price))
+    series = {}
+    for symbol, rows in points.items():
+        rows.sort()
+        series[symbol] = (np.array([ts for ts, _ in rows], dtype=np.int64), np.array([p for _, p in rows], dtype=np.float64))
+    return series
+
+def backtest_trades(user_id, since=None):
+    """ Trades fechados com entrada/saída/tamanho como arrays alinhados (taxas pela tabela de TIERs). """
+    field = {name: i for i, name in enumerate(TRADE_FIELDS)}
+    rows = [
+        row for row in closed_trade_rows(user_id)
+        if row[field['entry_price']] and row[field['exit_price']] and row[field['size']]
+        and row[field['closed_at_timestamp']] is not None
+        and (since is None or row[field['timestamp']] >= since)
+    ]
+    column = lambda name: [row[field[name]] for row in rows]
+    return {
+        'id': np.array(column('id'), dtype=object),
+        'symbol': np.array([(symbol or '').upper() for symbol in column('symbol')], dtype=object),
+        'side': np.array([-1.0 if side == 'short' else 1.0 for side in column('side')]),
+        'entry_ts': np.array([_epoch_ms(ts) for ts in column('timestamp')], dtype=np.int64),
+        'exit_ts': np.array([_epoch_ms(ts) for ts in column('closed_at_timestamp')], dtype=np.int64),
+        'entry_price': np.array(column('entry_price'), dtype=np.float64),
+        'exit_price': np.array(column('exit_price'), dtype=np.float64),
+        'size': np.abs(np.array(column('size'), dtype=np.float64)),
+        'entry_rate': np.array([fee_rate(row[field['tier']], 'maker', row[field['timestamp']]) for row in rows]),
+        'exit_rate': np.array([fee_rate(row[field['tier']], 'taker', row[field['closed_at_timestamp']]) for row in rows]),
+    }
+
+# --- Livro de Exposição e Risco (/api/risk) ---
+# Agregados por símbolo das posições abertas (tamanho e custo long/short, perda até o stop,
+# notional sem stop, PnL não realizado) mantidos em memória por usuário e ajustados por delta:
+# cada trade que mudou (SyncChange, como no snapshot analítico) tira a contribuição antiga e
+# soma a nova, e cada cotação (/api/market_data, disparos de TP/SL) recalcula só o seu símbolo.
+# Os totais também andam por delta, então /api/risk em dia custa um SELECT do MAX(SyncChange.id).
+# Limites: RISK_LIMITS (padrão; JSON no ambiente sobrescreve) + 'risk_limits:<user_id>' em
+# ConfigValue (PUT /api/risk/limits). Cada limite que estoura ou volta ao normal vira um evento.
+# O livro e as cotações são do processo: com vários workers cada um acompanha as suas.
+
+RISK_LIMITS = {
+    'max_gross_notional': None, # Soma do notional (long + short) de todas as posições
+    'max_symbol_notional': None, # Notional (long + short) de um símbolo
+    'max_loss_to_stop': None, # Perda total se todos os stops forem executados
+    'max_unprotected_notional': None, # Notional de posições sem stop
+    'max_unrealized_loss': None, # Prejuízo não realizado (valor positivo)
+}
+if os.environ.get('RISK_LIMITS'):
+    RISK_LIMITS.update(json.loads(os.environ['RISK_LIMITS']))
+RISK_EVENTS_MAX = 200 # Eventos de limite guardados por usuário
+EXPOSURE_SUMS = ('positions', 'long_size', 'long_cost', 'short_size', 'short_cost', 'loss_to_stop', 'unprotected_notional')
+
+_mark_prices = {} # símbolo -> (preço, time.time() da cotação)
+
+def record_mark_prices(prices):
+    """ Registra cotações {símbolo: preço} usadas no PnL não realizado dos livros. """
+    now = time.time()
+    for symbol, price in prices.items():
+        if price is not None and price > 0:
+            _mark_prices[symbol.upper()] = (float(price), now)
+
+def position_exposure(row):
+    """ (símbolo, lado, tamanho, custo, perda até o stop ou None) de uma posição aberta. """
+    _, symbol, side, size, entry_price, stop_loss = row
+    size = abs(size)
+    direction = -1 if side == 'short' else 1
+    loss_to_stop = None
+    if stop_loss is not None:
+        loss_to_stop = max(0.0, direction * (entry_price - stop_loss) * size) # Stop no lucro não perde nada
+    return (symbol or '-').upper(), direction, size, entry_price * size, loss_to_stop
+
+class ExposureBook:
+    """ Exposição de um usuário: contribuição por trade, somas por símbolo e totais. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None # Última SyncChange aplicada (None = ainda não carregado)
+        self.positions = {} # trade_id -> position_exposure
+        self.sums = {} # símbolo -> {EXPOSURE_SUMS}
+        self.views = {} # símbolo -> valores derivados (notional, preço médio, PnL) já calculados
+        self.marks = {} # símbolo -> (preço, instante) aplicado nas views
+        self.totals = dict.fromkeys(EXPOSURE_SUMS + ('gross_notional', 'net_notional', 'unrealized_pnl'), 0.0)
+        self.limits = None
+        self.breaches = {} # (limite, símbolo ou None) -> valor que estourou
+        self.events = deque(maxlen=RISK_EVENTS_MAX)
+        self.event_seq = 0
+
+    def apply(self, trade_ids, rows):
+        """ Troca a contribuição dos trades: remove a antiga e soma a de 'rows' (só abertos). Retorna os símbolos afetados. """
+        changed = set()
+        for trade_id in trade_ids:
+            old = self.positions.pop(trade_id, None)
+            if old is not None:
+                self._add(old, -1)
+                changed.add(old[0])
+            row = rows.get(trade_id)
+            if row is not None:
+                position = position_exposure(row)
+                self.positions[trade_id] = position
+                self._add(position, 1)
+                changed.add(position[0])
+        for symbol in changed:
+            self._refresh_view(symbol)
+        return changed
+
+    def _add(self, position, sign):
+        symbol, direction, size, cost, loss_to_stop = position
+        sums = self.sums.setdefault(symbol, dict.fromkeys(EXPOSURE_SUMS, 0.0))
+        side = 'long' if direction > 0 else 'short'
+        deltas = {'positions': 1, f'{side}_size': size, f'{side}_cost': cost}
+        if loss_to_stop is None:
+            deltas['unprotected_notional'] = cost
+        else:
+            deltas['loss_to_stop'] = loss_to_stop
+        for name, value in deltas.items():
+            sums[name] += sign * value
+            self.totals[name] += sign * value
+        if sums['positions'] == 0:
+            # Sem posições: zera os resíduos de ponto flutuante das somas/subtrações
+            for name in EXPOSURE_SUMS:
+                self.totals[name] -= sums[name]
+            del self.sums[symbol]
+
+    def apply_marks(self, marks):
+        """ Recalcula os símbolos do livro com cotação mais nova que a aplicada. """
+        changed = set()
+        for symbol in self.sums:
+            mark = marks.get(symbol)
+            if mark is not None and mark != self.marks.get(symbol):
+                self.marks[symbol] = mark
+                self._refresh_view(symbol)
+                changed.add(symbol)
+        return changed
+
+    def _refresh_view(self, symbol):
+        previous = self.views.pop(symbol, None)
+        if previous is not None:
+            for name in ('gross_notional', 'net_notional'):
+                self.totals[name] -= previous[name]
+            self.totals['unrealized_pnl'] -= previous['unrealized_pnl'] or 0.0
+        sums = self.sums.get(symbol)
+        if sums is None:
+            self.marks.pop(symbol, None)
+            return
+        mark = self.marks.get(symbol)
+        price = mark[0] if mark else None
+        long_notional = sums['long_size'] * price if price else sums['long_cost']
+        short_notional = sums['short_size'] * price if price else sums['short_cost']
+        unrealized = None
+        if price:
+            unrealized = (long_notional - sums['long_cost']) + (sums['short_cost'] - short_notional)
+        view = {
+            'positions': int(sums['positions']),
+            'long_size': sums['long_size'],
+            'short_size': sums['short_size'],
+            'avg_entry_long': sums['long_cost'] / sums['long_size'] if sums['long_size'] else None,
+            'avg_entry_short': sums['short_cost'] / sums['short_size'] if sums['short_size'] else None,
+            'long_notional': long_notional,
+            'short_notional': short_notional,
+            'gross_notional': long_notional + short_notional,
+            'net_notional': long_notional - short_notional,
+            'loss_to_stop': sums['loss_to_stop'],
+            'unprotected_notional': sums['unprotected_notional'],
+            'mark_price': price,
+            'unrealized_pnl': unrealized,
+        }
+        self.views[symbol] = view
+        for name in ('gross_notional', 'net_notional'):
+            self.totals[name] += view[name]
+        self.totals['unrealized_pnl'] += unrealized or 0.0
+
+    def check_limits(self, limits, symbols):
+        """ Compara os totais e os símbolos afetados com os limites; transições viram eventos. """
+        if limits != self.limits:
+            self.limits = limits
+            symbols = set(self.views) | {symbol for _, symbol in self.breaches if symbol}
+        checks = [
+            ('max_gross_notional', None, self.totals['gross_notional']),
+            ('max_loss_to_stop', None, self.totals['loss_to_stop']),
+            ('max_unprotected_notional', None, self.totals['unprotected_notional']),
+            ('max_unrealized_loss', None, -self.totals['unrealized_pnl']),
+        ]
+        for symbol in symbols:
+            view = self.views.get(symbol)
+            checks.append(('max_symbol_notional', symbol, view['gross_notional'] if view else 0.0))
+        for name, symbol, value in checks:
+            limit = limits.get(name)
+            breached = limit is not None and value > limit
+            key = (name, symbol)
+            if breached == (key in self.breaches):
+                if breached:
+                    self.breaches[key] = value
+                continue
+            if breached:
+                self.breaches[key] = value
+            else:
+                del self.breaches[key]
+            self.event_seq += 1
+            event = {
+                'seq': self.event_seq,
+                'at': datetime.utcnow().isoformat(),
+                'state': 'breached' if breached else 'cleared',
+                'limit': name,
+                'symbol': symbol,
+                'value': money(value),
+                'limit_value': limit,
+            }
+            self.events.append(event)
+            print(f"[RISK ALERT] Limite {name}{f' ({symbol})' if symbol else ''} {event['state']}: {event['value']} / {limit}")
+
+    def to_dict(self, events_after=0):
+        now = time.time()
+        symbols = {}
+        for symbol, view in sorted(self.views.items()):
+            mark = self.marks.get(symbol)
+            symbols[symbol] = {name: money(value) for name, value in view.items()}
+            symbols[symbol].update(
+                positions=view['positions'], long_size=view['long_size'], short_size=view['short_size'], mark_price=view['mark_price'],
+                avg_entry_long=quantize(view['avg_entry_long'], PRICE_SCALE), avg_entry_short=quantize(view['avg_entry_short'], PRICE_SCALE),
+            )
+            symbols[symbol]['mark_age_seconds'] = round(now - mark[1], 1) if mark else None
+        totals = {name: money(value) for name, value in self.totals.items() if name not in ('long_size', 'short_size', 'positions')}
+        totals['positions'] = int(self.totals['positions'])
+        totals['unmarked_symbols'] = sorted(symbol for symbol in self.views if symbol not in self.marks)
+        return {
+            'version': self.version,
+            'totals': totals,
+            'symbols': symbols,
+            'limits': self.limits,
+            'breaches': [
+                {'limit': name, 'symbol': symbol, 'value': money(value), 'limit_value': self.limits.get(name)}
+                for (name, symbol), value in self.breaches.items()
+            ],
+            'events': [event for event in self.events if event['seq'] > events_after],
+        }
+
+_exposure_books = {}
+_exposure_books_lock = threading.Lock()
+
+def user_risk_limits(user_id):
+    """ RISK_LIMITS com o override do usuário (ConfigValue 'risk_limits:<user_id>', JSON). """
+    limits = dict(RISK_LIMITS)
+    config = db.session.get(ConfigValue, user_config_key('risk_limits', user_id))
+    if config and config.value:
+        try:
+            limits.update(json.loads(config.value))
+        except ValueError:
+            print(f"[RISK WARN] risk_limits inválido para o usuário {user_id}: {config.value}")
+    return limits
+
+def _open_position_exposure_rows(user_id, trade_ids=None):
+    """ {trade_id: (id, symbol, side, size, entry_price, stop_loss)} das posições abertas (opcionalmente só 'trade_ids'). """
+    columns = (Trade.id, Trade.symbol, Trade.side, Trade.size, Trade.entry_price, Trade.stop_loss)
+    if trade_ids is None:
+        return {row[0]: row for row in open_positions_query(user_id).with_entities(*columns)}
+    rows = {}
+    for start in range(0, len(trade_ids), 500): # IN em blocos
+        chunk = trade_ids[start:start + 500]
+        rows.update((row[0], row) for row in open_positions_query(user_id).filter(Trade.id.in_(chunk)).with_entities(*columns))
+    return rows
+
+def exposure_book(user_id):
+    """ Livro do usuário em dia com as mudanças de trades, as cotações e os limites. """
+    with _exposure_books_lock:
+        book = _exposure_books.get(user_id)
+        if book is None:
+            book = _exposure_books[user_id] = ExposureBook()
+    with book.lock:
+        latest = db.session.query(func.max(SyncChange.id)).filter(
+            SyncChange.user_id == user_id, SyncChange.entity == 'trade'
+        ).scalar() or 0
+        settle_cutoff = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+        changed = set()
+        if book.version is None:
+            rows = _open_position_exposure_rows(user_id)
+            changed = book.apply(list(rows), rows)
+            # Mudanças recentes podem ter commits fora de ordem: ficam para o próximo refresh (reaplicar é idempotente)
+            recent = db.session.query(func.min(SyncChange.id)).filter(
+                SyncChange.user_id == user_id, SyncChange.entity == 'trade',
+                SyncChange.id <= latest, SyncChange.created_at > settle_cutoff
+            ).scalar()
+            book.version = recent - 1 if recent else latest
+        elif latest > book.version:
+            changes = db.session.query(SyncChange.id, SyncChange.entity_key, SyncChange.created_at).filter(
+                SyncChange.user_id == user_id, SyncChange.entity == 'trade', SyncChange.id > book.version
+            ).order_by(SyncChange.id).all()
+            trade_ids = sorted({trade_id for _, trade_id, _ in changes})
+            changed = book.apply(trade_ids, _open_position_exposure_rows(user_id, trade_ids))
+            recent_ids = [change_id for change_id, _, created_at in changes if created_at > settle_cutoff]
+            book.version = max(book.version, min(recent_ids) - 1) if recent_ids else changes[-1][0]
+        changed |= book.apply_marks(_mark_prices)
+        book.check_limits(user_risk_limits(user_id), changed)
+    return book
+
+# --- Compressão de Respostas e Assets Estáticos ---
+# JSON/HTML/CSS/JS acima de COMPRESS_MIN_SIZE saem comprimidos (br ou gzip). Os bundles de
+# static/ são servidos em /assets/ com o hash do conteúdo no nome e cache de longa duração.
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024)) # Bytes
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'text/html', 'text/css', 'application/javascript', 'text/javascript',
+    'application/vnd.apache.arrow.stream',
+}
+ASSET_BUNDLES = ('css/dashboard.css', 'js/sync-store.js', 'js/dashboard.js') # Relativos a static/
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+def negotiate_content_encoding():
+    """ Escolhe a codificação aceita pelo cliente: 'br' (se brotli instalado), 'gzip' ou None. """
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compress_body(body, encoding):
+    """ Comprime bytes com a codificação negociada. """
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+@app.after_request
+def compress_response(response):
+    """ Comprime respostas textuais grandes conforme o Accept-Encoding do cliente. """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.content_length or 0) < COMPRESS_MIN_SIZE:
+        return response
+    encoding = negotiate_content_encoding()
+    if encoding:
+        response.set_data(compress_body(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+class AssetBundle:
+    """ Um arquivo de static/ com hash do conteúdo e versões pré-comprimidas em memória. """
+
+    def __init__(self, name, path):
+        with open(path, 'rb') as f:
+            self.body = f.read()
+        self.name = name
+        self.mtime = os.path.getmtime(path)
+        self.digest = hashlib.sha256(self.body).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        self.fingerprinted_name = f"{stem}.{self.digest}{ext}"
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.encoded = {'gzip': gzip.compress(self.body, compresslevel=9)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(self.body, quality=11)
+
+_asset_manifest = {} # nome lógico -> AssetBundle
+_assets_by_fingerprint = {} # nome com hash -> AssetBundle
+
+def get_asset_bundle(name):
+    """ Carrega (uma vez por processo; em debug, de novo se o arquivo mudar) o bundle de static/. """
+    bundle = _asset_manifest.get(name)
+    path = os.path.join(app.static_folder, name)
+    if bundle is None or (app.debug and os.path.getmtime(path) != bundle.mtime):
+        bundle = AssetBundle(name, path)
+        _asset_manifest[name] = bundle
+        _assets_by_fingerprint[bundle.fingerprinted_name] = bundle
+    return bundle
+
+@app.template_global()
+def asset_url(name):
+    """ URL versionada de um bundle (o hash muda sempre que o conteúdo muda). """
+    return url_for('serve_asset', filename=get_asset_bundle(name).fingerprinted_name)
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    bundle = _assets_by_fingerprint.get(filename)
+    if bundle is None:
+        # Processo novo ainda sem manifesto: carrega os bundles conhecidos e tenta de novo
+        for name in ASSET_BUNDLES:
+            get_asset_bundle(name)
+        bundle = _assets_by_fingerprint.get(filename)
+    if bundle is None:
+        return jsonify({'error': 'Asset não encontrado'}), 404
+
+    encoding = negotiate_content_encoding()
+    body = bundle.encoded.get(encoding, bundle.body) if encoding else bundle.body
+    response = app.response_class(body, mimetype=bundle.mimetype)
+    if encoding and encoding in bundle.encoded:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # Nome com hash: o conteúdo nunca muda nesta URL, então pode ficar em cache "para sempre"
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    response.set_etag(bundle.digest)
+    return response.make_conditional(request)
+
+# --- Idempotência e Limite de Taxa (rotas de mutação) ---
+# Rotas com @guard_mutation passam por dois filtros antes de chegar ao banco principal, ambos
+# num SQLite local (REQUEST_GUARD_DB, compartilhado pelos workers da máquina; dados descartáveis):
+# - Token bucket por usuário e endpoint (RATE_LIMITS); sem ficha -> 429 com Retry-After.
+# - Idempotência: a mesma Idempotency-Key (ou, sem ela, o mesmo método+rota+corpo dentro de
+#   DUPLICATE_WINDOW_SECONDS) não executa de novo. Em andamento -> 409; concluída -> devolve a
+#   resposta gravada (Idempotent-Replayed: true); mesma chave com outro corpo -> 422.
+
+REQUEST_GUARD_DB = os.environ.get('REQUEST_GUARD_DB') or os.path.join(app.instance_path, 'request_guard.db')
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_SECONDS', 600))
+IDEMPOTENCY_PENDING_SECONDS = 60 # Requisição que morreu sem concluir libera a chave depois disso
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+DUPLICATE_WINDOW_SECONDS = float(os.environ.get('DUPLICATE_WINDOW_SECONDS', 3))
+MUTATION_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# (capacidade, fichas por segundo) por "endpoint:MÉTODO"; RATE_LIMITS no ambiente (JSON) sobrescreve
+RATE_LIMITS = {
+    'default': (30, 1.0),
+    'handle_trades:POST': (10, 0.5),
+    'batch_update_trades:PATCH': (20, 1.0),
+    'handle_triggered_close:POST': (20, 1.0),
+    'handle_deposit:POST': (10, 0.5),
+    'handle_withdraw:POST': (10, 0.5),
+    'handle_jobs:POST': (5, 0.1),
+}
+if os.environ.get('RATE_LIMITS'):
+    RATE_LIMITS.update({name: tuple(limit) for name, limit in json.loads(os.environ['RATE_LIMITS']).items()})
+
+class RequestGuardStore:
+    """ Chaves de idempotência e baldes de rate limit num SQLite local (uma conexão por thread). """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS idempotency_key (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            status INTEGER, -- NULL enquanto a requisição está em andamento
+            content_type TEXT,
+            body BLOB,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rate_bucket (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    '''
+    PURGE_INTERVAL_SECONDS = 60
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._purged_at = 0.0
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def take_token(self, bucket_key, capacity, refill_per_second):
+        """ Consome uma ficha do balde; retorna 0 se liberado ou os segundos até a próxima ficha. """
+        conn = self.connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated_at FROM rate_bucket WHERE key = ?', (bucket_key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_per_second)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / refill_per_second
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_bucket (key, tokens, updated_at) VALUES (?, ?, ?)',
+                (bucket_key, tokens, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._purge_expired(now)
+        return wait
+
+    def begin(self, key, fingerprint):
+        """ Reserva a chave. Retorna None se é nova, ou (fingerprint, status, content_type, body) existente. """
+        conn = self.connection()
+        now = time.time()
+        conn.execute('DELETE FROM idempotency_key WHERE key = ? AND expires_at < ?', (key, now))
+        inserted = conn.execute(
+            'INSERT OR IGNORE INTO idempotency_key (key, fingerprint, expires_at) VALUES (?, ?, ?)',
+            (key, fingerprint, now + IDEMPOTENCY_PENDING_SECONDS)
+        ).rowcount
+        if inserted:
+            return None
+        return conn.execute(
+            'SELECT fingerprint, status, content_type, body FROM idempotency_key WHERE key = ?', (key,)
+        ).fetchone()
+
+    def complete(self, key, ttl, status, content_type, body):
+        self.connection().execute(
+            'UPDATE idempotency_key SET status = ?, content_type = ?, body = ?, expires_at = ? WHERE key = ?',
+            (status, content_type, body, time.time() + ttl, key)
+        )
+
+    def release(self, key):
+        self.connection().execute('DELETE FROM idempotency_key WHERE key = ?', (key,))
+
+    def _purge_expired(self, now):
+        if now - self._purged_at < self.PURGE_INTERVAL_SECONDS:
+            return
+        self._purged_at = now
+        conn = self.connection()
+        conn.execute('DELETE FROM idempotency_key WHERE expires_at < ?', (now,))
+        conn.execute('DELETE FROM rate_bucket WHERE updated_at < ?', (now - 3600,)) # Balde parado há 1h já está cheio
+
+request_guard = RequestGuardStore(REQUEST_GUARD_DB)
+
+def request_fingerprint():
+    """ Hash de método + rota + corpo: identifica a "mesma" requisição. """
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.path.encode(), request.get_data()):
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def guard_mutation(view):
+    """ Rate limit + idempotência nos métodos que gravam (GET passa direto). Vai abaixo do @login_required. """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method not in MUTATION_METHODS:
+            return view(*args, **kwargs)
+        user_id = current_user.id
+        endpoint = f"{request.endpoint}:{request.method}"
+        try:
+            capacity, refill_per_second = RATE_LIMITS.get(endpoint, RATE_LIMITS['default'])
+            wait = request_guard.take_token(f"{user_id}:{endpoint}", capacity, refill_per_second)
+        except sqlite3.Error as e:
+            print(f"[REQUEST GUARD WARN] Rate limit indisponível, liberando: {e}")
+            wait = 0
+        if wait:
+            response = jsonify({'error': 'Muitas requisições; tente novamente em instantes'})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(math.ceil(wait))
+            return response
+
+        client_key = request.headers.get('Idempotency-Key')
+        if client_key is not None and not 0 < len(client_key) <= IDEMPOTENCY_MAX_KEY_LENGTH:
+            return jsonify({'error': f'Idempotency-Key deve ter de 1 a {IDEMPOTENCY_MAX_KEY_LENGTH} caracteres'}), 400
+        fingerprint = request_fingerprint()
+        if client_key:
+            key, ttl = f"{user_id}:key:{client_key}", IDEMPOTENCY_KEY_TTL_SECONDS
+        else:
+            key, ttl = f"{user_id}:auto:{fingerprint}", DUPLICATE_WINDOW_SECONDS
+        try:
+            existing = request_guard.begin(key, fingerprint)
+        except sqlite3.Error as e:
+            print(f"[REQUEST GUARD WARN] Idempotência indisponível, executando sem: {e}")
+            return view(*args, **kwargs)
+
+        if existing is not None:
+            stored_fingerprint, status, content_type, body = existing
+            if stored_fingerprint != fingerprint:
+                return jsonify({'error': 'Idempotency-Key já usada com outra requisição'}), 422
+            if status is None:
+                response = jsonify({'error': 'Requisição idêntica ainda em andamento'})
+                response.status_code = 409
+                response.headers['Retry-After'] = '1'
+                return response
+            response = app.response_class(body, status=status, content_type=content_type)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            request_guard.release(key)
+            raise
+        try:
+            if response.status_code >= 500 or response.is_streamed:
+                request_guard.release(key) # Falha do servidor: a mesma requisição pode ser repetida
+            else:
+                request_guard.complete(key, ttl, response.status_code, response.content_type, response.get_data())
+        except sqlite3.Error as e:
+            print(f"[REQUEST GUARD WARN] Falha ao gravar resposta idempotente: {e}")
+        return response
+    return wrapper
+
+# --- Cache de Resultados das Rotas de Agregados (tags) ---
+# Estatísticas, PnL diário/histórico, volume total e saldos só mudam quando um Trade, Balance
+# ou ConfigValue do usuário é gravado. @cached_result guarda a resposta 200 da rota por
+# usuário + URL sob tags ('trades', 'balances', 'config:total_volume'; as escritas também
+# marcam 'symbol:<SÍMBOLO>'). Cada tag tem uma geração: a entrada guarda as gerações lidas
+# antes do cálculo e só vale enquanto nenhuma delas mudar. O before_flush junta as tags das
+# escritas do ORM (UPDATE/DELETE em lote marcam via record_sync_changes/mark_result_cache_tags)
+# e o after_commit incrementa exatamente essas gerações; rollback as descarta.
+# RESULT_CACHE_BACKEND:
+# - 'local' (padrão): LRU em memória + SQLite local (RESULT_CACHE_DB) com gerações e entradas,
+#   compartilhado pelos workers, pelo 'flask worker' e pela CLI da máquina.
+# - 'memory': só o LRU do processo (um único processo gravando no banco). 'off' desliga.
+# RESULT_CACHE_TTL_SECONDS limita a idade de qualquer entrada (escritas fora do app, outras máquinas).
+
+RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND', 'local')
+RESULT_CACHE_DB = os.environ.get('RESULT_CACHE_DB') or os.path.join(app.instance_path, 'result_cache.db')
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get('RESULT_CACHE_TTL_SECONDS', 300))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 2048))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+RESULT_CACHE_SESSION_KEY = 'result_cache_tags' # Tags pendentes em Session.info até o commit
+
+class ResultCacheStore:
+    """ Gerações das tags e entradas do cache num SQLite local (uma conexão por thread). """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS cache_tag (
+            tag TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS cache_entry (
+            key TEXT PRIMARY KEY,
+            generations TEXT NOT NULL, -- JSON {tag: geração} lido antes do cálculo
+            content_type TEXT,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            used_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_cache_entry_used_at ON cache_entry (used_at);
+    '''
+
+    def __init__(self, path, max_entries, max_bytes):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def generations(self, tags):
+        current = dict.fromkeys(tags, 0)
+        if tags:
+            current.update(self.connection().execute(
+                f"SELECT tag, generation FROM cache_tag WHERE tag IN ({', '.join('?' * len(tags))})", list(tags)
+            ).fetchall())
+        return current
+
+    def bump(self, tags):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO cache_tag (tag, generation) VALUES (?, 1) '
+                'ON CONFLICT(tag) DO UPDATE SET generation = generation + 1',
+                [(tag,) for tag in tags]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get(self, key):
+        """ (gerações, content_type, body, expires_at) ou None; marca o uso para o LRU. """
+        conn = self.connection()
+        row = conn.execute(
+            'SELECT generations, content_type, body, expires_at FROM cache_entry WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE cache_entry SET used_at = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0]), row[1], row[2], row[3]
+
+    def put(self, key, generations, content_type, body, expires_at):
+        conn = self.connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entry (key, generations, content_type, body, size, expires_at, used_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, json.dumps(generations), content_type, body, len(body), expires_at, now)
+            )
+            conn.execute('DELETE FROM cache_entry WHERE expires_at < ?', (now,))
+            count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entry').fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                victims = []
+                for victim, size in conn.execute('SELECT key, size FROM cache_entry ORDER BY used_at'):
+                    if count <= self.max_entries and total <= self.max_bytes:
+                        break
+                    victims.append((victim,))
+                    count -= 1
+                    total -= size
+                conn.executemany('DELETE FROM cache_entry WHERE key = ?', victims)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, key):
+        self.connection().execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+
+class ResultCache:
+    """ LRU em memória (limitado por entradas e bytes) na frente do ResultCacheStore opcional. """
+
+    def __init__(self, max_entries, max_bytes, store=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self._entries = OrderedDict() # chave -> (gerações, content_type, body, expires_at)
+        self._bytes = 0
+        self._generations = {} # Sem store: gerações só deste processo
+        self._lock = threading.Lock()
+
+    def generations(self, tags):
+        if self.store is not None:
+            return self.store.generations(tags)
+        with self._lock:
+            return {tag: self._generations.get(tag, 0) for tag in tags}
+
+    def get(self, key):
+        """ (content_type, body) se a entrada existe, não expirou e nenhuma tag dela mudou; senão None. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None:
+            return None
+        generations, content_type, body, expires_at = entry
+        if expires_at > time.time() and self.generations(list(generations)) == generations:
+            return content_type, body
+        self.discard(key)
+        return None
+
+    def put(self, key, generations, content_type, body, ttl):
+        entry = (generations, content_type, body, time.time() + ttl)
+        self._remember(key, entry)
+        if self.store is not None:
+            self.store.put(key, *entry)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[2])
+            self._entries[key] = entry
+            self._bytes += len(entry[2])
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[2])
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry[2])
+        if self.store is not None:
+            self.store.delete(key)
+
+    def invalidate(self, tags):
+        if self.store is not None:
+            self.store.bump(sorted(tags))
+            return
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+if RESULT_CACHE_BACKEND in ('local', 'memory'):
+    result_cache = ResultCache(
+        RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES,
+        ResultCacheStore(RESULT_CACHE_DB, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES) if RESULT_CACHE_BACKEND == 'local' else None
+    )
+else:
+    if RESULT_CACHE_BACKEND != 'off':
+        print(f"[RESULT CACHE WARN] RESULT_CACHE_BACKEND desconhecido '{RESULT_CACHE_BACKEND}'; cache desligado.")
+    result_cache = None
+
+def result_cache_tags(obj):
+    """ Tags (prefixadas pelo usuário) que uma escrita do objeto invalida. """
+    if isinstance(obj, (Trade, TradeArchive, Balance)):
+        family = 'balances' if isinstance(obj, Balance) else 'trades'
+        symbols = {obj.symbol, *sa.inspect(obj).attrs.symbol.history.deleted} # Inclui o símbolo antigo se mudou
+        return {f"{obj.user_id}:{family}"} | {f"{obj.user_id}:symbol:{symbol}" for symbol in symbols if symbol}
+    if isinstance(obj, ConfigValue):
+        name, _, user_id = (obj.key or '').rpartition(':')
+        if name and user_id:
+            return {f"{user_id}:config:{name}"}
+    return set()
+
+def mark_result_cache_tags(user_id, *tags):
+    """ Tags a invalidar no próximo commit, para escritas que não passam pelo flush do ORM. """
+    db.session.info.setdefault(RESULT_CACHE_SESSION_KEY, set()).update(f"{user_id}:{tag}" for tag in tags)
+
+@sa.event.listens_for(RoutingSession, 'before_flush')
+def _collect_result_cache_tags(db_session, flush_context, instances):
+    tags = set()
+    for obj in db_session.new:
+        tags |= result_cache_tags(obj)
+    for obj in db_session.dirty:
+        if db_session.is_modified(obj, include_collections=False):
+            tags |= result_cache_tags(obj)
+    for obj in db_session.deleted:
+        tags |= result_cache_tags(obj)
+    if tags:
+        db_session.info.setdefault(RESULT_CACHE_SESSION_KEY, set()).update(tags)
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _invalidate_result_cache(db_session):
+    tags = db_session.info.pop(RESULT_CACHE_SESSION_KEY, None)
+    if tags and result_cache is not None:
+        try:
+            result_cache.invalidate(tags)
+        except sqlite3.Error as e:
+            # Sem como avisar os outros processos: limpa o local e o TTL cuida do resto
+            print(f"[RESULT CACHE WARN] Falha ao invalidar {sorted(tags)}: {e}")
+            result_cache.clear()
+
+@sa.event.listens_for(RoutingSession, 'after_rollback')
+def _discard_result_cache_tags(db_session):
+    db_session.info.pop(RESULT_CACHE_SESSION_KEY, None)
+
+def cached_result(*tags, vary=None):
+    """ Cacheia a resposta 200 de uma rota GET por usuário + URL (+ vary()) sob as tags dadas.
+
+    Vai abaixo do @login_required e acima do @read_replica (um acerto nem escolhe o banco).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if result_cache is None or request.method != 'GET':
+                return view(*args, **kwargs)
+            user_id = current_user.id
+            key = f"{user_id}:{request.full_path}"
+            if vary is not None:
+                key = f"{key}|{vary()}"
+            try:
+                hit = result_cache.get(key)
+                # Gerações lidas ANTES do cálculo: um commit no meio deixa a entrada já inválida
+                generations = None if hit else result_cache.generations([f"{user_id}:{tag}" for tag in tags])
+            except sqlite3.Error as e:
+                print(f"[RESULT CACHE WARN] Cache indisponível, calculando direto: {e}")
+                return view(*args, **kwargs)
+            if hit:
+                content_type, body = hit
+                response = app.response_class(body, status=200, content_type=content_type)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                ttl = RESULT_CACHE_TTL_SECONDS
+                if g.get('db_route') == 'replica':
+                    ttl = min(ttl, DB_REPLICA_MAX_LAG_SECONDS) # A réplica pode não ter o último commit
+                try:
+                    result_cache.put(key, generations, response.content_type, response.get_data(), ttl)
+                except sqlite3.Error as e:
+                    print(f"[RESULT CACHE WARN] Falha ao gravar no cache: {e}")
+                response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+def today_key():
+    """ Parte da chave de rotas que dependem do dia corrente. """
+    return date.today().isoformat()
+
+# --- Listagem de Mercado Compartilhada (/api/markets) ---
+# A página de Cryptomoedas buscava /coins/markets da CoinGecko direto de cada navegador (cota do
+# nosso IP gasta por visitante). Agora o servidor busca a listagem de todos os IDs de
+# symbol_to_id_map no máximo uma vez por MARKETS_REFRESH_SECONDS e guarda o payload pronto
+# (preço, variação 24h e sparkline das últimas 24h) num SQLite local compartilhado pelos workers.
+# Stale-while-revalidate: passado o refresh a cópia antiga sai na hora e um único processo (lease
+# no SQLite) atualiza em background; só sem cópia, ou com ela mais velha que
+# MARKETS_MAX_STALE_SECONDS, a requisição espera a CoinGecko. Falha no upstream mantém a cópia.
+
+MARKETS_CACHE_DB = os.environ.get('MARKETS_CACHE_DB') or RESULT_CACHE_DB
+MARKETS_REFRESH_SECONDS = float(os.environ.get('MARKETS_REFRESH_SECONDS', 60))
+MARKETS_MAX_STALE_SECONDS = float(os.environ.get('MARKETS_MAX_STALE_SECONDS', 3600))
+MARKETS_LEASE_SECONDS = 30 # Depois disso outro processo pode assumir uma atualização travada
+MARKETS_SPARKLINE_POINTS = 25 # Pontos horários cobrindo as últimas 24h
+MARKETS_LISTING = 'coingecko'
+
+class MarketListingStore:
+    """ Última listagem (corpo JSON pronto) e o lease de atualização num SQLite local. """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS market_listing (
+            name TEXT PRIMARY KEY,
+            body BLOB,
+            fetched_at REAL,
+            refresh_until REAL NOT NULL DEFAULT 0 -- Lease de quem está buscando no upstream
+        );
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def load(self, name):
+        """ (body, fetched_at) da última listagem gravada, ou None. """
+        row = self.connection().execute(
+            'SELECT body, fetched_at FROM market_listing WHERE name = ? AND body IS NOT NULL', (name,)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def acquire_refresh(self, name, lease_seconds):
+        """ True se este processo ficou com a atualização (nenhum lease válido de outro). """
+        conn = self.connection()
+        now = time.time()
+        conn.execute('INSERT OR IGNORE INTO market_listing (name) VALUES (?)', (name,))
+        return conn.execute(
+            'UPDATE market_listing SET refresh_until = ? WHERE name = ? AND refresh_until < ?', (now + lease_seconds, name, now)
+        ).rowcount == 1
+
+    def release_refresh(self, name):
+        self.connection().execute('UPDATE market_listing SET refresh_until = 0 WHERE name = ?', (name,))
+
+    def save(self, name, body, fetched_at):
+        self.connection().execute(
+            'INSERT INTO market_listing (name, body, fetched_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET body = excluded.body, fetched_at = excluded.fetched_at '
+            'WHERE market_listing.fetched_at IS NULL OR market_listing.fetched_at < excluded.fetched_at',
+            (name, body, fetched_at)
+        )
+
+markets_store = MarketListingStore(MARKETS_CACHE_DB)
+_market_listing = {} # MARKETS_LISTING -> (body, fetched_at) já lida por este processo
+_market_refresh_lock = threading.Lock() # Uma busca por processo; entre processos vale o lease
+
+def compact_sparkline(prices):
+    """ Últimas 24h do sparkline horário de 7 dias, com 6 algarismos significativos. """
+    return [float(f"{price:.6g}") for price in prices[-MARKETS_SPARKLINE_POINTS:] if price is not None]
+
+def fetch_market_listing():
+    """ Busca /coins/markets de todos os IDs conhecidos e monta as moedas no formato compacto. """
+    coin_ids = list(dict.fromkeys(symbol_to_id_map.values()))
+    response = requests.get(f"{COINGECKO_API_URL}/coins/markets", params={
+        'vs_currency': 'usd',
+        'ids': ','.join(coin_ids),
+        'sparkline': 'true',
+        'price_change_percentage': '24h',
+        'per_page': 250,
+    }, timeout=10)
+    response.raise_for_status()
+    data = response.json()
+    if not isinstance(data, list):
+        raise ValueError(f"resposta inesperada da CoinGecko: {str(data)[:200]}")
+    by_id = {coin.get('id'): coin for coin in data}
+
+    coins = []
+    for coin_id in coin_ids: # Mesma ordem de symbol_to_id_map; IDs ausentes saem com preço None
+        coin = by_id.get(coin_id, {})
+        price = coin.get('current_price')
+        sparkline = compact_sparkline((coin.get('sparkline_in_7d') or {}).get('price') or [])
+        change = coin.get('price_change_percentage_24h')
+        if change is None and price is not None and sparkline and sparkline[0]:
+            change = (price / sparkline[0] - 1) * 100 # Sem o campo: variação pelo início do sparkline
+        coins.append({
+            'id': coin_id,
+            'symbol': id_to_symbol_map[coin_id],
+            'name': coin.get('name'),
+            'image': coin.get('image'),
+            'price': price,
+            'change_24h': round(change, 2) if change is not None else None,
+            'sparkline': sparkline,
+        })
+    record_mark_prices({coin['symbol']: coin['price'] for coin in coins}) # Cotações para o livro de exposição
+    return coins
+
+def refresh_market_listing():
+    """ Busca a listagem na CoinGecko e grava no store; (body, fetched_at) ou None se falhou. """
+    try:
+        coins = fetch_market_listing()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"[MARKETS ERROR] Falha ao buscar a listagem da CoinGecko: {e}")
+        return None
+    fetched_at = time.time()
+    body = json.dumps({
+        'updated_at': datetime.fromtimestamp(fetched_at, timezone.utc).isoformat(),
+        'refresh_seconds': MARKETS_REFRESH_SECONDS,
+        'coins': coins,
+    }, separators=(',', ':')).encode()
+    _market_listing[MARKETS_LISTING] = (body, fetched_at)
+    try:
+        markets_store.save(MARKETS_LISTING, body, fetched_at)
+    except sqlite3.Error as e:
+        print(f"[MARKETS WARN] Falha ao gravar a listagem no cache compartilhado: {e}")
+    print(f"[MARKETS] Listagem atualizada ({len(coins)} moedas, {len(body)} bytes)")
+    return body, fetched_at
+
+def _refresh_market_listing_in_background():
+    try:
+        refresh_market_listing()
+    finally:
+        try:
+            markets_store.release_refresh(MARKETS_LISTING)
+        except sqlite3.Error:
+            pass # O lease expira sozinho
+        _market_refresh_lock.release()
+
+def start_market_listing_refresh():
+    """ Dispara a atualização em background se nenhuma outra (deste ou de outro processo) está em curso. """
+    if not _market_refresh_lock.acquire(blocking=False):
+        return
+    try:
+        leased = markets_store.acquire_refresh(MARKETS_LISTING, MARKETS_LEASE_SECONDS)
+    except sqlite3.Error as e:
+        print(f"[MARKETS WARN] Lease indisponível, atualizando mesmo assim: {e}")
+        leased = True
+    if not leased:
+        _market_refresh_lock.release()
+        return
+    threading.Thread(target=_refresh_market_listing_in_background, name='markets-refresh', daemon=True).start()
+
+def current_market_listing():
+    """ (body, fetched_at, 'HIT' | 'STALE' | 'MISS') pela regra de stale-while-revalidate, ou None. """
+    now = time.time()
+    listing = _market_listing.get(MARKETS_LISTING)
+    if listing is None or now - listing[1] >= MARKETS_REFRESH_SECONDS:
+        try:
+            stored = markets_store.load(MARKETS_LISTING) # Talvez outro worker já tenha atualizado
+        except sqlite3.Error as e:
+            print(f"[MARKETS WARN] Cache compartilhado indisponível: {e}")
+            stored = None
+        if stored is not None and (listing is None or stored[1] > listing[1]):
+            listing = _market_listing[MARKETS_LISTING] = stored
+    if listing is not None and now - listing[1] < MARKETS_REFRESH_SECONDS:
+        return (*listing, 'HIT')
+    if listing is not None and now - listing[1] < MARKETS_MAX_STALE_SECONDS:
+        start_market_listing_refresh()
+        return (*listing, 'STALE')
+
+    # Sem cópia utilizável: espera a busca (uma por processo; quem esperou reaproveita o resultado)
+    with _market_refresh_lock:
+        current = _market_listing.get(MARKETS_LISTING)
+        if current is not None and time.time() - current[1] < MARKETS_REFRESH_SECONDS:
+            return (*current, 'HIT')
+        fetched = refresh_market_listing()
+    if fetched is not None:
+        return (*fetched, 'MISS')
+    return (*listing, 'STALE') if listing is not None else None # Upstream fora: a cópia velha ainda serve
+
+# --- Profiler por Amostragem (/admin/profiles) ---
+# Uma fração das requisições (PROFILE_SAMPLE_RATE, 0..1) ou qualquer requisição de um admin com
+# o header X-Profile: 1 é perfilada por amostragem: uma thread do processo lê as pilhas das
+# threads marcadas (sys._current_frames) a cada PROFILE_INTERVAL_MS, sem instrumentar chamadas;
+# sem requisição marcada ela fica parada. Cada captura vira um .folded (formato de pilhas
+# colapsadas do flamegraph.pl / speedscope) + um .json com rota, duração e frames mais quentes
+# em PROFILES_DIR; as PROFILE_KEEP mais novas ficam. Admins = ADMIN_EMAILS (lista por vírgula).
+
+PROFILES_DIR = os.environ.get('PROFILES_DIR') or os.path.join(app.instance_path, 'profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+PROFILE_MIN_DURATION_MS = float(os.environ.get('PROFILE_MIN_DURATION_MS', 100)) # Amostradas mais rápidas são descartadas
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))
+PROFILE_TOP_FRAMES = 10
+PROFILE_HEADER = 'X-Profile'
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
+
+def collapse_stack(frame):
+    """ Pilha da raiz até 'frame' como 'arquivo:função;arquivo:função;...'. """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}") # co_qualname: Python 3.11+
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class SamplingProfiler:
+    """ Thread que amostra as pilhas das threads com requisição sendo perfilada. """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.active = {} # ident da thread -> {pilha colapsada: amostras}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def start(self, ident):
+        with self.lock:
+            self.active[ident] = {}
+            # Workers do gunicorn nascem por fork: a thread do processo pai não existe no filho
+            if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self.thread.start()
+            self.wakeup.set()
+
+    def stop(self, ident):
+        with self.lock:
+            stacks = self.active.pop(ident, {})
+            if not self.active:
+                self.wakeup.clear()
+        return stacks
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, stacks in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stack = collapse_stack(frame)
+                        stacks[stack] = stacks.get(stack, 0) + 1
+
+profiler = SamplingProfiler(PROFILE_INTERVAL_SECONDS)
+
+def is_admin(user):
+    return bool(user and user.is_authenticated and (user.email or '').lower() in ADMIN_EMAILS)
+
+def admin_required(view):
+    """ Só usuários de ADMIN_EMAILS. Vai abaixo do @login_required. """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin(current_user):
+            return jsonify({'error': 'Acesso restrito a administradores'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def top_frames(stacks, limit=PROFILE_TOP_FRAMES):
+    """ Frames com mais amostras no topo da pilha (tempo próprio), com a fração do total. """
+    total = sum(stacks.values())
+    leaves = {}
+    for stack, samples in stacks.items():
+        leaf = stack.rsplit(';', 1)[-1]
+        leaves[leaf] = leaves.get(leaf, 0) + samples
+    return [
+        {'frame': frame, 'samples': samples, 'fraction': round(samples / total, 3)}
+        for frame, samples in heapq.nlargest(limit, leaves.items(), key=lambda item: item[1])
+    ]
+
+def save_profile(capture, stacks):
+    """ Grava <nome>.folded e <nome>.json e apaga as capturas além de PROFILE_KEEP. """
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    name = capture['name']
+    with open(os.path.join(PROFILES_DIR, f'{name}.folded'), 'w') as f:
+        for stack, samples in sorted(stacks.items()):
+            f.write(f"{stack} {samples}\n")
+    capture['samples'] = sum(stacks.values())
+    capture['top_frames'] = top_frames(stacks)
+    meta_path = os.path.join(PROFILES_DIR, f'{name}.json')
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(capture, f)
+    os.replace(meta_path + '.tmp', meta_path) # A listagem nunca lê um .json pela metade
+    metas = sorted(entry for entry in os.listdir(PROFILES_DIR) if entry.endswith('.json'))
+    for old in metas[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+        for suffix in ('.json', '.folded'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(PROFILES_DIR, old[:-len('.json')] + suffix))
+
+def recent_profiles(limit):
+    """ Metadados das capturas mais novas primeiro (o nome começa pelo instante UTC). """
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    profiles = []
+    for entry in sorted((entry for entry in os.listdir(PROFILES_DIR) if entry.endswith('.json')), reverse=True)[:limit]:
+        try:
+            with open(os.path.join(PROFILES_DIR, entry)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue # Apagada pela retenção enquanto listávamos
+    return profiles
+
+@app.before_request
+def start_request_profile():
+    forced = request.headers.get(PROFILE_HEADER) == '1' and is_admin(current_user)
+    if not forced and not (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE):
+        return
+    if request.endpoint in ('static', 'serve_asset', 'list_profiles', 'get_profile'):
+        return
+    started = datetime.utcnow()
+    g.profile = {
+        'name': f"{started:%Y%m%dT%H%M%S%f}-{os.getpid()}-{request.endpoint or 'unknown'}",
+        'at': started.isoformat(),
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'user_id': current_user.get_id(),
+        'forced': forced,
+        'status': None,
+        'started': time.perf_counter(),
+        'thread': threading.get_ident(),
+    }
+    profiler.start(g.profile['thread'])
+
+@app.after_request
+def tag_request_profile(response):
+    capture = g.get('profile')
+    if capture is not None:
+        capture['status'] = response.status_code
+        if capture['forced']:
+            response.headers['X-Profile-Id'] = capture['name']
+    return response
+
+@app.teardown_request
+def finish_request_profile(exc):
+    capture = g.pop('profile', None)
+    if capture is None:
+        return
+    stacks = profiler.stop(capture.pop('thread'))
+    capture['duration_ms'] = round((time.perf_counter() - capture.pop('started')) * 1000, 1)
+    if capture['status'] is None:
+        capture['status'] = 500 # Exceção antes de haver resposta
+    if not stacks or (not capture['forced'] and capture['duration_ms'] < PROFILE_MIN_DURATION_MS):
+        return
+    try:
+        save_profile(capture, stacks)
+        print(f"[PROFILE] {capture['method']} {capture['path']} {capture['duration_ms']}ms -> {capture['name']}")
+    except OSError as e:
+        print(f"[PROFILE WARN] Falha ao gravar a captura {capture['name']}: {e}")
+
 # --- Rotas Flask ---
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -328,7 +3849,11 @@ def logout():
 @app.route('/')
 @login_required
 def index():
-    return render_template('index.html')
+    # ETag fraca: visitas repetidas com o mesmo HTML recebem 304 sem corpo
+    response = make_response(render_template('index.html'))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag(weak=True)
+    return response.make_conditional(request)
 
 @app.route('/cryptocurrencies')
 @login_required
@@ -340,16 +3865,11 @@ def cryptocurrencies():
 @login_required
 def get_open_positions():
     try:
-        open_positions_db = Trade.query.filter(
-            Trade.entry_price.isnot(None),
-            Trade.size.isnot(None),
-            Trade.size != 0,
-            Trade.exit_price.is_(None) # Verifica se exit_price é NULL
-        ).order_by(Trade.timestamp.desc()).all()
-
-        # Converte objetos SQLAlchemy para dicionários JSON serializáveis
-        open_positions_json = [pos.to_dict() for pos in open_positions_db]
-        return jsonify(open_positions_json)
+        # Lê só as colunas necessárias (sem objetos ORM) e serializa direto
+        open_positions_rows = trade_rows(open_positions_query(current_user.id))
+        if request.args.get('layout') == 'columnar':
+            return columnar_trades_response(open_positions_rows)
+        return jsonify(serialize_trade_rows(open_positions_rows))
     except Exception as e:
         print(f"[API /api/positions ERROR] {e}")
         return jsonify({"error": "Erro ao buscar posições abertas"}), 500
@@ -357,27 +3877,93 @@ def get_open_positions():
 # Rota para obter o volume total acumulado (lê do DB)
 @app.route('/api/total_volume', methods=['GET'])
 @login_required
+@cached_result('config:total_volume')
 def get_total_volume():
     try:
-        volume = get_total_volume_from_db()
+        volume = get_total_volume_from_db(current_user.id)
         return jsonify({'total_volume': volume})
     except Exception as e:
         print(f"[API /api/total_volume ERROR] {e}")
         return jsonify({"error": "Erro ao buscar volume total"}), 500
 
+@app.route('/api/volume/rolling', methods=['GET'])
+@login_required
+def get_rolling_volume():
+    days = request.args.get('days', ROLLING_VOLUME_DAYS, type=int)
+    if not days or days < 1 or days > 365:
+        return jsonify({'error': "'days' deve estar entre 1 e 365"}), 400
+    try:
+        today = datetime.utcnow().date()
+        start = today - timedelta(days=days - 1)
+        buckets = VolumeDaily.query.filter(
+            VolumeDaily.user_id == current_user.id, VolumeDaily.day >= start
+        ).order_by(VolumeDaily.day).all()
+        volume = rolling_volume(current_user.id, days, today) # SUM inteiro no banco
+        # O TIER é sempre pela janela de 30 dias, mesmo se 'days' for outro
+        tier_volume = volume if days == ROLLING_VOLUME_DAYS else rolling_volume(current_user.id, today=today)
+        tier, next_tier, next_tier_volume = tier_for_volume(tier_volume)
+        return jsonify({
+            'window_days': days,
+            'start': start.isoformat(),
+            'volume': volume,
+            'tier': tier,
+            'tier_volume_30d': tier_volume,
+            'next_tier': next_tier,
+            'next_tier_volume': next_tier_volume,
+            'remaining_to_next_tier': money(next_tier_volume - tier_volume) if next_tier else None,
+            'daily': [{'date': bucket.day.isoformat(), 'volume': bucket.volume} for bucket in buckets if bucket.volume],
+        })
+    except Exception as e:
+        print(f"[API /api/volume/rolling ERROR] {e}")
+        return jsonify({"error": "Erro ao buscar volume móvel"}), 500
+
+@app.route('/api/sync', methods=['GET'])
+@login_required
+def get_sync():
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', SYNC_PAGE_LIMIT, type=int) or SYNC_PAGE_LIMIT, SYNC_PAGE_LIMIT)
+    if since < 0:
+        return jsonify({'error': "'since' inválido"}), 400
+    try:
+        return jsonify(sync_delta(current_user.id, since, limit))
+    except Exception as e:
+        print(f"[API /api/sync ERROR] {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": "Erro ao buscar alterações"}), 500
+
+# Service worker na raiz para controlar '/' (cache do shell do dashboard para uso offline)
+@app.route('/sw.js')
+def service_worker():
+    response = send_from_directory(app.static_folder, 'js/sw.js', mimetype='application/javascript', max_age=0)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/api/trades', methods=['GET', 'POST'])
 @login_required
+@guard_mutation
+@read_replica
 def handle_trades():
     if request.method == 'GET':
         # GET: Retorna trades FECHADOS do Histórico
+        limit = request.args.get('limit', type=int)
+        if limit is not None and not 1 <= limit <= TRADES_PAGE_MAX:
+            return jsonify({'error': f"'limit' deve estar entre 1 e {TRADES_PAGE_MAX}"}), 400
         try:
-            closed_trades_db = Trade.query.filter(
-                Trade.exit_price.isnot(None)
-            ).order_by(Trade.timestamp.desc()).all()
-
-            # Usa o helper to_dict() do modelo
-            closed_trades_json = [trade.to_dict() for trade in closed_trades_db]
-            return jsonify(closed_trades_json)
+            # Projeção por colunas: evita hidratar um objeto Trade por linha do histórico
+            # O arquivo frio (TradeArchive) só entra quando a página/histórico pedido chega nele
+            if limit:
+                # Paginado: ?limit=N&before=<X-Next-Cursor da página anterior>
+                closed_trades_rows = closed_trade_page_rows(current_user.id, limit, request.args.get('before'))
+            else:
+                closed_trades_rows = closed_trade_rows(current_user.id)
+            if request.args.get('layout') == 'columnar':
+                response = make_response(columnar_trades_response(closed_trades_rows))
+            else:
+                response = jsonify(serialize_trade_rows(closed_trades_rows))
+            if limit and len(closed_trades_rows) == limit:
+                response.headers['X-Next-Cursor'] = closed_trades_rows[-1][0]
+            return response
         except Exception as e:
              print(f"[API /api/trades GET ERROR] {e}")
              return jsonify({"error": "Erro ao buscar histórico de trades"}), 500
@@ -390,7 +3976,7 @@ def handle_trades():
                 return jsonify({'error': 'Dados inválidos (símbolo obrigatório)'}), 400
 
             # --- Preparação dos dados para o novo trade ---
-            trade_id = str(datetime.now().timestamp()) # Gera ID único
+            trade_id = new_trade_id() # ULID: único entre workers e ordenado pelo tempo
             now_dt = datetime.utcnow() # Usar UTC para consistência no DB
 
             # Converte campos numéricos, tratando NaN e vazios como None
@@ -406,16 +3992,20 @@ def handle_trades():
                         parsed_data[field] = None
                 else:
                     parsed_data[field] = None
+            quantize_trade_values(data.get('symbol', 'UNKNOWN'), parsed_data) # Tick/step do mercado
 
             # Usa os dados parseados para calcular taxa e volume
             fee_calc_data = parsed_data.copy()
-            fee_calc_data['tier'] = data.get('tier', DEFAULT_TIER)
+            # Sem TIER (ou 'auto'): usa o TIER atual pelo volume móvel de 30 dias
+            requested_tier = data.get('tier')
+            fee_calc_data['tier'] = requested_tier if requested_tier and requested_tier != 'auto' else current_volume_tier(current_user.id)
             calculated_fee = calculate_trade_fee(fee_calc_data)
             volume_contribution = calculate_volume_contribution(fee_calc_data) # Baseado na entrada
 
             # Cria nova instância do Trade
             new_trade = Trade(
                 id=trade_id,
+                user_id=current_user.id,
                 timestamp=now_dt,
                 symbol=data.get('symbol', 'UNKNOWN').upper(), # Garante caixa alta
                 side=data.get('side'),
@@ -440,12 +4030,11 @@ def handle_trades():
             # Precisa commitar antes de ler o volume para evitar problemas com save_total_volume_to_db
             # db.session.flush() # Garante que new_trade tenha acesso à sessão se necessário
 
-            # Atualiza o volume total
-            current_total_volume = get_total_volume_from_db()
-            updated_total_volume = current_total_volume + (volume_contribution or 0.0)
-            save_total_volume_to_db(updated_total_volume) # Esta função adiciona/atualiza e faz parte do commit
+            # Atualiza o volume do usuário (balde do dia + total; faz parte do commit)
+            adjust_user_volume(current_user.id, [(volume_day(now_dt), volume_contribution or 0.0)])
+            record_trade_event(new_trade, 'created', volume_delta=volume_contribution)
 
-            db.session.commit() # Commita o trade E a atualização do volume
+            db.session.commit() # Commita o trade, a atualização do volume E o evento
             print(f"[ADD TRADE DB] Trade adicionado com ID: {new_trade.id}")
 
             # Retorna o trade adicionado usando to_dict()
@@ -460,12 +4049,18 @@ def handle_trades():
 
 @app.route('/api/trades/<trade_id>', methods=['GET', 'DELETE', 'PUT'])
 @login_required
+@guard_mutation
 def handle_trade(trade_id):
-    # Busca o trade pelo ID no BD
+    # Busca o trade pelo ID no BD (somente trades do usuário logado)
     # Usar with_for_update() pode ser útil se houver muita concorrência, mas complica
-    trade = db.session.get(Trade, trade_id)
+    trade = get_user_trade(current_user.id, trade_id)
 
     if not trade:
+        archived = db.session.get(TradeArchive, trade_id)
+        if archived is not None and archived.user_id == current_user.id:
+            if request.method == 'GET':
+                return jsonify(archived.to_dict()), 200
+            return jsonify({'error': 'Trade arquivado (somente leitura)'}), 409
         return jsonify({'error': 'Trade não encontrado'}), 404
 
     if request.method == 'GET':
@@ -477,14 +4072,15 @@ def handle_trade(trade_id):
             print(f"[DELETE TRADE DB] Recebido pedido para deletar trade ID: {trade_id}")
             volume_to_subtract = trade.volume_contribution or 0.0
             symbol = trade.symbol # Guarda para log
+            trade_day = volume_day(trade.timestamp)
 
-            # Deleta o trade
+            # Deleta o trade (o evento guarda só o ID; o estado anterior está nos eventos passados)
+            record_trade_event(trade, 'deleted', volume_delta=-volume_to_subtract)
+            TradeFill.query.filter_by(trade_id=trade.id).delete()
             db.session.delete(trade)
 
-            # Subtrai a contribuição do volume total
-            current_total_volume = get_total_volume_from_db()
-            updated_total_volume = current_total_volume - volume_to_subtract
-            save_total_volume_to_db(updated_total_volume)
+            # Subtrai a contribuição do volume (balde do dia + total)
+            adjust_user_volume(current_user.id, [(trade_day, -volume_to_subtract)])
 
             db.session.commit() # Commita delete E atualização do volume
             print(f"[DELETE TRADE DB] Trade {trade_id} ({symbol}) deletado. Volume subtraído: {volume_to_subtract}")
@@ -495,6 +4091,8 @@ def handle_trade(trade_id):
             return jsonify({'error': f'Erro interno ao deletar trade: {str(e)}'}), 500
 
     elif request.method == 'PUT':
+        if TradeFill.query.filter_by(trade_id=trade.id).first() is not None:
+            return jsonify({'error': 'Trade com fills: adicione/remova lotes em /api/trades/<id>/fills'}), 409
         try:
             data = request.json
             print(f"[PUT TRADE DB {trade_id}] Dados recebidos: {data}")
@@ -525,6 +4123,7 @@ def handle_trade(trade_id):
                         except (ValueError, TypeError):
                             print(f"[PUT WARN {trade_id}] Valor inválido para '{field}': {value}. Definindo como None.")
                             new_value = None # Garante None em caso de erro
+                    new_value = quantize_trade_values(trade.symbol, {field: new_value})[field]
                     
                     # Define o atributo apenas se o valor mudou
                     if new_value != original_value:
@@ -552,23 +4151,26 @@ def handle_trade(trade_id):
 
             # Recalcular taxa SEMPRE que houver atualização numérica relevante (size, entry, exit)
             # if updated_numeric_fields: # Ou recalcular sempre para garantir?
-            trade_data_for_fee = trade.to_dict() # Usa helper para pegar dados atuais
+            trade_data_for_fee = trade_fee_inputs(trade) # Só os campos usados no cálculo
             trade.calculated_fee = calculate_trade_fee(trade_data_for_fee)
             print(f"[PUT TRADE DB {trade_id}] Taxa recalculada: {trade.calculated_fee}")
 
             # Se entry_price ou size mudou, recalcula contribuição e ajusta total
+            volume_diff = 0.0
             if hasattr(trade, 'entry_price') or hasattr(trade, 'size'): # Verifica se os atributos foram atualizados
-                 trade_data_for_vol = trade.to_dict()
+                 trade_data_for_vol = trade_fee_inputs(trade)
                  new_volume_contribution = calculate_volume_contribution(trade_data_for_vol)
                  volume_diff = (new_volume_contribution or 0.0) - old_volume_contribution
                  if volume_diff != 0:
                     trade.volume_contribution = new_volume_contribution
-                    current_total_volume = get_total_volume_from_db()
-                    save_total_volume_to_db(current_total_volume + volume_diff)
+                    adjust_user_volume(current_user.id, [(volume_day(trade.timestamp), volume_diff)])
                     print(f"[PUT TRADE DB {trade_id}] Volume contribution recalculado para {new_volume_contribution}. Total ajustado por {volume_diff}.")
 
 
-            db.session.commit() # Commita todas as alterações
+            event_type = 'closed' if is_closing_now else 'reopened' if is_reopening_now else 'edited'
+            record_trade_event(trade, event_type, volume_delta=volume_diff)
+
+            db.session.commit() # Commita todas as alterações (e o evento)
             print(f"[PUT TRADE DB {trade_id}] Trade atualizado com sucesso.")
             return jsonify(trade.to_dict()), 200 # Retorna o objeto atualizado
         except Exception as e:
@@ -578,9 +4180,142 @@ def handle_trade(trade_id):
             traceback.print_exc()
             return jsonify({'error': f'Erro interno ao atualizar trade: {str(e)}'}), 500
 
+# Rota Alteração em Lote (fechar/editar várias posições numa transação)
+@app.route('/api/trades', methods=['PATCH'])
+@login_required
+@guard_mutation
+def batch_update_trades():
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': "'items' deve ser uma lista não vazia"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Máximo de {BATCH_MAX_ITEMS} itens por lote'}), 400
+    try:
+        mark_price = parse_optional_float(data.get('mark_price'))
+        mark_prices = {
+            str(symbol).upper(): parse_optional_float(price)
+            for symbol, price in (data.get('mark_prices') or {}).items()
+        }
+    except (ValueError, AttributeError) as e:
+        return jsonify({'error': f'mark_price inválido: {e}'}), 400
+    atomic = bool(data.get('atomic'))
+
+    id_map = resolve_trade_ids(current_user.id, {
+        str(item['id']) for item in items if isinstance(item, dict) and item.get('id') is not None
+    })
+    for item in items:
+        if isinstance(item, dict) and item.get('id') is not None:
+            item['id'] = id_map[str(item['id'])] # IDs antigos -> atuais
+    ids = set(id_map.values())
+    trades = {}
+    with_fills = set() # Trades com fills são derivados dos lotes; alterações passam por /api/trades/<id>/fills
+    if ids:
+        rows = trade_rows(user_trades_query(current_user.id).filter(Trade.id.in_(ids)))
+        trades = {row[0]: dict(zip(TRADE_FIELDS, row)) for row in rows}
+        with_fills = {
+            trade_id for (trade_id,) in db.session.query(TradeFill.trade_id).filter(TradeFill.trade_id.in_(ids)).distinct()
+        }
+
+    now = datetime.utcnow()
+    results = []
+    changed_ids = []
+    event_rows = []
+    net_volume_diff = 0.0
+    volume_moves = []
+    fill_closed = {} # id -> Trade fechado pelos lotes (já alterado na sessão)
+    for item in items:
+        trade_id = str(item.get('id')) if isinstance(item, dict) and item.get('id') is not None else None
+        trade_dict = trades.get(trade_id)
+        if trade_dict is None:
+            results.append({'id': trade_id, 'status': 'error', 'error': 'Trade não encontrado'})
+            continue
+        if trade_id in with_fills:
+            action = item.get('action', 'update')
+            if action not in ('close', 'trigger_close'):
+                results.append({'id': trade_id, 'status': 'error', 'error': 'Trade com fills: use /api/trades/<id>/fills'})
+                continue
+            if trade_dict['exit_price'] is not None:
+                results.append({'id': trade_id, 'status': 'unchanged'})
+                continue
+            # Fechamento de trade com lotes: saída da quantidade em aberto pelo ORM (PnL/taxa dos fills)
+            try:
+                exit_price = batch_exit_price(trade_dict, item, mark_price, mark_prices)
+                with db.session.begin_nested():
+                    trade = db.session.get(Trade, trade_id)
+                    volume_diff = close_trade_fills(trade, quantize(exit_price, symbol_precision(trade.symbol, 'price')), now)
+                    event_type = 'trigger_closed' if action == 'trigger_close' else 'closed'
+                    if action == 'trigger_close':
+                        trade.take_profit = None
+                        trade.stop_loss = None
+                    record_trade_event(trade, event_type, volume_delta=volume_diff)
+            except ValueError as e:
+                results.append({'id': trade_id, 'status': 'error', 'error': str(e)})
+                continue
+            net_volume_diff += volume_diff
+            trade_dict['exit_price'] = trade.exit_price # Um segundo item do mesmo trade vira 'unchanged'
+            fill_closed[trade_id] = trade
+            results.append({'id': trade_id, 'status': event_type})
+            continue
+        before = dict(trade_dict)
+        try:
+            outcome = apply_batch_item(trade_dict, item, mark_price, mark_prices, now)
+        except ValueError as e:
+            trade_dict.update(before) # Item inválido não deixa alteração parcial
+            results.append({'id': trade_id, 'status': 'error', 'error': str(e)})
+            continue
+        if outcome is None:
+            results.append({'id': trade_id, 'status': 'unchanged'})
+            continue
+        event_type, volume_diff = outcome
+        net_volume_diff += volume_diff
+        volume_moves.append((volume_day(trade_dict['timestamp']), volume_diff))
+        if trade_id not in changed_ids:
+            changed_ids.append(trade_id)
+        event_rows.append(trade_event_values(current_user.id, trade_dict_isoformat(trade_dict), event_type, volume_diff))
+        results.append({'id': trade_id, 'status': event_type})
+
+    errors = sum(1 for result in results if result['status'] == 'error')
+    if atomic and errors:
+        db.session.rollback() # Descarta fechamentos de trades com fills já aplicados na sessão
+        return jsonify({'error': 'Lote rejeitado: há itens inválidos', 'results': results}), 422
+
+    try:
+        if changed_ids:
+            # UPDATE em lote pela PK (executemany) + eventos + um único ajuste de volume
+            db.session.execute(db.update(Trade), [
+                {field: trades[trade_id][field] for field in TRADE_FIELDS} for trade_id in changed_ids
+            ])
+            db.session.execute(db.insert(TradeEvent), event_rows)
+            record_sync_changes(current_user.id, 'trade', changed_ids)
+            mark_result_cache_tags(current_user.id, *{f"symbol:{trades[trade_id]['symbol']}" for trade_id in changed_ids})
+            adjust_user_volume(current_user.id, volume_moves)
+        if changed_ids or fill_closed:
+            db.session.commit()
+        print(f"[PATCH TRADES DB] {len(changed_ids) + len(fill_closed)} trades alterados, {errors} erros. Volume ajustado por {net_volume_diff}.")
+    except Exception as e:
+        db.session.rollback()
+        print(f"[API /api/trades PATCH ERROR] Erro ao aplicar lote: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'Erro interno ao aplicar lote: {str(e)}'}), 500
+
+    serialized = {trade_id: trade_dict_isoformat(trades[trade_id]) for trade_id in changed_ids}
+    serialized.update({trade_id: trade.to_dict() for trade_id, trade in fill_closed.items()})
+    for result in results:
+        if result['status'] not in ('error', 'unchanged'):
+            result['trade'] = serialized[result['id']]
+    return jsonify({
+        'results': results,
+        'updated': len(changed_ids) + len(fill_closed),
+        'errors': errors,
+        'volume_delta': money(net_volume_diff),
+    }), 200
+
 # ROTA Fechamento acionado por TP/SL (AJUSTADA para DB)
 @app.route('/api/trades/<trade_id>/trigger_close', methods=['POST'])
 @login_required
+@guard_mutation
 def handle_triggered_close(trade_id):
     print(f"[TRIGGER CLOSE DEBUG {trade_id}] Recebido POST.")
     data = request.json
@@ -594,7 +4329,7 @@ def handle_triggered_close(trade_id):
     except (ValueError, TypeError):
         return jsonify({'error': 'Preço de disparo inválido'}), 400
 
-    trade = db.session.get(Trade, trade_id)
+    trade = get_user_trade(current_user.id, trade_id)
     if not trade:
         return jsonify({'error': 'Trade não encontrado'}), 404
     if trade.exit_price is not None:
@@ -602,6 +4337,25 @@ def handle_triggered_close(trade_id):
         print(f"[TRIGGER CLOSE WARN {trade_id}] Trade já estava fechado.")
         return jsonify(trade.to_dict()), 200 # Retorna o estado atual
 
+    if db.session.query(TradeFill.id).filter_by(trade_id=trade.id).first() is not None:
+        # Trade com lotes: o gatilho vira uma saída da quantidade em aberto (PnL/taxa vêm dos fills)
+        try:
+            volume_diff = close_trade_fills(trade, trigger_price)
+            trade.take_profit = None
+            trade.stop_loss = None
+            record_trade_event(trade, 'trigger_closed', volume_delta=volume_diff)
+            db.session.commit()
+            record_mark_prices({trade.symbol: trigger_price})
+            print(f"[TRIGGER CLOSE DEBUG {trade_id}] Saída dos lotes em aberto @ {trigger_price}. PnL: {trade.pnl}")
+            return jsonify(trade.to_dict()), 200
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': f'Fills inconsistentes: {e}'}), 409
+        except Exception as e:
+            db.session.rollback()
+            print(f"[TRIGGER CLOSE ERROR {trade_id}] Erro: {e}")
+            return jsonify({'error': f'Erro interno ao fechar trade por gatilho: {str(e)}'}), 500
+
     try:
         # Define dados para fechamento
         trade.exit_price = trigger_price
@@ -615,13 +4369,12 @@ def handle_triggered_close(trade_id):
         if entry_price is not None and size is not None and side is not None and trigger_price is not None:
             price_diff = trigger_price - entry_price
             raw_pnl = price_diff * size if side == 'long' else -price_diff * size
-            # Arredonda PnL para um número razoável de casas decimais (ex: 4)
-            calculated_pnl = round(raw_pnl, 4)
+            calculated_pnl = money(raw_pnl) # Na precisão da coluna (micro-USD)
         trade.pnl = calculated_pnl
         print(f"[TRIGGER CLOSE DEBUG {trade_id}] PnL calculado: {trade.pnl}")
 
         # Recalcula taxa FINAL (incluindo saída)
-        trade_data_for_fee = trade.to_dict()
+        trade_data_for_fee = trade_fee_inputs(trade)
         trade.calculated_fee = calculate_trade_fee(trade_data_for_fee)
         print(f"[TRIGGER CLOSE DEBUG {trade_id}] Taxa final recalculada: {trade.calculated_fee}")
 
@@ -629,7 +4382,9 @@ def handle_triggered_close(trade_id):
         trade.take_profit = None
         trade.stop_loss = None
 
+        record_trade_event(trade, 'trigger_closed')
         db.session.commit()
+        record_mark_prices({trade.symbol: trigger_price}) # O gatilho também é uma cotação
         print(f"[TRIGGER CLOSE DEBUG {trade_id}] Trade atualizado e salvo com exit_price={trigger_price}")
 
         # Retorna o trade atualizado
@@ -642,91 +4397,125 @@ def handle_triggered_close(trade_id):
         traceback.print_exc()
         return jsonify({'error': f'Erro interno ao fechar trade por gatilho: {str(e)}'}), 500
 
+# Rotas de Lotes/Fills de um Trade (aumentos de posição e saídas parciais)
+def _trade_fills_response(trade, fills, book=None):
+    if book is None:
+        _, book = rollup_trade_fills(trade, fills) if fills else (0.0, None)
+    return {
+        'trade': trade.to_dict(),
+        'fills': [fill.to_dict() for fill in fills],
+        'open_lots': book.open_lots() if book is not None else [],
+        'matching': LOT_MATCHING_METHOD,
+    }
 
-# Rota de Estatísticas (AJUSTADA para DB e Pandas)
-@app.route('/api/statistics', methods=['GET'])
+@app.route('/api/trades/<trade_id>/fills', methods=['GET', 'POST'])
 @login_required
-def get_statistics_route():
+@guard_mutation
+def handle_trade_fills(trade_id):
+    trade = get_user_trade(current_user.id, trade_id)
+    if not trade:
+        return jsonify({'error': 'Trade não encontrado'}), 404
+
+    if request.method == 'GET':
+        fills = trade_fills_query(trade.id).all()
+        try:
+            response = _trade_fills_response(trade, fills)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': f'Fills inconsistentes: {e}'}), 409
+        db.session.rollback() # GET não persiste o recálculo
+        return jsonify(response), 200
+
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    if kind not in FILL_KINDS:
+        return jsonify({'error': "'kind' deve ser 'entry' ou 'exit'"}), 400
     try:
-        print("[STATS DEBUG DB] Iniciando get_statistics com DB...")
-        # Busca todos os trades do banco de dados
-        all_trades_db = Trade.query.all()
+        price = parse_optional_float(data.get('price'))
+        quantity = parse_optional_float(data.get('quantity'))
+        fee = parse_optional_float(data.get('fee'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not price or price <= 0 or not quantity or quantity <= 0:
+        return jsonify({'error': "'price' e 'quantity' devem ser positivos"}), 400
+    timestamp = parse_datetime_safe(data['timestamp']) if data.get('timestamp') else datetime.utcnow()
+    if timestamp is None:
+        return jsonify({'error': 'Timestamp inválido'}), 400
 
-        default_stats = {
-            'total_pnl': 0.0, 'best_trade': {'pnl': 0.0, 'symbol': '-'}, 'worst_trade': {'pnl': 0.0, 'symbol': '-'},
-            'best_symbol_pnl': 0.0, 'worst_symbol_pnl': 0.0, 'best_symbol': '-', 'worst_symbol': '-',
-            'total_trades': 0, 'symbol_pnl': {}, 'total_fees': 0.0,
-            'winning_trades_count': 0, 'losing_trades_count': 0
-        }
+    try:
+        was_open = trade.exit_price is None
+        old_day, old_volume = volume_day(trade.timestamp), trade.volume_contribution or 0.0
+        fills = trade_fills_query(trade.id).all()
+        if not fills:
+            fills = seed_trade_fills(trade)
+        fill = TradeFill(
+            user_id=current_user.id, trade_id=trade.id, kind=kind, price=price, quantity=quantity,
+            fee=fee if fee is not None else default_fill_fee(trade.tier, kind, price, quantity, timestamp),
+            timestamp=timestamp,
+        )
+        db.session.add(fill)
+        db.session.flush() # IDs desempatam fills com o mesmo timestamp
+        fills = sorted(fills + [fill], key=lambda f: (f.timestamp, f.id))
+        volume_diff, book = rollup_trade_fills(trade, fills)
+        # A entrada mais antiga define o dia do trade; o volume muda de balde se ela mudar
+        adjust_user_volume(current_user.id, [(old_day, -old_volume), (volume_day(trade.timestamp), trade.volume_contribution)])
+        is_closing_now = was_open and trade.exit_price is not None
+        record_trade_event(trade, 'closed' if is_closing_now else 'edited', volume_delta=volume_diff)
+        db.session.commit()
+        print(f"[ADD FILL DB {trade_id}] Fill {kind} {quantity}@{price} adicionado. PnL realizado: {trade.pnl}")
+        return jsonify(_trade_fills_response(trade, fills, book)), 201
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': f'Fill inválido: {e}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"[API /api/trades/{trade_id}/fills POST ERROR] {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'Erro interno ao adicionar fill: {str(e)}'}), 500
 
-        if not all_trades_db:
-            print("[STATS DEBUG DB] Nenhum trade no DB. Retornando default.")
-            return jsonify(default_stats)
+@app.route('/api/trades/<trade_id>/fills/<int:fill_id>', methods=['DELETE'])
+@login_required
+@guard_mutation
+def delete_trade_fill(trade_id, fill_id):
+    trade = get_user_trade(current_user.id, trade_id)
+    if not trade:
+        return jsonify({'error': 'Trade não encontrado'}), 404
+    fills = trade_fills_query(trade.id).all()
+    fill = next((f for f in fills if f.id == fill_id), None)
+    if fill is None:
+        return jsonify({'error': 'Fill não encontrado'}), 404
 
-        # Converte para DataFrame do Pandas
-        trades_list = [
-            {
-                'id': t.id, 'symbol': t.symbol or '-', 'pnl': t.pnl,
-                'exit_price': t.exit_price, 'calculated_fee': t.calculated_fee
-            } for t in all_trades_db
-        ]
-        df = pd.DataFrame(trades_list)
-        print(f"[STATS DEBUG DB] DataFrame criado com shape: {df.shape}")
-
-        # --- Validações e Conversões Essenciais no DataFrame ---
-        df['pnl'] = pd.to_numeric(df['pnl'], errors='coerce').fillna(0)
-        df['calculated_fee'] = pd.to_numeric(df['calculated_fee'], errors='coerce').fillna(0)
-        df['exit_price'] = pd.to_numeric(df['exit_price'], errors='coerce') # NaN se não for número
-        # ---------------------------------------------------------
-
-        # Calcula PnL Total
-        total_pnl = df['pnl'].sum()
-        print(f"[STATS DEBUG DB] total_pnl={total_pnl}")
-
-        # Calcula Taxas Totais (SOMENTE de trades FECHADOS)
-        # Usar pd.notna() é mais robusto que != None
-        closed_trades_df = df[pd.notna(df['exit_price'])]
-        total_fees = closed_trades_df['calculated_fee'].sum()
-        print(f"[STATS DEBUG DB] Taxas Totais SOMADAS (trades fechados): {total_fees}")
-
-        # Conta Trades Vencedores/Perdedores (baseado no PnL salvo)
-        winning_trades_count = df[df['pnl'] > 0].shape[0]
-        losing_trades_count = df[df['pnl'] < 0].shape[0]
-        print(f"[STATS DEBUG DB] Vencedores: {winning_trades_count}, Perdedores: {losing_trades_count}")
-
-        # Encontra melhor/pior trade (usando dados do DataFrame)
-        # Trata caso de DataFrame vazio ou com apenas NaN em PnL
-        idx_max = df['pnl'].idxmax() if not df['pnl'].isnull().all() else None
-        idx_min = df['pnl'].idxmin() if not df['pnl'].isnull().all() else None
-        best_trade_row = df.loc[idx_max] if idx_max is not None else pd.Series({'pnl': 0.0, 'symbol': '-'})
-        worst_trade_row = df.loc[idx_min] if idx_min is not None else pd.Series({'pnl': 0.0, 'symbol': '-'})
-        print(f"[STATS DEBUG DB] Best trade: Pnl={best_trade_row['pnl']}, Symbol={best_trade_row['symbol']}")
-        print(f"[STATS DEBUG DB] Worst trade: Pnl={worst_trade_row['pnl']}, Symbol={worst_trade_row['symbol']}")
-
-        # Calcula PnL por Símbolo
-        symbol_pnl = df.groupby('symbol')['pnl'].sum()
-        print(f"[STATS DEBUG DB] symbol_pnl calculado:\n{symbol_pnl.to_string()}")
-
-        best_symbol_pnl_val = symbol_pnl.max() if not symbol_pnl.empty else 0.0
-        worst_symbol_pnl_val = symbol_pnl.min() if not symbol_pnl.empty else 0.0
-        # Usa .iloc[0] em idxmax/idxmin se o índice não for o símbolo diretamente (pandas >= 1.0)
-        best_symbol = symbol_pnl.idxmax() if not symbol_pnl.empty and pd.notna(symbol_pnl.max()) and symbol_pnl.max() != 0 else '-'
-        worst_symbol = symbol_pnl.idxmin() if not symbol_pnl.empty and pd.notna(symbol_pnl.min()) and symbol_pnl.min() != 0 else '-'
-
-        stats_result = {
-            'total_pnl': round(total_pnl, 2),
-            'best_trade': {'pnl': round(best_trade_row['pnl'], 2), 'symbol': best_trade_row['symbol']},
-            'worst_trade': {'pnl': round(worst_trade_row['pnl'], 2), 'symbol': worst_trade_row['symbol']},
-            'best_symbol_pnl': round(best_symbol_pnl_val, 2),
-            'worst_symbol_pnl': round(worst_symbol_pnl_val, 2),
-            'best_symbol': best_symbol,
-            'worst_symbol': worst_symbol,
-            'total_trades': len(df),
-            'symbol_pnl': symbol_pnl.round(2).to_dict(),
-            'total_fees': round(total_fees, 2),
-            'winning_trades_count': winning_trades_count,
-            'losing_trades_count': losing_trades_count
-        }
+    try:
+        was_open = trade.exit_price is None
+        old_day, old_volume = volume_day(trade.timestamp), trade.volume_contribution or 0.0
+        remaining = [f for f in fills if f.id != fill_id]
+        volume_diff, book = rollup_trade_fills(trade, remaining) # Saída removida pode reabrir a posição
+        db.session.delete(fill)
+        adjust_user_volume(current_user.id, [(old_day, -old_volume), (volume_day(trade.timestamp), trade.volume_contribution)])
+        is_reopening_now = not was_open and trade.exit_price is None
+        record_trade_event(trade, 'reopened' if is_reopening_now else 'edited', volume_delta=volume_diff)
+        db.session.commit()
+        print(f"[DELETE FILL DB {trade_id}] Fill {fill_id} removido.")
+        return jsonify(_trade_fills_response(trade, remaining, book)), 200
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': f'Não é possível remover o fill: {e}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"[API /api/trades/{trade_id}/fills DELETE ERROR] {e}")
+        return jsonify({'error': f'Erro interno ao remover fill: {str(e)}'}), 500
+
+
+# Rota de Estatísticas (AJUSTADA para DB e Pandas)
+@app.route('/api/statistics', methods=['GET'])
+@login_required
+@cached_result('trades')
+@read_replica
+def get_statistics_route():
+    try:
+        print("[STATS DEBUG DB] Iniciando get_statistics com o snapshot colunar...")
+        stats_result = trade_statistics(current_user.id)
         print(f"[STATS DEBUG DB] Estatísticas Finais: {stats_result}")
         return jsonify(stats_result)
 
@@ -745,16 +4534,60 @@ def get_statistics_route():
         return jsonify(default_stats_fallback), 500
 
 
+# Exposição e risco das posições abertas (livro em memória, ver exposure_book)
+@app.route('/api/risk', methods=['GET'])
+@login_required
+def get_risk():
+    events_after = request.args.get('events_after', 0, type=int)
+    try:
+        book = exposure_book(current_user.id)
+        with book.lock:
+            return jsonify(book.to_dict(events_after))
+    except Exception as e:
+        print(f"[API /api/risk ERROR] {e}")
+        return jsonify({"error": "Erro ao calcular exposição"}), 500
+
+@app.route('/api/risk/limits', methods=['GET', 'PUT'])
+@login_required
+@guard_mutation
+def handle_risk_limits():
+    if request.method == 'GET':
+        return jsonify(user_risk_limits(current_user.id))
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Corpo deve ser um objeto {limite: valor}'}), 400
+    unknown = sorted(set(data) - set(RISK_LIMITS))
+    if unknown:
+        return jsonify({'error': f"Limites desconhecidos: {', '.join(unknown)}"}), 400
+    for name, value in data.items():
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            return jsonify({'error': f"'{name}' deve ser um número >= 0 ou null"}), 400
+    try:
+        key = user_config_key('risk_limits', current_user.id)
+        config = db.session.get(ConfigValue, key)
+        overrides = json.loads(config.value) if config and config.value else {}
+        overrides.update(data)
+        if config:
+            config.value = json.dumps(overrides)
+        else:
+            db.session.add(ConfigValue(key=key, value=json.dumps(overrides)))
+        db.session.commit()
+        return jsonify(user_risk_limits(current_user.id))
+    except Exception as e:
+        db.session.rollback()
+        print(f"[API /api/risk/limits ERROR] {e}")
+        return jsonify({"error": "Erro ao salvar limites de risco"}), 500
+
 # --- ROTAS PARA BALANÇO SPOT (AJUSTADAS para DB) ---
 
 @app.route('/api/balances', methods=['GET'])
 @login_required
+@cached_result('balances')
 def get_balances():
     print("[API BALANCES DB] GET /api/balances solicitado.")
     try:
-        balances_db = Balance.query.all()
         # Converte para formato {symbol: amount}
-        balances_dict = {bal.symbol: bal.amount for bal in balances_db}
+        balances_dict = user_balances_dict(current_user.id)
         print(f"[API BALANCES DB] Retornando balanços: {balances_dict}")
         return jsonify(balances_dict)
     except Exception as e:
@@ -763,6 +4596,7 @@ def get_balances():
 
 @app.route('/api/balances/deposit', methods=['POST'])
 @login_required
+@guard_mutation
 def handle_deposit():
     print("[API BALANCES DB] POST /api/balances/deposit solicitado.")
     data = request.json
@@ -781,19 +4615,18 @@ def handle_deposit():
     try:
         # Busca ou cria o registro de balanço
         # Usar .with_for_update() se alta concorrência for esperada (mais complexo)
-        balance = Balance.query.filter_by(symbol=symbol).first()
+        balance = user_balances_query(current_user.id).filter_by(symbol=symbol).first()
         if balance:
             balance.amount += amount
             print(f"[API BALANCES DB] Depositando {amount} para {symbol}. Novo saldo: {balance.amount}")
         else:
-            balance = Balance(symbol=symbol, amount=amount)
+            balance = Balance(user_id=current_user.id, symbol=symbol, amount=amount)
             db.session.add(balance)
             print(f"[API BALANCES DB] Criando balanço e depositando {amount} para {symbol}.")
 
         db.session.commit()
         # Retorna TODOS os balanços atualizados
-        balances_db = Balance.query.all()
-        balances_dict = {bal.symbol: bal.amount for bal in balances_db}
+        balances_dict = user_balances_dict(current_user.id)
         return jsonify({'message': 'Depósito realizado com sucesso', 'balances': balances_dict}), 200
     except Exception as e:
         db.session.rollback()
@@ -802,6 +4635,7 @@ def handle_deposit():
 
 @app.route('/api/balances/withdraw', methods=['POST'])
 @login_required
+@guard_mutation
 def handle_withdraw():
     print("[API BALANCES DB] POST /api/balances/withdraw solicitado.")
     data = request.json
@@ -819,7 +4653,7 @@ def handle_withdraw():
 
     try:
         # Usar .with_for_update() se alta concorrência for esperada
-        balance = Balance.query.filter_by(symbol=symbol).first()
+        balance = user_balances_query(current_user.id).filter_by(symbol=symbol).first()
 
         if not balance or balance.amount < amount:
              current_amount = balance.amount if balance else 0.0
@@ -831,8 +4665,7 @@ def handle_withdraw():
         db.session.commit()
 
         # Retorna TODOS os balanços atualizados
-        balances_db = Balance.query.all()
-        balances_dict = {bal.symbol: bal.amount for bal in balances_db}
+        balances_dict = user_balances_dict(current_user.id)
         return jsonify({'message': 'Saque realizado com sucesso', 'balances': balances_dict}), 200
     except Exception as e:
         db.session.rollback()
@@ -844,6 +4677,8 @@ def handle_withdraw():
 # Rota PnL do Dia (AJUSTADA para DB, usando closed_at_timestamp)
 @app.route('/api/daily_pnl')
 @login_required
+@cached_result('trades', vary=today_key)
+@read_replica
 def get_daily_pnl():
     """Calcula e retorna o PnL total dos trades fechados hoje."""
     try:
@@ -855,11 +4690,7 @@ def get_daily_pnl():
         print(f"[Daily PnL DB] Calculando PnL para {date.today()} (UTC range: {today_start_utc} a {today_end_utc})")
 
         # Soma o PnL de trades onde closed_at_timestamp está no dia de HOJE
-        daily_pnl_sum = db.session.query(func.sum(Trade.pnl)).filter(
-            Trade.closed_at_timestamp >= today_start_utc,
-            Trade.closed_at_timestamp <= today_end_utc,
-            Trade.pnl.isnot(None) # Garante que PnL não seja nulo
-        ).scalar() or 0.0 # Retorna 0.0 se a soma for None (nenhum trade)
+        daily_pnl_sum = sum_closed_between(current_user.id, 'pnl', today_start_utc, today_end_utc)
 
         print(f"[Daily PnL DB] Soma PnL calculada para hoje: {daily_pnl_sum}")
         return jsonify({'daily_pnl': round(daily_pnl_sum, 2)}) # Arredonda
@@ -872,6 +4703,8 @@ def get_daily_pnl():
 # Rota Taxas do Dia (AJUSTADA para DB, usando closed_at_timestamp)
 @app.route('/api/daily_fees')
 @login_required
+@cached_result('trades', vary=today_key)
+@read_replica
 def get_daily_fees():
     """Calcula e retorna a soma das taxas dos trades fechados hoje."""
     try:
@@ -881,11 +4714,7 @@ def get_daily_fees():
         print(f"[Daily Fees DB] Calculando Taxas para {date.today()} (UTC range: {today_start_utc} a {today_end_utc})")
 
         # Soma calculated_fee de trades onde closed_at_timestamp está no dia de HOJE
-        daily_fees_sum = db.session.query(func.sum(Trade.calculated_fee)).filter(
-            Trade.closed_at_timestamp >= today_start_utc,
-            Trade.closed_at_timestamp <= today_end_utc,
-            Trade.calculated_fee.isnot(None) # Garante que taxa não seja nula
-        ).scalar() or 0.0 # Retorna 0.0 se a soma for None
+        daily_fees_sum = sum_closed_between(current_user.id, 'calculated_fee', today_start_utc, today_end_utc)
 
         print(f"[Daily Fees DB] Soma Taxas calculada para hoje: {daily_fees_sum}")
         return jsonify({'daily_fees': round(daily_fees_sum, 2)}) # Arredonda
@@ -903,7 +4732,7 @@ def count_trades_created_today():
         today_end_utc = datetime.combine(date.today(), datetime.max.time())
 
         # Conta trades onde o timestamp ORIGINAL (criação) está no dia de HOJE
-        count = Trade.query.filter(
+        count = user_trades_query(current_user.id).filter(
             Trade.timestamp >= today_start_utc,
             Trade.timestamp <= today_end_utc
         ).count()
@@ -920,52 +4749,68 @@ def count_trades_created_today():
 # Rota Histórico de PNL Líquido Diário (AJUSTADA para DB)
 @app.route('/api/daily_pnl_history')
 @login_required
+@cached_result('trades')
+@read_replica
 def get_daily_pnl_history():
     try:
+        # ?since=AAAA-MM-DD limita o histórico; o arquivo frio só é lido se o intervalo chegar nele
+        since = request.args.get('since')
+        start = None
+        if since:
+            try:
+                start = datetime.combine(date.fromisoformat(since), datetime.min.time())
+            except ValueError:
+                return jsonify({'error': "'since' deve ser uma data AAAA-MM-DD"}), 400
+
         # Agrupa por data de fechamento e soma PnL e Taxas
         # ATENÇÃO: Funções de data podem variar entre bancos de dados (DATE() funciona bem em SQLite e PostgreSQL)
         # Usar CAST para Date pode ser mais portável se DATE() não for universal
         # Exemplo com CAST: func.cast(Trade.closed_at_timestamp, db.Date)
-        daily_summary = db.session.query(
-            func.date(Trade.closed_at_timestamp).label('closure_date'),
-            func.sum(Trade.pnl).label('pnl_sum'),
-            func.sum(Trade.calculated_fee).label('fee_sum')
-        ).filter(
-            Trade.closed_at_timestamp.isnot(None),
-            Trade.pnl.isnot(None),
-            Trade.calculated_fee.isnot(None)
-        ).group_by(
-            func.date(Trade.closed_at_timestamp) # Agrupa pela data
-        ).order_by(
-            func.date(Trade.closed_at_timestamp).desc() # Ordena pela data desc
-        ).all()
-
-        history = []
-        for result in daily_summary:
-            # result.closure_date pode ser string ou date object dependendo do DB/driver
-            closure_date_str = None
-            if isinstance(result.closure_date, date):
-                closure_date_str = result.closure_date.isoformat()
-            elif isinstance(result.closure_date, str):
-                 # Tenta parsear a string para validar e padronizar
-                 try:
-                      parsed_date = date.fromisoformat(result.closure_date)
-                      closure_date_str = parsed_date.isoformat()
-                 except ValueError:
-                     print(f"[PNL History WARN] Formato de data inválido retornado do DB: {result.closure_date}")
+        daily_totals = {}
+        for model in trade_models_for_range(current_user.id, start):
+            filters = [
+                model.user_id == current_user.id,
+                model.closed_at_timestamp.isnot(None),
+                model.pnl.isnot(None),
+                model.calculated_fee.isnot(None)
+            ]
+            if start is not None:
+                filters.append(model.closed_at_timestamp >= start)
+            daily_summary = db.session.query(
+                func.date(model.closed_at_timestamp).label('closure_date'),
+                func.sum(model.pnl).label('pnl_sum'),
+                func.sum(model.calculated_fee).label('fee_sum')
+            ).filter(*filters).group_by(
+                func.date(model.closed_at_timestamp) # Agrupa pela data
+            ).all()
+
+            for result in daily_summary:
+                # result.closure_date pode ser string ou date object dependendo do DB/driver
+                closure_date_str = None
+                if isinstance(result.closure_date, date):
+                    closure_date_str = result.closure_date.isoformat()
+                elif isinstance(result.closure_date, str):
+                     # Tenta parsear a string para validar e padronizar
+                     try:
+                          parsed_date = date.fromisoformat(result.closure_date)
+                          closure_date_str = parsed_date.isoformat()
+                     except ValueError:
+                         print(f"[PNL History WARN] Formato de data inválido retornado do DB: {result.closure_date}")
+                         continue # Pula esta entrada
+                else:
+                     print(f"[PNL History WARN] Tipo inesperado para closure_date: {type(result.closure_date)}")
                      continue # Pula esta entrada
-            else:
-                 print(f"[PNL History WARN] Tipo inesperado para closure_date: {type(result.closure_date)}")
-                 continue # Pula esta entrada
 
-            net_pnl = round((result.pnl_sum or 0.0) - (result.fee_sum or 0.0), 2)
-            history.append({
-                'date': closure_date_str,
-                'net_pnl': net_pnl
-            })
+                # Um dia pode ter trades na tabela quente e no arquivo: soma as duas partes
+                daily_totals[closure_date_str] = daily_totals.get(closure_date_str, 0.0) + (result.pnl_sum or 0.0) - (result.fee_sum or 0.0)
+
+        # Ordena pela data desc (ISO ordena como texto)
+        history = [
+            {'date': closure_date_str, 'net_pnl': round(net_pnl, 2)}
+            for closure_date_str, net_pnl in sorted(daily_totals.items(), reverse=True)
+        ]
 
         print(f"[PNL History DB] Histórico calculado: {len(history)} dias.")
-        # A ordenação já foi feita no banco de dados
         return jsonify(history)
     except Exception as e:
          print(f"[API /api/daily_pnl_history ERROR] {e}")
@@ -973,15 +4818,99 @@ def get_daily_pnl_history():
          traceback.print_exc()
          return jsonify({"error": "Erro ao buscar histórico de PNL diário"}), 500
 
-# Rota Buscar Dados de Mercado (AGORA USA CoinMarketCap)
-@app.route('/api/market_data')
+# Rotas de Jobs em Background (processados pelo 'flask worker')
+@app.route('/api/jobs', methods=['GET', 'POST'])
 @login_required
-def get_market_data():
-    # Pega os IDs da query string (ainda no formato CoinGecko ID)
-    ids_param = request.args.get('ids')
-    if not ids_param:
-        return jsonify({"error": "Parâmetro 'ids' é obrigatório"}), 400
+@guard_mutation
+def handle_jobs():
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        kind = data.get('kind')
+        if kind not in JOB_HANDLERS:
+            return jsonify({'error': f"Tipo de job inválido. Use um de: {', '.join(sorted(JOB_HANDLERS))}"}), 400
+        params = data.get('params') or {}
+        if not isinstance(params, dict):
+            return jsonify({'error': "'params' deve ser um objeto"}), 400
+        try:
+            job, created = enqueue_job(current_user.id, kind, params)
+            print(f"[API /api/jobs] Job {job.id} ({kind}) {'enfileirado' if created else 'já pendente'}.")
+            response = jsonify(job.to_dict())
+            response.headers['Location'] = url_for('get_job', job_id=job.id)
+            return response, 202
+        except Exception as e:
+            db.session.rollback()
+            print(f"[API /api/jobs POST ERROR] {e}")
+            return jsonify({'error': 'Erro ao enfileirar job'}), 500
+
+    jobs = Job.query.filter_by(user_id=current_user.id).order_by(Job.id.desc()).limit(50).all()
+    return jsonify([job.to_dict() for job in jobs])
 
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(job.to_dict())
+
+# Export do histórico fechado em streaming (CSV ou NDJSON)
+@app.route('/api/trades/export', methods=['GET'])
+@login_required
+def export_trades():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"'format' deve ser um de: {', '.join(EXPORT_FORMATS)}"}), 400
+    response = app.response_class(stream_with_context(export_trades_chunks(current_user.id, fmt)), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=trades.{fmt}'
+    return response
+
+# Capturas do profiler por amostragem (admins; ver SamplingProfiler)
+@app.route('/admin/profiles', methods=['GET'])
+@login_required
+@admin_required
+def list_profiles():
+    limit = request.args.get('limit', 50, type=int)
+    if not limit or not 1 <= limit <= PROFILE_KEEP:
+        return jsonify({'error': f"'limit' deve estar entre 1 e {PROFILE_KEEP}"}), 400
+    return jsonify({
+        'sample_rate': PROFILE_SAMPLE_RATE,
+        'interval_ms': PROFILE_INTERVAL_SECONDS * 1000,
+        'profiles': recent_profiles(limit),
+    })
+
+@app.route('/admin/profiles/<name>', methods=['GET'])
+@login_required
+@admin_required
+def get_profile(name):
+    """ Pilhas colapsadas da captura (flamegraph.pl, speedscope, inferno). """
+    if not os.path.exists(os.path.join(PROFILES_DIR, f'{name}.folded')):
+        return jsonify({'error': 'Captura não encontrada'}), 404
+    return send_from_directory(PROFILES_DIR, f'{name}.folded', mimetype='text/plain', max_age=0)
+
+# Listagem da página de Cryptomoedas (CoinGecko via cache compartilhado; ver current_market_listing)
+@app.route('/api/markets', methods=['GET'])
+@login_required
+def get_markets():
+    listing = current_market_listing()
+    if listing is None:
+        return jsonify({'error': 'Listagem de mercado indisponível no momento'}), 502
+    body, fetched_at, state = listing
+    age = max(0, int(time.time() - fetched_at))
+    response = app.response_class(body, mimetype='application/json')
+    response.headers['X-Cache'] = state
+    response.headers['Age'] = str(age)
+    response.headers['Cache-Control'] = f'private, max-age={max(0, int(MARKETS_REFRESH_SECONDS) - age)}'
+    response.set_etag(f"markets-{int(fetched_at * 1000)}") # Uma versão por busca no upstream
+    return response.make_conditional(request)
+
+# Cotações da CoinMarketCap: montagem do pedido e leitura da resposta ficam fora da rota para o
+# handler async do modo ASGI (asgi.py) responder exatamente igual
+def cmc_quotes_request(ids_param):
+    """ Converte os IDs CoinGecko pedidos em ((url, headers, params, {símbolo CMC: ID original}), erro).
+
+    erro = (mensagem, status) quando não há o que consultar ou falta a chave; mensagem None =
+    nenhum símbolo mapeado (responde {}).
+    """
     print(f"[Market Data API] Recebido pedido para IDs (formato CoinGecko): {ids_param}")
 
     # Converte IDs CoinGecko para Símbolos CoinMarketCap (MAIÚSCULOS)
@@ -999,18 +4928,17 @@ def get_market_data():
     if not symbols_to_query:
         print("[Market Data API ERROR] Nenhum símbolo válido encontrado após mapeamento.")
         # Retorna vazio ou erro? Retornar vazio pode ser melhor para o frontend
-        return jsonify({}) # Retorna objeto vazio se nenhum símbolo puder ser consultado
+        return None, (None, 200)
 
     symbols_param = ','.join(symbols_to_query)
     print(f"[Market Data API] Símbolos mapeados para consulta CoinMarketCap: {symbols_param}")
 
-
     # Pega a chave da API CoinMarketCap das variáveis de ambiente
     api_key = os.environ.get('COINMARKETCAP_API_KEY')
     if not api_key:
         print("[Market Data API ERROR] Chave da API CoinMarketCap (COINMARKETCAP_API_KEY) não está configurada no ambiente.")
         # Sem chave, a API Pro da CMC não funcionará.
-        return jsonify({"error": "Configuração interna do servidor incompleta (API Key ausente)"}), 500
+        return None, ("Configuração interna do servidor incompleta (API Key ausente)", 500)
 
     headers = {
         'Accepts': 'application/json',
@@ -1019,70 +4947,95 @@ def get_market_data():
 
     # Endpoint da CoinMarketCap (v2/cryptocurrency/quotes/latest é mais recente, verificar docs se necessário)
     # Usando a v1 por enquanto como exemplo comum
-    # ATENÇÃO: Use a URL Sandbox para testes se disponível: 'https://sandbox-api.coinmarketcap.com/...'
-    market_url = 'https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest'
+    # Sandbox/testes de carga: COINMARKETCAP_API_URL=https://sandbox-api.coinmarketcap.com (ou o loadtest/fake_cmc.py)
+    market_url = f'{COINMARKETCAP_API_URL}/v1/cryptocurrency/quotes/latest'
     parameters = {
         'symbol': symbols_param, # Usa os símbolos mapeados
         'convert': 'USD'       # Pede a cotação em USD
     }
+    return (market_url, headers, parameters, original_id_map), None
 
+def cmc_quotes_payload(cmc_data, original_id_map):
+    """ (resposta {coingecko_id: {'usd': preço}}, erro) do JSON da CMC; erro = (mensagem, 502) sem dados. """
     market_data_response_final = {} # Resposta final no formato { coingecko_id: { usd: price } }
-    try:
-        response = requests.get(market_url, headers=headers, params=parameters, timeout=10)
-        response.raise_for_status() # Lança erro para 4xx/5xx
-        cmc_data = response.json()
-        print(f"[Market Data API] Resposta recebida da CoinMarketCap: Status {cmc_data.get('status', {}).get('error_code', 'N/A')}")
-
-
-        # --- Processamento da Resposta da CoinMarketCap ---
-        # A estrutura é diferente: { "data": { "BTC": { ... }, "ETH": { ... } }, "status": { ... } }
-        if 'data' in cmc_data and cmc_data['data']:
-            for symbol, details in cmc_data['data'].items():
-                # symbol aqui é o símbolo CMC (ex: 'BTC')
-                if symbol in original_id_map: # Verifica se temos o ID original mapeado
-                    coingecko_id = original_id_map[symbol] # Pega o ID original (ex: 'bitcoin')
-                    
-                    usd_quote = details.get('quote', {}).get('USD', {})
-                    current_price = usd_quote.get('price')
-
-                    if current_price is not None:
-                         market_data_response_final[coingecko_id] = {
-                             'usd': current_price,
-                             # 'image': None # CoinMarketCap geralmente não retorna imagem neste endpoint
-                         }
-                    else:
-                         print(f"[Market Data API WARN] Preço USD não encontrado na resposta da CMC para o símbolo {symbol} (ID {coingecko_id}).")
-                         market_data_response_final[coingecko_id] = {'usd': None} # Indica que não foi encontrado
-
+    print(f"[Market Data API] Resposta recebida da CoinMarketCap: Status {cmc_data.get('status', {}).get('error_code', 'N/A')}")
+
+    # --- Processamento da Resposta da CoinMarketCap ---
+    # A estrutura é diferente: { "data": { "BTC": { ... }, "ETH": { ... } }, "status": { ... } }
+    if 'data' in cmc_data and cmc_data['data']:
+        for symbol, details in cmc_data['data'].items():
+            # symbol aqui é o símbolo CMC (ex: 'BTC')
+            if symbol in original_id_map: # Verifica se temos o ID original mapeado
+                coingecko_id = original_id_map[symbol] # Pega o ID original (ex: 'bitcoin')
+
+                usd_quote = details.get('quote', {}).get('USD', {})
+                current_price = usd_quote.get('price')
+
+                if current_price is not None:
+                     record_mark_prices({symbol: current_price}) # Cotação para o livro de exposição
+                     market_data_response_final[coingecko_id] = {
+                         'usd': current_price,
+                         # 'image': None # CoinMarketCap geralmente não retorna imagem neste endpoint
+                     }
                 else:
-                     print(f"[Market Data API WARN] Símbolo {symbol} retornado pela CMC não encontrado no mapeamento original_id_map.")
+                     print(f"[Market Data API WARN] Preço USD não encontrado na resposta da CMC para o símbolo {symbol} (ID {coingecko_id}).")
+                     market_data_response_final[coingecko_id] = {'usd': None} # Indica que não foi encontrado
 
-        else:
-            # Pode haver um erro no status, mesmo com código 200
-            status_info = cmc_data.get('status', {})
-            error_code = status_info.get('error_code')
-            error_message = status_info.get('error_message', 'Erro desconhecido na resposta da API.')
-            print(f"[Market Data API ERROR] Resposta da CoinMarketCap não contém dados válidos. Status: {error_code} - {error_message}")
-            # Decide se retorna erro 500 ou objeto vazio
-            return jsonify({"error": f"Erro da API externa: {error_message}"}), 502 # Bad Gateway
+            else:
+                 print(f"[Market Data API WARN] Símbolo {symbol} retornado pela CMC não encontrado no mapeamento original_id_map.")
 
-        print(f"[Market Data API] Dados processados para {len(market_data_response_final)} IDs.")
+    else:
+        # Pode haver um erro no status, mesmo com código 200
+        status_info = cmc_data.get('status', {})
+        error_code = status_info.get('error_code')
+        error_message = status_info.get('error_message', 'Erro desconhecido na resposta da API.')
+        print(f"[Market Data API ERROR] Resposta da CoinMarketCap não contém dados válidos. Status: {error_code} - {error_message}")
+        # Decide se retorna erro 500 ou objeto vazio
+        return None, (f"Erro da API externa: {error_message}", 502) # Bad Gateway
+
+    print(f"[Market Data API] Dados processados para {len(market_data_response_final)} IDs.")
+    return market_data_response_final, None
+
+def cmc_http_error(status_code):
+    """ (mensagem, status da nossa resposta) para um erro HTTP da CoinMarketCap. """
+    # Trata erros específicos da CoinMarketCap se necessário (ex: 401 Unauthorized, 403 Forbidden, 429 Too Many Requests)
+    error_msg = "Erro ao buscar dados de mercado externos"
+    if status_code == 401 or status_code == 403:
+         error_msg = "Chave de API CoinMarketCap inválida ou não autorizada."
+    elif status_code == 429:
+         error_msg = "Limite de requisições da API CoinMarketCap atingido."
+    # Retorna o status code original se for um erro do cliente (4xx)
+    return error_msg, status_code if 400 <= status_code < 500 else 502
 
+# Rota Buscar Dados de Mercado (AGORA USA CoinMarketCap)
+@app.route('/api/market_data')
+@login_required
+def get_market_data():
+    # Pega os IDs da query string (ainda no formato CoinGecko ID)
+    ids_param = request.args.get('ids')
+    if not ids_param:
+        return jsonify({"error": "Parâmetro 'ids' é obrigatório"}), 400
+    cmc_request, error = cmc_quotes_request(ids_param)
+    if error:
+        message, status = error
+        return (jsonify({"error": message}), status) if message else jsonify({}) # Objeto vazio se nenhum símbolo puder ser consultado
+    market_url, headers, parameters, original_id_map = cmc_request
 
+    try:
+        response = requests.get(market_url, headers=headers, params=parameters, timeout=10)
+        response.raise_for_status() # Lança erro para 4xx/5xx
+        market_data_response_final, error = cmc_quotes_payload(response.json(), original_id_map)
+        if error:
+            message, status = error
+            return jsonify({"error": message}), status
     except requests.exceptions.Timeout:
         print("[Market Data API] Erro: Timeout ao conectar com CoinMarketCap API.")
         return jsonify({"error": "Timeout ao buscar dados de mercado externos"}), 504
     except requests.exceptions.RequestException as e:
-        # Trata erros específicos da CoinMarketCap se necessário (ex: 401 Unauthorized, 403 Forbidden, 429 Too Many Requests)
         status_code = e.response.status_code if e.response is not None else 500
         print(f"[Market Data API] Erro {status_code} ao buscar dados da CoinMarketCap API: {e}")
-        error_msg = "Erro ao buscar dados de mercado externos"
-        if status_code == 401 or status_code == 403:
-             error_msg = "Chave de API CoinMarketCap inválida ou não autorizada."
-        elif status_code == 429:
-             error_msg = "Limite de requisições da API CoinMarketCap atingido."
-        # Retorna o status code original se for um erro do cliente (4xx)
-        return jsonify({"error": error_msg}), status_code if 400 <= status_code < 500 else 502
+        error_msg, status = cmc_http_error(status_code)
+        return jsonify({"error": error_msg}), status
     except Exception as e:
         print(f"[Market Data API] Erro inesperado: {e}")
         import traceback
@@ -1136,6 +5089,314 @@ def create_user(email, password):
         db.session.rollback()
         print(f"Error creating user: {e}")
 
+@app.cli.command("sync-fills")
+@click.argument("email")
+@click.option("--fixture", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Read fills from a recorded JSON file instead of the Backpack API.")
+@click.option("--batch-size", default=500, show_default=True, help="Fills per page/commit.")
+@click.option("--reset", is_flag=True, help="Restart from the beginning (already imported fills are skipped).")
+def sync_fills_command(email, fixture, batch_size, reset):
+    """Imports Backpack fills for the user and aggregates them into trades."""
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        print(f"Error: User with email {email} not found.")
+        return
+
+    if fixture:
+        source = FixtureFillSource(fixture)
+    else:
+        api_key = os.environ.get('BACKPACK_API_KEY')
+        api_secret = os.environ.get('BACKPACK_API_SECRET')
+        if not api_key or not api_secret:
+            print("Error: BACKPACK_API_KEY and BACKPACK_API_SECRET must be set (or use --fixture).")
+            return
+        source = BackpackFillSource(api_key, api_secret)
+
+    try:
+        totals = sync_fills(user.id, source, batch_size=batch_size, reset_cursor=reset)
+        print(f"Synced {totals['inserted']} new fills ({totals['fetched']} fetched, "
+              f"{totals['batches']} batches). Cursor: {totals['cursor']}.")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error syncing fills: {e}")
+
+@app.cli.command("rebuild-derived")
+@click.argument("email")
+@click.option("--from-scratch", is_flag=True, help="Ignore snapshots and replay every event.")
+@click.option("--apply", "apply_changes", is_flag=True, help="Overwrite the stored total_volume with the replayed value.")
+def rebuild_derived_command(email, from_scratch, apply_changes):
+    """Replays the trade event log to rebuild total volume, statistics and daily rollups."""
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        print(f"Error: User with email {email} not found.")
+        return
+
+    try:
+        state, applied = replay_trade_events(user.id, from_scratch=from_scratch)
+        stored_volume = get_total_volume_from_db(user.id)
+        drift = stored_volume - state.total_volume
+        print(f"Replayed {applied} events (last event {state.last_event_id}).")
+        print(f"total_volume: stored={stored_volume:.4f} replayed={state.total_volume:.4f} drift={drift:.4f}")
+        print(f"statistics: {json.dumps(state.to_statistics())}")
+        print(f"daily rollups: {len(state.daily)} days")
+        if apply_changes:
+            save_total_volume_to_db(user.id, state.total_volume)
+            print("Stored total_volume replaced by the replayed value.")
+        db.session.commit() # Persiste snapshots (e o volume, com --apply)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error rebuilding derived state: {e}")
+
+@app.cli.command("set-fee-rate")
+@click.argument("tier")
+@click.argument("side", type=click.Choice(FEE_SIDES))
+@click.argument("rate", type=float)
+@click.option("--effective-from", default=None, help="ISO date/time the rate starts to apply (default: now, UTC).")
+@click.option("--note", default=None, help="Free-text note (e.g. link to the exchange announcement).")
+@click.option("--no-recompute", is_flag=True, help="Only edit the schedule; do not touch existing trades.")
+def set_fee_rate_command(tier, side, rate, effective_from, note, no_recompute):
+    """Adds (or replaces) a fee-schedule rate and recomputes the trades in its validity window."""
+    start = parse_datetime_safe(effective_from) if effective_from else datetime.utcnow()
+    if start is None:
+        print(f"Error: invalid --effective-from: {effective_from}")
+        return
+
+    entry = FeeSchedule.query.filter_by(tier=tier, side=side, effective_from=start).first()
+    if entry:
+        entry.rate = rate
+        entry.note = note or entry.note
+    else:
+        db.session.add(FeeSchedule(tier=tier, side=side, rate=rate, effective_from=start, note=note))
+    version = bump_fee_schedule_version()
+    db.session.commit()
+    end = get_fee_schedule().next_change(tier, side, start)
+    print(f"Fee schedule v{version}: TIER {tier} {side} = {rate} from {start.isoformat()}"
+          f" until {end.isoformat() if end else 'further notice'}.")
+    if no_recompute:
+        return
+    checked, changed = recompute_schedule_window_fees(tier, side, start, end)
+    print(f"Recomputed {checked} affected trades ({changed} fees changed).")
+
+@app.cli.command("delete-fee-rate")
+@click.argument("schedule_id", type=int)
+@click.option("--no-recompute", is_flag=True, help="Only edit the schedule; do not touch existing trades.")
+def delete_fee_rate_command(schedule_id, no_recompute):
+    """Removes a fee-schedule rate; its window falls back to the previous rate."""
+    entry = db.session.get(FeeSchedule, schedule_id)
+    if not entry:
+        print(f"Error: fee schedule entry {schedule_id} not found.")
+        return
+
+    tier, side, start = entry.tier, entry.side, entry.effective_from
+    db.session.delete(entry)
+    version = bump_fee_schedule_version()
+    db.session.commit()
+    print(f"Fee schedule v{version}: removed TIER {tier} {side} from {start.isoformat()}.")
+    if no_recompute:
+        return
+    end = get_fee_schedule().next_change(tier, side, start)
+    checked, changed = recompute_schedule_window_fees(tier, side, start, end)
+    print(f"Recomputed {checked} affected trades ({changed} fees changed).")
+
+@app.cli.command("list-fee-schedule")
+@click.option("--tier", default=None, help="Only show this TIER.")
+def list_fee_schedule_command(tier):
+    """Lists the fee schedule (rates by TIER, side and effective date)."""
+    query = FeeSchedule.query
+    if tier:
+        query = query.filter_by(tier=tier)
+    entries = query.order_by(FeeSchedule.tier, FeeSchedule.side, FeeSchedule.effective_from).all()
+    print(f"Fee schedule version: {get_fee_schedule_version() or '-'}")
+    for entry in entries:
+        print(f"{entry.id:>5}  TIER {entry.tier:<5} {entry.side:<5} {entry.rate:.6f}  from {entry.effective_from.isoformat()}"
+              f"{'  # ' + entry.note if entry.note else ''}")
+
+@app.cli.command("recompute-fees")
+@click.option("--tier", required=True, help="TIER whose trades should be recomputed.")
+@click.option("--side", type=click.Choice(FEE_SIDES), required=True, help="maker (entry time) or taker (close time).")
+@click.option("--since", required=True, help="ISO date/time; start of the window (inclusive).")
+@click.option("--until", default=None, help="ISO date/time; end of the window (exclusive).")
+def recompute_fees_command(tier, side, since, until):
+    """Recomputes calculated_fee for trades of a TIER inside a time window (all users)."""
+    start = parse_datetime_safe(since)
+    end = parse_datetime_safe(until) if until else None
+    if start is None or (until and end is None):
+        print("Error: invalid --since/--until.")
+        return
+    checked, changed = recompute_schedule_window_fees(tier, side, start, end)
+    print(f"Recomputed {checked} trades ({changed} fees changed).")
+
+@app.cli.command("compact-sync-log")
+def compact_sync_log_command():
+    """Drops sync changes superseded by a newer change to the same record (deltas stay correct)."""
+    latest_ids = db.select(func.max(SyncChange.id)).group_by(
+        SyncChange.user_id, SyncChange.entity, SyncChange.entity_key
+    )
+    removed = db.session.execute(db.delete(SyncChange).where(SyncChange.id.not_in(latest_ids))).rowcount
+    db.session.commit()
+    print(f"Removed {removed} superseded sync changes.")
+
+@app.cli.command("analytics-snapshot")
+@click.option("--email", default=None, help="Only this user (default: all users).")
+@click.option("--rebuild", is_flag=True, help="Write a fresh generation instead of appending new closes.")
+@click.option("--report", is_flag=True, help="Print the lifetime statistics read from the snapshot.")
+def analytics_snapshot_command(email, rebuild, report):
+    """Refreshes the memory-mapped columnar snapshot of closed trades (run periodically, e.g. from cron)."""
+    if email:
+        users = User.query.filter_by(email=email).all()
+        if not users:
+            print(f"Error: User with email {email} not found.")
+            return
+    else:
+        users = User.query.order_by(User.id).all()
+
+    for user in users:
+        meta = refresh_analytics_snapshot(user.id, rebuild=rebuild)
+        print(f"{user.email}: {meta['count']} closed trades (generation {meta['generation']}, version {meta['version']}).")
+        if report:
+            print(json.dumps(trade_statistics(user.id)))
+
+@app.cli.command("archive-trades")
+@click.option("--older-than", "older_than", type=int, required=True,
+              help=f"Archive trades closed more than N days ago (minimum {ARCHIVE_MIN_AGE_DAYS}).")
+@click.option("--email", default=None, help="Only this user (default: all users).")
+@click.option("--batch-size", default=1000, show_default=True, help="Trades moved per transaction.")
+def archive_trades_command(older_than, email, batch_size):
+    """Moves old closed trades to the cold archive table (history, stats and volume stay intact)."""
+    if older_than < ARCHIVE_MIN_AGE_DAYS:
+        print(f"Error: --older-than must be at least {ARCHIVE_MIN_AGE_DAYS}.")
+        return
+    if email:
+        users = User.query.filter_by(email=email).all()
+        if not users:
+            print(f"Error: User with email {email} not found.")
+            return
+    else:
+        users = User.query.order_by(User.id).all()
+
+    cutoff = datetime.combine(date.today() - timedelta(days=older_than), datetime.min.time())
+    try:
+        for user in users:
+            moved = archive_closed_trades(user.id, cutoff, batch_size=batch_size)
+            print(f"{user.email}: archived {moved} trades closed before {cutoff.date().isoformat()}.")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error archiving trades: {e}")
+
+@app.cli.command("backtest")
+@click.argument("email")
+@click.option("--rule", type=click.Choice(sorted(backtest.RULES)), default='fixed', show_default=True)
+@click.option("--tp-pct", default=None, help="fixed: take-profit levels in %, comma-separated (0 = none).")
+@click.option("--sl-pct", default=None, help="fixed: stop-loss levels in %, comma-separated (0 = none).")
+@click.option("--tp-atr", default=None, help="atr: take-profit levels as ATR multiples, comma-separated.")
+@click.option("--sl-atr", default=None, help="atr: stop-loss levels as ATR multiples, comma-separated.")
+@click.option("--trail-pct", default=None, help="trailing: trailing-stop distances in %, comma-separated.")
+@click.option("--prices", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="JSON {symbol: [[timestamp, price], ...]} (default: replay the user's Backpack fills).")
+@click.option("--since", default=None, help="Only trades opened at or after this ISO date.")
+@click.option("--workers", default=0, help="Processes for the parameter grid (default: CPU count).")
+@click.option("--top", default=10, show_default=True, help="Best combinations to print (by net PnL).")
+def backtest_command(email, rule, tp_pct, sl_pct, tp_atr, sl_atr, trail_pct, prices, since, workers, top):
+    """Re-simulates closed trades under alternative TP/SL rules and reports PnL, fee and drawdown deltas."""
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        print(f"Error: User with email {email} not found.")
+        return
+
+    try:
+        values = {
+            name: [float(v) for v in raw.split(',') if v.strip()]
+            for name, raw in (('tp_pct', tp_pct), ('sl_pct', sl_pct), ('tp_atr', tp_atr),
+                              ('sl_atr', sl_atr), ('trail_pct', trail_pct)) if raw
+        }
+        grid = backtest.parameter_grid(rule, values)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    since_dt = parse_datetime_safe(since) if since else None
+    if since and since_dt is None:
+        print("Error: invalid --since.")
+        return
+
+    started = time.perf_counter()
+    trades = backtest_trades(user.id, since_dt)
+    if len(trades['id']) == 0:
+        print("No closed trades with entry, exit and size to simulate.")
+        return
+    series = backtest_price_series(user.id, prices)
+    paths = backtest.TradePaths(trades, series)
+    baseline, results = backtest.run_backtest(paths, rule, grid, workers=workers or None)
+    elapsed = time.perf_counter() - started
+
+    ticks = len(paths.price) - len(paths)
+    print(f"{len(paths)} trades x {len(grid)} combinations ({ticks} price ticks) in {elapsed:.2f}s.")
+    print(f"actual: net={baseline['net']:.2f} pnl={baseline['pnl']:.2f} fees={baseline['fees']:.2f} "
+          f"max_drawdown={baseline['max_drawdown']:.2f}")
+    for result in sorted(results, key=lambda r: r['net'], reverse=True)[:top]:
+        params = ' '.join(f"{name}={result[name]:g}" for name in backtest.RULES[rule])
+        print(f"{params}: net={result['net']:.2f} ({result['delta_net']:+.2f}) "
+              f"fees={result['fees']:.2f} ({result['delta_fees']:+.2f}) "
+              f"max_drawdown={result['max_drawdown']:.2f} ({result['delta_max_drawdown']:+.2f}) "
+              f"early_exits={result['early_exits']}")
+
+@app.cli.command("enqueue-job")
+@click.argument("email")
+@click.argument("kind", type=click.Choice(sorted(JOB_HANDLERS)))
+@click.option("--from-scratch", is_flag=True, help="rebuild_stats: discard snapshots and replay every event.")
+@click.option("--dry-run", is_flag=True, help="reconcile_volume: report the drift without fixing it.")
+def enqueue_job_command(email, kind, from_scratch, dry_run):
+    """Queues a background recomputation job for the user."""
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        print(f"Error: User with email {email} not found.")
+        return
+
+    params = {}
+    if from_scratch:
+        params['from_scratch'] = True
+    if dry_run:
+        params['dry_run'] = True
+    job, created = enqueue_job(user.id, kind, params)
+    print(f"Job {job.id} ({kind}) {'queued' if created else 'already pending'}.")
+
+@app.cli.command("worker")
+@click.option("--concurrency", default=1, show_default=True, help="Jobs processed in parallel by this worker.")
+@click.option("--poll-interval", default=2.0, show_default=True, help="Seconds to wait when the queue is empty.")
+@click.option("--once", is_flag=True, help="Exit when the queue is empty instead of polling.")
+def worker_command(concurrency, poll_interval, once):
+    """Processes queued background jobs (fee recalculation, volume reconciliation, stats rebuild)."""
+    import socket
+    from concurrent.futures import ThreadPoolExecutor
+
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def run_in_context(job_id):
+        with app.app_context():
+            try:
+                run_job(job_id)
+            finally:
+                db.session.remove()
+
+    print(f"Worker {worker_id} started (concurrency={concurrency}, max running jobs={JOB_MAX_CONCURRENT}).")
+    running = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            while True:
+                running = {future for future in running if not future.done()}
+                job_id = None
+                if len(running) < concurrency:
+                    requeue_stale_jobs()
+                    job_id = claim_next_job(worker_id)
+                if job_id is not None:
+                    running.add(executor.submit(run_in_context, job_id))
+                    continue
+                if once and not running:
+                    break
+                time.sleep(poll_interval if not running else min(poll_interval, 0.5))
+        except KeyboardInterrupt:
+            print("Stopping worker; waiting for running jobs to finish.")
+    print(f"Worker {worker_id} stopped.")
+
 
 # --- Inicialização Principal (Apenas para Desenvolvimento Local) ---
 if __name__ == '__main__':
@@ -1175,7 +5436,7 @@ if __name__ == '__main__':
 
         # Inicializa o valor de total_volume se não existir
         try:
-             get_total_volume_from_db() # Chama para inicializar se necessário
+             get_total_volume_from_db('1') # Chama para inicializar se necessário (usuário padrão)
         except Exception as e:
             print(f"Erro ao inicializar total_volume: {e}")
 
@@ -0,0 +1,205 @@
+""" Modo ASGI: rotas presas ao upstream ou ao streaming como handlers async; o resto é o app Flask.
+
+Sob gunicorn com workers sync cada requisição esperando a CoinMarketCap (até 10s) ou enviando
+um export longo ocupa um worker inteiro. Aqui essas rotas rodam no event loop com HTTP e banco
+não bloqueantes (httpx, SQLAlchemy async com asyncpg/aiosqlite), enquanto as demais seguem
+sendo o mesmo app Flask, chamado num pool de threads pelo adaptador WSGI do asgiref:
+
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT --workers ${WEB_CONCURRENCY:-2}
+
+Rotas async (mesmas respostas das versões Flask, que continuam valendo no deploy WSGI):
+- GET /api/market_data      -> cotações da CMC (cmc_quotes_request / cmc_quotes_payload)
+- GET /api/trades/export    -> histórico fechado em CSV/NDJSON, em streaming
+
+Sessão: o cookie de sessão do Flask (ou o 'remember me' do Flask-Login) é validado com a mesma
+SECRET_KEY, sem passar pelo banco. Dependências: requirements.txt (linhas do modo ASGI).
+"""
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, quote
+
+import httpx
+import sqlalchemy as sa
+from asgiref.wsgi import WsgiToAsgi
+from flask_login.utils import decode_cookie
+from itsdangerous import BadSignature
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import app as tracker
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+CMC_TIMEOUT_SECONDS = 10 # Mesmo timeout do requests.get da rota Flask
+
+flask_app = WsgiToAsgi(tracker.app)
+_resources = {} # 'http' (httpx.AsyncClient) e 'engine' (AsyncEngine), criados no primeiro uso por processo
+_resources_lock = asyncio.Lock()
+
+
+def async_database_url(url):
+    """ DATABASE_URL do app com o driver async equivalente (asyncpg / aiosqlite). """
+    url = sa.engine.make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"sem driver async para o banco '{backend}'")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+async def resource(name):
+    if name not in _resources:
+        async with _resources_lock:
+            if name == 'http' and 'http' not in _resources:
+                _resources['http'] = httpx.AsyncClient(timeout=CMC_TIMEOUT_SECONDS)
+            elif name == 'engine' and 'engine' not in _resources:
+                _resources['engine'] = create_async_engine(
+                    async_database_url(tracker.app.config['SQLALCHEMY_DATABASE_URI']), pool_pre_ping=True
+                )
+    return _resources[name]
+
+
+async def close_resources():
+    if 'http' in _resources:
+        await _resources.pop('http').aclose()
+    if 'engine' in _resources:
+        await _resources.pop('engine').dispose()
+
+
+# --- Sessão do Flask-Login ---
+
+def request_cookies(scope):
+    cookies = SimpleCookie()
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    return {name: morsel.value for name, morsel in cookies.items()}
+
+
+def current_user_id(scope):
+    """ ID do usuário logado pelo cookie de sessão assinado do Flask ou pelo cookie 'remember me'. """
+    flask = tracker.app
+    cookies = request_cookies(scope)
+    session_cookie = cookies.get(flask.config['SESSION_COOKIE_NAME'])
+    if session_cookie:
+        serializer = flask.session_interface.get_signing_serializer(flask)
+        try:
+            data = serializer.loads(session_cookie, max_age=int(flask.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            data = {}
+        if data.get('_user_id'):
+            return data['_user_id']
+    remember_cookie = cookies.get(flask.config.get('REMEMBER_COOKIE_NAME', 'remember_token'))
+    if remember_cookie:
+        with flask.app_context():
+            return decode_cookie(remember_cookie)
+    return None
+
+
+# --- Respostas ---
+
+async def send_response(send, status, body, content_type='application/json', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode()),
+                    *((name.encode(), value.encode()) for name, value in headers)],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, payload):
+    await send_response(send, status, json.dumps(payload).encode())
+
+
+async def redirect_to_login(scope, send):
+    """ Mesmo comportamento do @login_required (login_view): 302 para /login?next=... """
+    target = scope['path'] + ('?' + scope['query_string'].decode() if scope['query_string'] else '')
+    await send_response(send, 302, b'', 'text/html', [('location', f"/login?next={quote(target, safe='')}")])
+
+
+# --- Handlers async ---
+
+async def market_data(scope, receive, send):
+    if current_user_id(scope) is None:
+        return await redirect_to_login(scope, send)
+    ids_param = (parse_qs(scope['query_string'].decode()).get('ids') or [None])[0]
+    if not ids_param:
+        return await send_json(send, 400, {"error": "Parâmetro 'ids' é obrigatório"})
+    cmc_request, error = tracker.cmc_quotes_request(ids_param)
+    if error:
+        message, status = error
+        return await send_json(send, status, {"error": message} if message else {})
+    market_url, headers, parameters, original_id_map = cmc_request
+
+    http = await resource('http')
+    try:
+        response = await http.get(market_url, headers=headers, params=parameters)
+        response.raise_for_status()
+        payload, error = tracker.cmc_quotes_payload(response.json(), original_id_map)
+    except httpx.TimeoutException:
+        print("[Market Data ASGI] Erro: Timeout ao conectar com CoinMarketCap API.")
+        return await send_json(send, 504, {"error": "Timeout ao buscar dados de mercado externos"})
+    except httpx.HTTPStatusError as e:
+        print(f"[Market Data ASGI] Erro {e.response.status_code} ao buscar dados da CoinMarketCap API: {e}")
+        message, status = tracker.cmc_http_error(e.response.status_code)
+        return await send_json(send, status, {"error": message})
+    except httpx.HTTPError as e:
+        print(f"[Market Data ASGI] Erro ao buscar dados da CoinMarketCap API: {e}")
+        message, status = tracker.cmc_http_error(500)
+        return await send_json(send, status, {"error": message})
+    if error:
+        message, status = error
+        return await send_json(send, status, {"error": message})
+    await send_json(send, 200, payload)
+
+
+async def export_trades(scope, receive, send):
+    user_id = current_user_id(scope)
+    if user_id is None:
+        return await redirect_to_login(scope, send)
+    fmt = (parse_qs(scope['query_string'].decode()).get('format') or ['csv'])[0]
+    if fmt not in tracker.EXPORT_FORMATS:
+        return await send_json(send, 400, {'error': f"'format' deve ser um de: {', '.join(tracker.EXPORT_FORMATS)}"})
+
+    engine = await resource('engine')
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', tracker.EXPORT_FORMATS[fmt].encode()),
+            (b'content-disposition', f'attachment; filename=trades.{fmt}'.encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': tracker.export_header(fmt).encode(), 'more_body': True})
+    async with engine.connect() as connection:
+        for statement in tracker.export_trades_statements(user_id):
+            result = await connection.stream(statement.execution_options(yield_per=tracker.EXPORT_BATCH_ROWS))
+            async for rows in result.partitions():
+                await send({'type': 'http.response.body', 'body': tracker.format_export_rows(rows, fmt).encode(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+ASYNC_ROUTES = {
+    ('GET', '/api/market_data'): market_data,
+    ('GET', '/api/trades/export'): export_trades,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_resources()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http':
+        handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+        if handler is not None:
+            return await handler(scope, receive, send)
+    await flask_app(scope, receive, send)
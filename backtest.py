@@ -0,0 +1,225 @@
+""" Backtest vetorizado de regras de TP/SL sobre o histórico de trades fechados.
+
+Cada trade vira um caminho de preços (ticks entre a entrada e a saída real, terminando na
+saída real). Os caminhos de todos os trades ficam num único array achatado e a primeira
+travessia de um nível é um searchsorted sobre curvas monótonas por linha (máximo acumulado
+do ganho, da perda ou do recuo desde o pico), deslocadas por linha para que um único
+searchsorted atenda todos os trades x todas as combinações de parâmetros de uma vez.
+
+Sem Flask/DB aqui: o app monta os arrays (flask backtest) e os shards da grade rodam num
+pool de processos.
+"""
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Regra -> parâmetros da grade. Percentuais em %, múltiplos de ATR em x; 0 desliga o nível.
+RULES = {
+    'fixed': ('tp_pct', 'sl_pct'),
+    'atr': ('tp_atr', 'sl_atr'),
+    'trailing': ('trail_pct',),
+}
+ATR_LOOKBACK_TICKS = 14 # Ticks antes da entrada usados no ATR (variação média absoluta por tick)
+SHARD_SIZE = 256 # Combinações por tarefa do pool
+
+
+def _row_cummax(values, row):
+    """ Máximo acumulado por linha num array achatado: (curva deslocada, mínimo, máximo, passo).
+
+    A linha k é deslocada por k * passo (passo > amplitude dos valores), então a curva inteira
+    é crescente e o máximo acumulado nunca vaza de uma linha para a seguinte.
+    """
+    low, high = float(values.min()), float(values.max())
+    span = high - low + 1.0
+    return np.maximum.accumulate(values + row * span), low, high, span
+
+
+def _tick_atr(prices, first_tick, lookback):
+    """ Variação relativa média por tick nos 'lookback' ticks antes de cada entrada (NaN sem histórico). """
+    if len(prices) < 2:
+        return np.full(len(first_tick), np.nan)
+    moves = np.abs(np.diff(prices)) / prices[:-1]
+    cumulative = np.concatenate(([0.0], np.cumsum(moves)))
+    end = np.clip(first_tick - 1, 0, len(moves)) # Movimentos que terminam antes da entrada
+    start = np.maximum(end - lookback, 0)
+    count = end - start
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, (cumulative[end] - cumulative[start]) / count, np.nan)
+
+
+class TradePaths:
+    """ Caminhos de preço de todos os trades, achatados (linha k em [start[k], end[k])).
+
+    'trades' é um dict de arrays alinhados: symbol, side (+1/-1), entry_ts/exit_ts (ms),
+    entry_price, exit_price, size, entry_rate, exit_rate. 'series' é {symbol: (times_ms, prices)}
+    ordenado por tempo. O último ponto de cada linha é a saída real do trade, então 'nenhuma
+    travessia' e 'sair como saiu' são o mesmo índice.
+    """
+
+    def __init__(self, trades, series, atr_lookback=ATR_LOOKBACK_TICKS):
+        self.trades = trades
+        n = len(trades['entry_price'])
+        lo = np.zeros(n, dtype=np.int64)
+        hi = np.zeros(n, dtype=np.int64)
+        self.atr = np.full(n, np.nan)
+        all_times, all_prices = [], []
+        base = 0
+        for symbol, (times, prices) in series.items():
+            times = np.asarray(times, dtype=np.int64)
+            prices = np.asarray(prices, dtype=np.float64)
+            rows = np.flatnonzero(trades['symbol'] == symbol)
+            if len(rows):
+                first = np.searchsorted(times, trades['entry_ts'][rows], side='right')
+                last = np.searchsorted(times, trades['exit_ts'][rows], side='right')
+                lo[rows] = base + first
+                hi[rows] = base + np.maximum(last, first)
+                self.atr[rows] = _tick_atr(prices, first, atr_lookback)
+            all_times.append(times)
+            all_prices.append(prices)
+            base += len(times)
+        # Um elemento extra no fim: índice seguro para o ponto final (substituído pela saída real)
+        times = np.concatenate(all_times + [np.zeros(1, dtype=np.int64)])
+        prices = np.concatenate(all_prices + [np.full(1, np.nan)])
+
+        lengths = hi - lo + 1
+        self.end = np.cumsum(lengths)
+        self.start = self.end - lengths
+        self.row = np.repeat(np.arange(n), lengths)
+        position = np.arange(int(self.end[-1]) if n else 0) - self.start[self.row]
+        is_last = position == lengths[self.row] - 1
+        source = np.where(is_last, base, lo[self.row] + position)
+        self.price = np.where(is_last, trades['exit_price'][self.row], prices[source])
+        self.time = np.where(is_last, trades['exit_ts'][self.row], times[source])
+        entry = trades['entry_price'][self.row]
+        self.ret = trades['side'][self.row] * (self.price / entry - 1.0) # Retorno no sentido do trade
+        self._curves = {}
+
+    def __len__(self):
+        return len(self.end)
+
+    def curve(self, name):
+        """ Curvas monótonas por linha: 'gain' (melhor retorno), 'loss' (pior perda), 'giveback' (recuo do pico). """
+        if name not in self._curves:
+            if name == 'gain':
+                self._curves[name] = _row_cummax(self.ret, self.row)
+            elif name == 'loss':
+                self._curves[name] = _row_cummax(-self.ret, self.row)
+            elif name == 'giveback':
+                gain, _, _, span = self.curve('gain')
+                peak = gain - self.row * span
+                self._curves[name] = _row_cummax(peak - self.ret, self.row)
+            else:
+                raise ValueError(f"curva desconhecida: {name}")
+        return self._curves[name]
+
+    def shared(self, rule):
+        """ Arrays que os workers precisam para a regra (enviados uma vez por processo). """
+        names = ('giveback',) if rule == 'trailing' else ('gain', 'loss')
+        trades = self.trades
+        return {
+            'curves': {name: self.curve(name) for name in names},
+            'end': self.end, 'ret': self.ret, 'price': self.price, 'time': self.time, 'atr': self.atr,
+            'entry_price': trades['entry_price'], 'size': trades['size'],
+            'entry_rate': trades['entry_rate'], 'exit_rate': trades['exit_rate'],
+        }
+
+
+def first_cross(ctx, curve_name, thresholds):
+    """ Índice (achatado) do primeiro ponto de cada linha em que a curva atinge o nível [n, G].
+
+    Níveis <= 0, NaN ou inf não disparam: a linha sai no último ponto (a saída real).
+    """
+    curve, low, high, span = ctx['curves'][curve_name]
+    n = len(ctx['end'])
+    levels = np.where(np.isfinite(thresholds) & (thresholds > 0), thresholds, high + 0.5)
+    levels = np.clip(levels, low, high + 0.5) # Mantém cada consulta dentro da faixa da sua linha
+    index = np.searchsorted(curve, levels + (np.arange(n) * span)[:, None], side='left')
+    return np.minimum(index, ctx['end'][:, None] - 1)
+
+
+def exit_indices(ctx, rule, params):
+    """ Índice de saída [n, G] de cada trade em cada combinação de parâmetros. """
+    n = len(ctx['end'])
+    if rule == 'fixed':
+        tp = first_cross(ctx, 'gain', np.broadcast_to(params[:, 0] / 100.0, (n, len(params))))
+        sl = first_cross(ctx, 'loss', np.broadcast_to(params[:, 1] / 100.0, (n, len(params))))
+        return np.minimum(tp, sl)
+    if rule == 'atr':
+        atr = ctx['atr'][:, None]
+        tp = first_cross(ctx, 'gain', np.where(params[:, 0] > 0, atr * params[:, 0], np.inf))
+        sl = first_cross(ctx, 'loss', np.where(params[:, 1] > 0, atr * params[:, 1], np.inf))
+        return np.minimum(tp, sl)
+    if rule == 'trailing':
+        return first_cross(ctx, 'giveback', np.broadcast_to(params[:, 0] / 100.0, (n, len(params))))
+    raise ValueError(f"regra desconhecida: {rule}")
+
+
+def evaluate(ctx, exits):
+    """ PnL, taxas, resultado líquido, drawdown máximo e saídas antecipadas por combinação. """
+    notional = (ctx['entry_price'] * ctx['size'])[:, None]
+    pnl = notional * ctx['ret'][exits]
+    fees = notional * ctx['entry_rate'][:, None] + ctx['price'][exits] * ctx['size'][:, None] * ctx['exit_rate'][:, None]
+    net = pnl - fees
+    # Curva de capital na ordem das saídas simuladas
+    order = np.argsort(ctx['time'][exits], axis=0, kind='stable')
+    equity = np.cumsum(np.take_along_axis(net, order, axis=0), axis=0)
+    peak = np.maximum(np.maximum.accumulate(equity, axis=0), 0.0)
+    drawdown = (peak - equity).max(axis=0) if len(equity) else np.zeros(exits.shape[1])
+    return {
+        'pnl': pnl.sum(axis=0),
+        'fees': fees.sum(axis=0),
+        'net': net.sum(axis=0),
+        'max_drawdown': drawdown,
+        'early_exits': (exits < ctx['end'][:, None] - 1).sum(axis=0),
+    }
+
+
+_WORKER_CTX = None
+
+def _init_worker(ctx):
+    global _WORKER_CTX
+    _WORKER_CTX = ctx
+
+def _run_shard(rule, params):
+    return evaluate(_WORKER_CTX, exit_indices(_WORKER_CTX, rule, params))
+
+
+def parameter_grid(rule, values):
+    """ Produto cartesiano dos valores de cada parâmetro da regra -> array [G, k] (ausente = desligado). """
+    names = RULES[rule]
+    if not any(values.get(name) for name in names):
+        raise ValueError(f"nenhum parâmetro informado para '{rule}' ({', '.join(names)})")
+    return np.array(list(itertools.product(*(values.get(name) or [0.0] for name in names))), dtype=np.float64)
+
+
+def run_backtest(paths, rule, grid, workers=None, shard_size=SHARD_SIZE):
+    """ Simula a grade inteira e compara com as saídas reais.
+
+    Retorna (baseline, resultados): baseline com os totais das saídas reais e, por combinação,
+    os totais simulados e as diferenças (delta_*) em relação a ele. workers=1 roda no processo.
+    """
+    ctx = paths.shared(rule)
+    baseline = {key: float(value[0]) for key, value in evaluate(ctx, (ctx['end'] - 1)[:, None]).items()}
+
+    shards = [grid[i:i + shard_size] for i in range(0, len(grid), shard_size)]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(shards) <= 1:
+        _init_worker(ctx)
+        parts = [_run_shard(rule, shard) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards)), initializer=_init_worker, initargs=(ctx,)) as pool:
+            parts = list(pool.map(_run_shard, itertools.repeat(rule), shards))
+
+    metrics = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]} if parts else {}
+    names = RULES[rule]
+    results = []
+    for g, params in enumerate(grid):
+        result = dict(zip(names, params.tolist()))
+        for key in ('pnl', 'fees', 'net', 'max_drawdown'):
+            result[key] = float(metrics[key][g])
+            result[f'delta_{key}'] = result[key] - baseline[key]
+        result['early_exits'] = int(metrics['early_exits'][g])
+        results.append(result)
+    return baseline, results
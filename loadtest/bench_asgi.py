@@ -0,0 +1,120 @@
+""" Compara o deploy WSGI (gunicorn sync) com o modo ASGI (uvicorn asgi:application) sob concorrência.
+
+Sobe os dois apontando para o mesmo banco e para o fake_cmc com latência alta, para que o
+upstream lento domine o tempo de cada requisição:
+
+    python loadtest/fake_cmc.py --port 9100 --latency-ms 800 --jitter-ms 200 &
+    export COINMARKETCAP_API_URL=http://127.0.0.1:9100 COINMARKETCAP_API_KEY=fake
+    gunicorn app:app --workers 4 --bind 127.0.0.1:8000 &
+    uvicorn asgi:application --workers 4 --port 8001 &
+    python loadtest/bench_asgi.py --target wsgi=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001 \\
+        --concurrency 8,64,256 --duration 20 --email loadtest-1@example.com
+
+Para o export em streaming use --path '/api/trades/export?format=ndjson'. Cada alvo faz login uma
+vez e todas as conexões reusam o mesmo cookie de sessão.
+
+Referência (1 vCPU, SQLite, 4 workers em cada servidor, fake_cmc 800±200ms, 20s por nível):
+
+    /api/market_data           c=8                 c=64                 c=256
+    gunicorn sync     4.8 req/s p50 1612ms   4.8 req/s p50 12824ms   2.9 req/s, 208 timeouts
+    uvicorn (ASGI)    9.2 req/s p50  852ms  71.2 req/s p50   857ms  45.4 req/s p50 4340ms
+
+    /api/trades/export?format=ndjson (2000 trades), 15s por nível
+    gunicorn sync    13.0 req/s p50  628ms  14.0 req/s p50  4366ms
+    uvicorn (ASGI)   19.3 req/s p50  396ms  15.8 req/s p50  3904ms
+
+Com o upstream lento o sync satura em workers/latência (~5 req/s); o ASGI só é limitado pelo
+upstream até o event loop e a CPU saturarem. O export é limitado pela CPU nos dois modos.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+DEFAULT_PATH = '/api/market_data?ids=bitcoin,ethereum,solana'
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def login(base_url, email, password):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        response = await client.post('/login', data={'email': email, 'password': password})
+        if response.status_code != 302:
+            raise SystemExit(f"[BENCH] Login falhou em {base_url} (status {response.status_code})")
+        return httpx.Cookies(client.cookies)
+
+
+async def run_level(base_url, cookies, path, concurrency, duration, timeout):
+    latencies, errors = [], {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, cookies=cookies, timeout=timeout, limits=limits) as client:
+        deadline = time.monotonic() + duration
+
+        async def worker():
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    async with client.stream('GET', path) as response:
+                        async for _ in response.aiter_bytes():
+                            pass
+                    outcome = response.status_code
+                except httpx.HTTPError as e:
+                    outcome = type(e).__name__
+                if outcome == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors[str(outcome)] = errors.get(str(outcome), 0) + 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies) + sum(errors.values()),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'errors': errors,
+    }
+
+
+async def main(options):
+    targets = []
+    for target in options.target:
+        name, _, url = target.partition('=')
+        if not url:
+            raise SystemExit(f"--target deve ser nome=url (recebido: {target})")
+        targets.append((name, url.rstrip('/')))
+    levels = [int(level) for level in options.concurrency.split(',')]
+
+    results = []
+    for name, url in targets:
+        cookies = await login(url, options.email, options.password)
+        for concurrency in levels:
+            result = {'target': name, **await run_level(url, cookies, options.path, concurrency, options.duration, options.timeout)}
+            results.append(result)
+            if not options.json:
+                print(f"[BENCH] {name:<8} c={concurrency:<4} {result['rps']:>8} req/s  p50 {result['p50_ms']:>8}ms  "
+                      f"p99 {result['p99_ms']:>8}ms  erros {result['errors'] or '-'}")
+    if options.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--target', action='append', required=True, help='name=base_url; repeat for each deployment.')
+    parser.add_argument('--concurrency', default='8,64,256', help='Comma-separated in-flight request levels.')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds per concurrency level.')
+    parser.add_argument('--path', default=DEFAULT_PATH, help='Route to hit (GET).')
+    parser.add_argument('--email', default='loadtest-1@example.com', help='User created by scenario.py setup.')
+    parser.add_argument('--password', default='loadtest')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,160 @@
+""" Servidor falso da CoinMarketCap para testes de carga (só /v1/cryptocurrency/quotes/latest).
+
+Os preços fazem um passeio aleatório no tempo (mesma semente -> mesma sequência), então as
+posições abertas pelo cenário acabam batendo TP/SL. Latência, erros 5xx e 429 são configuráveis
+para ver como o app se comporta com o upstream lento ou limitando.
+
+    python loadtest/fake_cmc.py --port 9100 --latency-ms 150 --jitter-ms 100 --error-rate 0.01 --rate-limit-rate 0.05
+    export COINMARKETCAP_API_URL=http://127.0.0.1:9100 COINMARKETCAP_API_KEY=fake
+
+Ctrl-C imprime os contadores de requisições.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+QUOTES_PATH = '/v1/cryptocurrency/quotes/latest'
+# Preço inicial dos símbolos mais comuns no dashboard; os demais começam em 1.0
+BASE_PRICES = {
+    'BTC': 65000.0, 'ETH': 3200.0, 'SOL': 150.0, 'BNB': 580.0, 'XRP': 0.52, 'DOGE': 0.12,
+    'AVAX': 28.0, 'LINK': 14.0, 'SUI': 1.1, 'HYPE': 22.0, 'JUP': 0.9, 'BONK': 0.00002,
+    'USDT': 1.0, 'USDC': 1.0,
+}
+STABLECOINS = ('USDT', 'USDC')
+
+
+class PriceWalk:
+    """ Passeio aleatório geométrico por símbolo, avançado pelo tempo decorrido desde a última cotação. """
+
+    def __init__(self, volatility, seed):
+        self.volatility = volatility # Desvio padrão do retorno por raiz de segundo
+        self.random = random.Random(seed)
+        self.prices = {}
+        self.updated_at = {}
+        self.lock = threading.Lock()
+
+    def quote(self, symbol):
+        now = time.monotonic()
+        with self.lock:
+            price = self.prices.get(symbol, BASE_PRICES.get(symbol, 1.0))
+            elapsed = now - self.updated_at.get(symbol, now)
+            if elapsed > 0 and symbol not in STABLECOINS:
+                price *= math.exp(self.random.gauss(0.0, self.volatility * math.sqrt(elapsed)))
+            self.prices[symbol] = price
+            self.updated_at[symbol] = now
+            return price
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, outcome):
+        with self.lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+
+def make_handler(options, walk, stats):
+    chaos = random.Random(options.seed + 1)
+    chaos_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive, como a API real
+
+        def log_message(self, format, *args):
+            if options.verbose:
+                super().log_message(format, *args)
+
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def status_block(self, error_code=0, error_message=None):
+            return {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+                'error_code': error_code,
+                'error_message': error_message,
+                'elapsed': 0,
+                'credit_count': 1,
+            }
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != QUOTES_PATH:
+                stats.count('404')
+                return self.send_json(404, {'status': self.status_block(404, 'Not found')})
+            if not self.headers.get('X-CMC_PRO_API_KEY'):
+                stats.count('401')
+                return self.send_json(401, {'status': self.status_block(1002, 'API key missing.')})
+
+            with chaos_lock:
+                delay = max(0.0, chaos.gauss(options.latency_ms, options.jitter_ms)) / 1000.0
+                roll = chaos.random()
+            time.sleep(delay)
+            if roll < options.rate_limit_rate:
+                stats.count('429')
+                return self.send_json(429, {'status': self.status_block(1008, "You've exceeded your API Key's HTTP request rate limit.")},
+                                      {'Retry-After': '60'})
+            if roll < options.rate_limit_rate + options.error_rate:
+                stats.count('500')
+                return self.send_json(500, {'status': self.status_block(500, 'Internal server error.')})
+
+            symbols = [s.strip().upper() for s in parse_qs(url.query).get('symbol', [''])[0].split(',') if s.strip()]
+            if not symbols:
+                stats.count('400')
+                return self.send_json(400, {'status': self.status_block(400, '"symbol" is required')})
+            data = {}
+            for symbol in symbols:
+                price = walk.quote(symbol)
+                data[symbol] = {
+                    'symbol': symbol,
+                    'name': symbol,
+                    'quote': {'USD': {'price': price, 'last_updated': self.status_block()['timestamp']}},
+                }
+            stats.count('200')
+            self.send_json(200, {'status': self.status_block(), 'data': data})
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency-ms', type=float, default=120.0, help='Mean added latency per request.')
+    parser.add_argument('--jitter-ms', type=float, default=60.0, help='Std deviation of the added latency.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500.')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of requests answered with 429.')
+    parser.add_argument('--volatility', type=float, default=0.002, help='Price std deviation per sqrt(second).')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--verbose', action='store_true', help='Log every request.')
+    options = parser.parse_args()
+
+    stats = Stats()
+    server = ThreadingHTTPServer((options.host, options.port), make_handler(options, PriceWalk(options.volatility, options.seed), stats))
+    server.daemon_threads = True
+    print(f"[FAKE CMC] Ouvindo em http://{options.host}:{options.port}{QUOTES_PATH} "
+          f"(latência {options.latency_ms}±{options.jitter_ms}ms, 5xx {options.error_rate:.1%}, 429 {options.rate_limit_rate:.1%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"[FAKE CMC] Respostas por status: {dict(sorted(stats.counts.items()))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+""" Cenário de carga: N dashboards simultâneos contra o app (gunicorn) com a CMC falsa.
+
+Cada dashboard virtual faz login com um usuário próprio e repete o que static/js/dashboard.js
+faz: a carga da página (estatísticas, histórico colunar, posições, PnL/taxas do dia, histórico
+de PnL, volumes, saldos, cotações), o laço de TP/SL (cotações a cada --tp-sl-interval e PATCH
+em lote quando um gatilho bate, seguido das recargas) e, de vez em quando, uma posição nova com
+TP/SL perto do preço. Os passos de --dashboards rodam um depois do outro e o relatório mostra
+vazão, latência de cauda e taxa de erros de cada um.
+
+    python loadtest/fake_cmc.py --port 9100 &
+    export DATABASE_URL=sqlite:///loadtest.db COINMARKETCAP_API_URL=http://127.0.0.1:9100 COINMARKETCAP_API_KEY=fake
+    flask db upgrade
+    python loadtest/scenario.py setup --users 64 --history 200
+    gunicorn -w 4 -b 127.0.0.1:8000 app:app &
+    python loadtest/scenario.py run --dashboards 1,4,16,64 --duration 60 --tp-sl-interval 5
+
+Os intervalos padrão são os do dashboard; encurte-os para gerar mais carga por dashboard.
+Limites de taxa por usuário (RATE_LIMITS) continuam valendo: 429 aparece separado dos erros.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+EMAIL_PATTERN = 'loadtest-{}@example.com'
+DEFAULT_PASSWORD = 'loadtest'
+# Símbolo do trade -> ID CoinGecko usado por /api/market_data
+MARKETS = {'BTC': 'bitcoin', 'ETH': 'ethereum', 'SOL': 'solana'}
+PAGE_LOAD = (
+    '/api/statistics',
+    '/api/trades?layout=columnar',
+    '/api/positions',
+    '/api/daily_pnl',
+    '/api/daily_fees',
+    '/api/daily_pnl_history',
+    '/api/total_volume',
+    '/api/volume/rolling',
+    '/api/balances',
+)
+AFTER_TRIGGER = ('/api/trades?layout=columnar', '/api/positions', '/api/daily_pnl', '/api/daily_fees')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """ Amostras (rota, status, latência) de um passo; status 0 = exceção (timeout, conexão). """
+
+    def __init__(self):
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def add(self, name, status, latency):
+        with self.lock:
+            self.samples.append((name, status, latency))
+
+    @staticmethod
+    def summarize(samples, duration):
+        latencies = sorted(latency for _, _, latency in samples)
+        statuses = [status for _, status, _ in samples]
+        total = len(samples)
+        errors = sum(1 for status in statuses if status == 0 or status >= 500)
+        return {
+            'requests': total,
+            'rps': total / duration if duration else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+            'errors': errors,
+            'error_rate': errors / total if total else 0.0,
+            'rate_limited': sum(1 for status in statuses if status == 429),
+        }
+
+    def report(self, duration):
+        by_route = {}
+        for sample in self.samples:
+            by_route.setdefault(sample[0], []).append(sample)
+        return {
+            'overall': self.summarize(self.samples, duration),
+            'routes': {name: self.summarize(samples, duration) for name, samples in sorted(by_route.items())},
+        }
+
+
+class Dashboard(threading.Thread):
+    """ Uma aba do dashboard: carga da página, laço de TP/SL e posições novas. """
+
+    def __init__(self, options, email, recorder, stop, seed):
+        super().__init__(daemon=True)
+        self.options = options
+        self.email = email
+        self.recorder = recorder
+        self.stop = stop
+        self.random = random.Random(seed)
+        self.http = requests.Session()
+        self.positions = []
+        self.prices = {}
+
+    def call(self, method, path, name=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.options.base_url + path, timeout=self.options.timeout, allow_redirects=False, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+        self.recorder.add(name or f'{method} {path}', status, time.perf_counter() - started)
+        return response
+
+    def login(self):
+        response = self.call('POST', '/login', data={'email': self.email, 'password': self.options.password})
+        if response is None or response.status_code != 302: # Senha errada volta 200 com o formulário
+            raise RuntimeError(f'login falhou para {self.email}')
+
+    def page_load(self):
+        for path in PAGE_LOAD:
+            response = self.call('GET', path)
+            if path == '/api/positions' and response is not None and response.ok:
+                self.positions = response.json()
+        self.fetch_prices()
+
+    def fetch_prices(self):
+        response = self.call('GET', '/api/market_data?ids=' + ','.join(MARKETS.values()), name='GET /api/market_data')
+        if response is not None and response.ok:
+            for symbol, coin_id in MARKETS.items():
+                price = (response.json().get(coin_id) or {}).get('usd')
+                if price:
+                    self.prices[symbol] = price
+            return True
+        return False
+
+    def check_tp_sl(self):
+        """ Mesma regra de checkTpSlTriggers: TP primeiro, depois SL, fechando tudo num PATCH. """
+        if not self.positions or not self.fetch_prices():
+            return
+        items = []
+        for position in self.positions:
+            price = self.prices.get((position.get('symbol') or '').upper())
+            if price is None:
+                continue
+            long = position.get('side') == 'long'
+            take_profit, stop_loss = position.get('take_profit'), position.get('stop_loss')
+            trigger = None
+            if take_profit is not None and (price >= take_profit if long else price <= take_profit):
+                trigger = take_profit
+            elif stop_loss is not None and (price <= stop_loss if long else price >= stop_loss):
+                trigger = stop_loss
+            if trigger is not None:
+                items.append({'id': position['id'], 'action': 'trigger_close', 'exit_price': trigger})
+        if items:
+            response = self.call('PATCH', '/api/trades', json={'items': items})
+            if response is not None and response.ok:
+                for path in AFTER_TRIGGER:
+                    reloaded = self.call('GET', path)
+                    if path == '/api/positions' and reloaded is not None and reloaded.ok:
+                        self.positions = reloaded.json()
+
+    def open_position(self):
+        symbol = self.random.choice([symbol for symbol in MARKETS if symbol in self.prices] or [None])
+        if symbol is None:
+            return
+        price = self.prices[symbol]
+        side = self.random.choice(('long', 'short'))
+        distance = self.options.tp_sl_distance * (1 if side == 'long' else -1)
+        response = self.call('POST', '/api/trades', headers={'Idempotency-Key': str(uuid.uuid4())}, json={
+            'symbol': symbol,
+            'side': side,
+            'size': round(100.0 / price, 6),
+            'entry_price': price,
+            'take_profit': price * (1 + distance),
+            'stop_loss': price * (1 - distance),
+        })
+        if response is not None and response.status_code == 201:
+            reloaded = self.call('GET', '/api/positions')
+            if reloaded is not None and reloaded.ok:
+                self.positions = reloaded.json()
+
+    def run(self):
+        options = self.options
+        # Abas não abrem todas no mesmo instante
+        if self.stop.wait(self.random.uniform(0, min(options.tp_sl_interval, options.ramp))):
+            return
+        try:
+            self.login()
+        except RuntimeError as e:
+            print(f"[LOADTEST WARN] {e}")
+            return
+        self.page_load()
+        now = time.monotonic()
+        schedule = {
+            'tp_sl': now + options.tp_sl_interval,
+            'reload': now + options.reload_interval,
+            'trade': now + self.random.uniform(0, options.trade_interval),
+        }
+        actions = {'tp_sl': self.check_tp_sl, 'reload': self.page_load, 'trade': self.open_position}
+        intervals = {'tp_sl': options.tp_sl_interval, 'reload': options.reload_interval, 'trade': options.trade_interval}
+        while not self.stop.is_set():
+            name = min(schedule, key=schedule.get)
+            if self.stop.wait(max(0.0, schedule[name] - time.monotonic())):
+                break
+            actions[name]()
+            schedule[name] = time.monotonic() + intervals[name]
+
+
+def run_step(options, dashboards):
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [
+        Dashboard(options, EMAIL_PATTERN.format(i % options.users + 1), recorder, stop, options.seed * 1000 + i)
+        for i in range(dashboards)
+    ]
+    for thread in threads:
+        thread.start()
+    started = time.monotonic()
+    stop.wait(options.duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=options.timeout + 1)
+    return recorder.report(time.monotonic() - started)
+
+
+def print_step(dashboards, report, per_route):
+    overall = report['overall']
+    print(f"{dashboards:>10} {overall['requests']:>8} {overall['rps']:>8.1f} {overall['p50_ms']:>8.1f} {overall['p95_ms']:>8.1f} "
+          f"{overall['p99_ms']:>8.1f} {overall['max_ms']:>8.1f} {overall['error_rate']:>7.2%} {overall['rate_limited']:>6}")
+    if per_route:
+        for name, route in report['routes'].items():
+            print(f"{'':>10}   {name:<44} {route['requests']:>6} p95 {route['p95_ms']:>8.1f}ms  erros {route['error_rate']:>6.2%}  429 {route['rate_limited']}")
+
+
+def command_run(options):
+    steps = [int(value) for value in options.dashboards.split(',')]
+    print(f"Alvo {options.base_url}; {options.duration}s por passo; TP/SL a cada {options.tp_sl_interval}s")
+    print(f"{'dashboards':>10} {'reqs':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'erros':>7} {'429':>6}")
+    results = []
+    for dashboards in steps:
+        report = run_step(options, dashboards)
+        print_step(dashboards, report, options.per_route)
+        results.append({'dashboards': dashboards, **report})
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Relatório salvo em {options.json}")
+
+
+def command_setup(options):
+    """ Cria os usuários do teste (e um histórico de trades fechados) direto no banco do app. """
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from datetime import datetime, timedelta
+    import app as tracker
+
+    rng = random.Random(options.seed)
+    with tracker.app.app_context():
+        for i in range(1, options.users + 1):
+            email = EMAIL_PATTERN.format(i)
+            if tracker.User.query.filter_by(email=email).first():
+                continue
+            # Mesmo esquema de ID do 'flask create-user'
+            user = tracker.User(
+                id=str(tracker.User.query.count() + 1), email=email,
+                password_hash=tracker.generate_password_hash(options.password, method='pbkdf2:sha256'),
+            )
+            tracker.db.session.add(user)
+            now = datetime.utcnow()
+            for n in range(options.history):
+                symbol = rng.choice(list(MARKETS))
+                closed_at = now - timedelta(minutes=rng.uniform(5, 60 * 24 * 90))
+                opened_at = closed_at - timedelta(minutes=rng.uniform(1, 60 * 24))
+                entry = {'BTC': 65000.0, 'ETH': 3200.0, 'SOL': 150.0}[symbol] * rng.uniform(0.8, 1.2)
+                exit_price = entry * rng.uniform(0.97, 1.03)
+                side = rng.choice(('long', 'short'))
+                size = round(100.0 / entry, 6)
+                trade = tracker.Trade(
+                    id=tracker.deterministic_trade_id(opened_at, f'{email}:{n}'),
+                    user_id=user.id, timestamp=opened_at, closed_at_timestamp=closed_at, symbol=symbol, side=side,
+                    size=size, entry_price=entry, exit_price=exit_price, tier=tracker.DEFAULT_TIER,
+                    pnl=tracker.money((exit_price - entry) * size * (1 if side == 'long' else -1)),
+                )
+                trade.calculated_fee = tracker.calculate_trade_fee(tracker.trade_fee_inputs(trade))
+                tracker.db.session.add(trade)
+            tracker.db.session.commit()
+            print(f"[LOADTEST SETUP] {email}: {options.history} trades fechados")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=64, help='Number of loadtest-N@example.com users.')
+    parser.add_argument('--password', default=DEFAULT_PASSWORD)
+    parser.add_argument('--seed', type=int, default=7)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    setup = commands.add_parser('setup', help='Create the test users in the app database (uses DATABASE_URL).')
+    setup.add_argument('--history', type=int, default=200, help='Closed trades created per new user.')
+
+    run = commands.add_parser('run', help='Run the scenario against a running server.')
+    run.add_argument('--base-url', default='http://127.0.0.1:8000')
+    run.add_argument('--dashboards', default='1,4,16', help='Comma-separated concurrent dashboards per step.')
+    run.add_argument('--duration', type=float, default=60.0, help='Seconds per step.')
+    run.add_argument('--ramp', type=float, default=5.0, help='Dashboards start spread over this many seconds.')
+    run.add_argument('--tp-sl-interval', type=float, default=30.0, help='TP/SL check period (dashboard: 30s).')
+    run.add_argument('--reload-interval', type=float, default=300.0, help='Full page reload period.')
+    run.add_argument('--trade-interval', type=float, default=120.0, help='Period between new positions per dashboard.')
+    run.add_argument('--tp-sl-distance', type=float, default=0.003, help='TP/SL distance from the entry (fraction).')
+    run.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds.')
+    run.add_argument('--per-route', action='store_true', help='Also print the breakdown per route.')
+    run.add_argument('--json', default=None, help='Write the full report to this file.')
+
+    options = parser.parse_args()
+    if options.command == 'setup':
+        command_setup(options)
+    else:
+        command_run(options)
+
+
+if __name__ == '__main__':
+    main()
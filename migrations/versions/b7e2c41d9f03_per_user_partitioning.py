@@ -0,0 +1,116 @@
+"""Per-user partitioning of trade, balance and total_volume
+
+Revision ID: b7e2c41d9f03
+Revises: a31a97fa8a01
+Create Date: 2026-10-19 09:12:44.318201
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2c41d9f03'
+down_revision = 'a31a97fa8a01'
+branch_labels = None
+depends_on = None
+
+
+def _backfill_owner_id(bind):
+    """ Dono dos dados existentes: BACKFILL_USER_ID, ou o primeiro usuário cadastrado, ou '1'. """
+    owner_id = os.environ.get('BACKFILL_USER_ID')
+    if owner_id:
+        return owner_id
+    first_user = bind.execute(sa.text('SELECT id FROM "user" ORDER BY id LIMIT 1')).scalar()
+    return first_user or '1'
+
+
+def _check_backfill_owner(bind, owner_id):
+    """ Falha antes de alterar o schema se houver dados a atribuir sem um usuário válido (FK para user.id). """
+    pending = sum(
+        bind.execute(sa.text(query)).scalar() or 0
+        for query in (
+            'SELECT COUNT(*) FROM trade',
+            'SELECT COUNT(*) FROM balance',
+            "SELECT COUNT(*) FROM config_value WHERE key = 'total_volume'",
+        )
+    )
+    if not pending:
+        return
+    exists = bind.execute(sa.text('SELECT 1 FROM "user" WHERE id = :id').bindparams(id=owner_id)).scalar()
+    if not exists:
+        raise RuntimeError(
+            f"Há {pending} registros (trade/balance/total_volume) para atribuir, mas o usuário '{owner_id}' não existe. "
+            "Crie o usuário dono dos dados ('flask create-user') ou defina BACKFILL_USER_ID com um ID existente "
+            "e rode 'flask db upgrade' de novo."
+        )
+
+
+def upgrade():
+    bind = op.get_bind()
+    owner_id = _backfill_owner_id(bind)
+    _check_backfill_owner(bind, owner_id)
+    is_sqlite = bind.dialect.name == 'sqlite'
+
+    # --- trade: coluna user_id + índices compostos ---
+    with op.batch_alter_table('trade', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('user_id', sa.String(length=50), nullable=True))
+
+    op.execute(sa.text('UPDATE trade SET user_id = :owner').bindparams(owner=owner_id))
+
+    with op.batch_alter_table('trade', schema=None) as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.String(length=50), nullable=False)
+        batch_op.create_foreign_key('fk_trade_user_id_user', 'user', ['user_id'], ['id'])
+        batch_op.create_index('ix_trade_user_timestamp', ['user_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_trade_user_symbol', ['user_id', 'symbol'], unique=False)
+        batch_op.create_index('ix_trade_user_closed_at', ['user_id', 'closed_at_timestamp'], unique=False)
+
+    # --- balance: coluna user_id + PK composta (user_id, symbol) ---
+    with op.batch_alter_table('balance', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('user_id', sa.String(length=50), nullable=True))
+
+    op.execute(sa.text('UPDATE balance SET user_id = :owner').bindparams(owner=owner_id))
+
+    if not is_sqlite:
+        op.drop_constraint('balance_pkey', 'balance', type_='primary')
+    with op.batch_alter_table('balance', schema=None) as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.String(length=50), nullable=False)
+        batch_op.create_primary_key('balance_pkey', ['user_id', 'symbol'])
+        batch_op.create_foreign_key('fk_balance_user_id_user', 'user', ['user_id'], ['id'])
+
+    # --- config_value: total_volume passa a ser por usuário ---
+    op.execute(
+        sa.text("UPDATE config_value SET key = :new_key WHERE key = 'total_volume'")
+        .bindparams(new_key=f'total_volume:{owner_id}')
+    )
+
+
+def downgrade():
+    bind = op.get_bind()
+    owner_id = _backfill_owner_id(bind)
+    is_sqlite = bind.dialect.name == 'sqlite'
+
+    op.execute(
+        sa.text("UPDATE config_value SET key = 'total_volume' WHERE key = :old_key")
+        .bindparams(old_key=f'total_volume:{owner_id}')
+    )
+    op.execute(sa.text("DELETE FROM config_value WHERE key LIKE 'total_volume:%'"))
+
+    # Mantém apenas os saldos do dono original (PK volta a ser só symbol)
+    op.execute(sa.text('DELETE FROM balance WHERE user_id != :owner').bindparams(owner=owner_id))
+    if not is_sqlite:
+        op.drop_constraint('balance_pkey', 'balance', type_='primary')
+    with op.batch_alter_table('balance', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_balance_user_id_user', type_='foreignkey')
+        batch_op.create_primary_key('balance_pkey', ['symbol'])
+        batch_op.drop_column('user_id')
+
+    op.execute(sa.text('DELETE FROM trade WHERE user_id != :owner').bindparams(owner=owner_id))
+    with op.batch_alter_table('trade', schema=None) as batch_op:
+        batch_op.drop_index('ix_trade_user_closed_at')
+        batch_op.drop_index('ix_trade_user_symbol')
+        batch_op.drop_index('ix_trade_user_timestamp')
+        batch_op.drop_constraint('fk_trade_user_id_user', type_='foreignkey')
+        batch_op.drop_column('user_id')
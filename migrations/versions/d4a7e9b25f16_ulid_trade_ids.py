@@ -0,0 +1,161 @@
+"""Time-ordered ULID trade ids with aliases for legacy ids
+
+Revision ID: d4a7e9b25f16
+Revises: c6f2d8a41e95
+Create Date: 2026-10-19 21:26:40.118523
+
+"""
+from datetime import timezone
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7e9b25f16'
+down_revision = 'c6f2d8a41e95'
+branch_labels = None
+depends_on = None
+
+ULID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+LEGACY_EPOCH_MIN_MS = 946684800000 # 2000-01-01: abaixo disso o ID antigo não é um timestamp
+LEGACY_EPOCH_TOLERANCE_MS = 24 * 60 * 60 * 1000
+
+
+def _encode_ulid(timestamp_ms, randomness):
+    value = (timestamp_ms << 80) | randomness
+    chars = []
+    for _ in range(26):
+        chars.append(ULID_ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def _is_ulid(value):
+    return len(value) == 26 and set(value) <= set(ULID_ALPHABET)
+
+
+def _ulid_for_legacy(legacy_id, timestamp):
+    """ Mesmo esquema de deterministic_trade_id no app: aleatoriedade = sha256 do ID antigo e tempo
+    da entrada do trade. IDs antigos numéricos (time.time() das primeiras versões) só valem como
+    tempo se forem uma época plausível (>= 2000-01-01 ou a até um dia do timestamp da linha);
+    IDs sequenciais como '1' ou '42' caem no timestamp. Para 'bp-<fill>' isso dá exatamente o
+    synced_trade_id que a sincronização gera. """
+    row_ms = round(timestamp.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    try:
+        timestamp_ms = round(float(legacy_id) * 1000)
+    except (ValueError, OverflowError):
+        timestamp_ms = row_ms
+    plausible = LEGACY_EPOCH_MIN_MS <= timestamp_ms or abs(timestamp_ms - row_ms) <= LEGACY_EPOCH_TOLERANCE_MS
+    if not plausible or not 0 < timestamp_ms < 2 ** 48:
+        timestamp_ms = row_ms
+    randomness = int.from_bytes(hashlib.sha256(legacy_id.encode()).digest()[:10], 'big')
+    return _encode_ulid(timestamp_ms, randomness)
+
+
+def _rename_trades(bind, renames):
+    """ Troca IDs de trades {antigo: (novo, user_id)}: cópia com o ID novo, filhos apontados
+    para ela e só então remoção da antiga (as FKs ficam válidas o tempo todo). """
+    if not renames:
+        return
+    meta = sa.MetaData()
+    trade = sa.Table('trade', meta, autoload_with=bind)
+    pairs = [{'b_old': old, 'b_new': new} for old, (new, _) in renames.items()]
+
+    rows = bind.execute(sa.select(trade).where(trade.c.id.in_(list(renames)))).mappings().all()
+    bind.execute(trade.insert(), [dict(row, id=renames[row['id']][0]) for row in rows])
+    for table_name in ('trade_fill', 'exchange_fill', 'trade_event'):
+        table = sa.Table(table_name, meta, autoload_with=bind)
+        bind.execute(
+            table.update().where(table.c.trade_id == sa.bindparam('b_old')).values(trade_id=sa.bindparam('b_new')),
+            pairs
+        )
+    bind.execute(trade.delete().where(trade.c.id == sa.bindparam('b_old')), pairs)
+
+    # Payload dos eventos e estado dos snapshots guardam o ID dentro do JSON
+    new_ids = {new: old for old, (new, _) in renames.items()}
+    trade_event = sa.Table('trade_event', meta, autoload_with=bind)
+    event_updates = []
+    for event_id, trade_id, payload in bind.execute(
+        sa.select(trade_event.c.id, trade_event.c.trade_id, trade_event.c.payload)
+        .where(trade_event.c.trade_id.in_(list(new_ids)))
+    ):
+        if payload:
+            data = json.loads(payload)
+            data['id'] = trade_id
+            event_updates.append({'b_id': event_id, 'b_payload': json.dumps(data)})
+    if event_updates:
+        bind.execute(
+            trade_event.update().where(trade_event.c.id == sa.bindparam('b_id'))
+            .values(payload=sa.bindparam('b_payload')),
+            event_updates
+        )
+    trade_snapshot = sa.Table('trade_snapshot', meta, autoload_with=bind)
+    snapshot_updates = []
+    for snapshot_id, state in bind.execute(sa.select(trade_snapshot.c.id, trade_snapshot.c.state)):
+        data = json.loads(state)
+        trades = data.get('trades') or {}
+        if any(trade_id in renames for trade_id in trades):
+            data['trades'] = {renames.get(trade_id, (trade_id,))[0]: value for trade_id, value in trades.items()}
+            snapshot_updates.append({'b_id': snapshot_id, 'b_state': json.dumps(data)})
+    if snapshot_updates:
+        bind.execute(
+            trade_snapshot.update().where(trade_snapshot.c.id == sa.bindparam('b_id'))
+            .values(state=sa.bindparam('b_state')),
+            snapshot_updates
+        )
+
+    # Espelhos do /api/sync: lápide do ID antigo + upsert do novo
+    sync_change = sa.Table('sync_change', meta, autoload_with=bind)
+    changes = []
+    for old, (new, user_id) in renames.items():
+        changes.append({'user_id': user_id, 'entity': 'trade', 'entity_key': old, 'op': 'delete'})
+        changes.append({'user_id': user_id, 'entity': 'trade', 'entity_key': new, 'op': 'upsert'})
+    bind.execute(sync_change.insert().values(created_at=sa.func.current_timestamp()), changes)
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('trade_id_alias',
+    sa.Column('legacy_id', sa.String(length=50), nullable=False),
+    sa.Column('trade_id', sa.String(length=50), nullable=False),
+    sa.Column('user_id', sa.String(length=50), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('legacy_id')
+    )
+    with op.batch_alter_table('trade_id_alias', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_trade_id_alias_trade_id'), ['trade_id'], unique=False)
+
+    # ### end Alembic commands ###
+
+    bind = op.get_bind()
+    renames = {}
+    trade = sa.Table('trade', sa.MetaData(), autoload_with=bind) # Refletida: timestamp vem como datetime
+    for trade_id, user_id, timestamp in bind.execute(sa.select(trade.c.id, trade.c.user_id, trade.c.timestamp)):
+        if not _is_ulid(trade_id):
+            renames[trade_id] = (_ulid_for_legacy(trade_id, timestamp), user_id)
+    _rename_trades(bind, renames)
+    if renames:
+        trade_id_alias = sa.table('trade_id_alias', sa.column('legacy_id'), sa.column('trade_id'), sa.column('user_id'))
+        op.bulk_insert(trade_id_alias, [
+            {'legacy_id': old, 'trade_id': new, 'user_id': user_id} for old, (new, user_id) in renames.items()
+        ])
+
+
+def downgrade():
+    bind = op.get_bind()
+    renames = {}
+    for legacy_id, trade_id, user_id in bind.execute(sa.text(
+        'SELECT a.legacy_id, a.trade_id, a.user_id FROM trade_id_alias a JOIN trade t ON t.id = a.trade_id'
+    )):
+        renames[trade_id] = (legacy_id, user_id)
+    _rename_trades(bind, renames)
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('trade_id_alias', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_trade_id_alias_trade_id'))
+
+    op.drop_table('trade_id_alias')
+    # ### end Alembic commands ###
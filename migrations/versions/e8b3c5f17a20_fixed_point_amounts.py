@@ -0,0 +1,77 @@
+"""Store prices, sizes and USD amounts as scaled integers
+
+Revision ID: e8b3c5f17a20
+Revises: d4a7e9b25f16
+Create Date: 2026-10-19 22:41:07.356194
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b3c5f17a20'
+down_revision = 'd4a7e9b25f16'
+branch_labels = None
+depends_on = None
+
+# Mesmas escalas de MONEY_SCALE / PRICE_SCALE / QUANTITY_SCALE no app
+MONEY, PRICE, QUANTITY = 6, 10, 8
+
+# tabela -> [(coluna, casas decimais, nullable)]
+COLUMNS = {
+    'trade': [
+        ('size', QUANTITY, True),
+        ('entry_price', PRICE, True),
+        ('exit_price', PRICE, True),
+        ('pnl', MONEY, True),
+        ('take_profit', PRICE, True),
+        ('stop_loss', PRICE, True),
+        ('calculated_fee', MONEY, True),
+        ('volume_contribution', MONEY, True),
+    ],
+    'balance': [('amount', QUANTITY, False)],
+    'volume_daily': [('volume', MONEY, False)],
+    'exchange_fill': [
+        ('price', PRICE, False),
+        ('quantity', QUANTITY, False),
+        ('fee', MONEY, True),
+        ('allocated_qty', QUANTITY, True),
+    ],
+    'trade_fill': [
+        ('price', PRICE, False),
+        ('quantity', QUANTITY, False),
+        ('fee', MONEY, False),
+        ('realized_pnl', MONEY, True),
+    ],
+    'trade_event': [('volume_delta', MONEY, False)],
+}
+
+
+def upgrade():
+    is_sqlite = op.get_bind().dialect.name == 'sqlite'
+    for table, columns in COLUMNS.items():
+        if is_sqlite:
+            # SQLite não tem ALTER ... USING: escala no lugar e a cópia do batch converte para inteiro
+            op.execute(sa.text(f'UPDATE {table} SET ' + ', '.join(
+                f'{column} = CAST(ROUND({column} * {10 ** scale}) AS INTEGER)' for column, scale, _ in columns
+            )))
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column, scale, nullable in columns:
+                batch_op.alter_column(column,
+                    existing_type=sa.Float(), type_=sa.BigInteger(), existing_nullable=nullable,
+                    postgresql_using=f'ROUND({column} * {10 ** scale})::bigint')
+
+
+def downgrade():
+    is_sqlite = op.get_bind().dialect.name == 'sqlite'
+    for table, columns in COLUMNS.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column, scale, nullable in columns:
+                batch_op.alter_column(column,
+                    existing_type=sa.BigInteger(), type_=sa.Float(), existing_nullable=nullable,
+                    postgresql_using=f'{column}::double precision / {10 ** scale}')
+        if is_sqlite:
+            op.execute(sa.text(f'UPDATE {table} SET ' + ', '.join(
+                f'{column} = {column} / {10 ** scale}.0' for column, scale, _ in columns
+            )))
@@ -0,0 +1,77 @@
+// --- Service worker do dashboard: mantém o shell (página, assets, CDN) em cache para uso offline ---
+// /assets/* têm hash no nome (imutáveis): cache-first. Página e CDN: network-first com o cache
+// como reserva. /api/* nunca passa pelo cache (os dados offline vêm do IndexedDB do SyncStore).
+const SHELL_CACHE = 'backpack-shell-v1';
+const ASSET_CACHE = 'backpack-assets-v1';
+const CDN_HOSTS = ['cdn.jsdelivr.net'];
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', event => {
+    const keep = [SHELL_CACHE, ASSET_CACHE];
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names.filter(name => !keep.includes(name)).map(name => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+async function cacheFirst(request) {
+    const cached = await caches.match(request);
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.ok) {
+        const cache = await caches.open(ASSET_CACHE);
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function networkFirst(request) {
+    try {
+        const response = await fetch(request);
+        // Só guarda a página se veio dela mesma (um redirect para /login não vira o shell offline)
+        if (response.ok && !response.redirected) {
+            const cache = await caches.open(SHELL_CACHE);
+            cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await caches.match(request);
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+// Logout: remove a página em cache e os espelhos locais de dados do usuário
+async function clearUserData() {
+    await caches.delete(SHELL_CACHE);
+    if (self.indexedDB && indexedDB.databases) {
+        const databases = await indexedDB.databases();
+        databases
+            .filter(database => database.name && database.name.startsWith('backpack-tracker-'))
+            .forEach(database => indexedDB.deleteDatabase(database.name));
+    }
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+
+    if (url.origin === self.location.origin) {
+        if (url.pathname === '/logout') {
+            event.waitUntil(clearUserData());
+            return;
+        }
+        if (url.pathname.startsWith('/assets/')) {
+            event.respondWith(cacheFirst(request));
+        } else if (url.pathname === '/') {
+            event.respondWith(networkFirst(request));
+        }
+        return; // /api/* e demais rotas: rede direto
+    }
+    if (CDN_HOSTS.includes(url.hostname)) {
+        event.respondWith(networkFirst(request));
+    }
+});
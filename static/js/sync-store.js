@@ -0,0 +1,154 @@
+// --- Espelho local (IndexedDB) dos dados do usuário, sincronizado por delta via /api/sync ---
+// Guarda trades, saldos e config (total_volume). Cada sync pede só o que mudou depois da
+// última versão vista; offline, o dashboard lê daqui em modo somente leitura.
+const SyncStore = (() => {
+    const DB_PREFIX = 'backpack-tracker-';
+    const DB_VERSION = 1;
+    let dbPromise = null;
+    let syncPromise = null;
+
+    function userId() {
+        return document.body.dataset.userId || 'anon';
+    }
+
+    function isOffline() {
+        return navigator.onLine === false;
+    }
+
+    function requestToPromise(request) {
+        return new Promise((resolve, reject) => {
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    function openDb() {
+        if (!('indexedDB' in window)) return Promise.reject(new Error('IndexedDB indisponível'));
+        if (!dbPromise) {
+            dbPromise = new Promise((resolve, reject) => {
+                const request = indexedDB.open(DB_PREFIX + userId(), DB_VERSION);
+                request.onupgradeneeded = () => {
+                    const db = request.result;
+                    db.createObjectStore('trades', { keyPath: 'id' });
+                    db.createObjectStore('balances', { keyPath: 'symbol' });
+                    db.createObjectStore('meta'); // 'version' e 'config'
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => reject(request.error);
+            });
+            dbPromise.catch(() => { dbPromise = null; });
+        }
+        return dbPromise;
+    }
+
+    function transactionDone(tx) {
+        return new Promise((resolve, reject) => {
+            tx.oncomplete = () => resolve();
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        });
+    }
+
+    async function getMeta(key, fallback) {
+        const db = await openDb();
+        const value = await requestToPromise(db.transaction('meta').objectStore('meta').get(key));
+        return value === undefined ? fallback : value;
+    }
+
+    // Aplica uma página do delta numa única transação (versão só avança se tudo for gravado)
+    async function applyDelta(delta) {
+        const db = await openDb();
+        const tx = db.transaction(['trades', 'balances', 'meta'], 'readwrite');
+        const trades = tx.objectStore('trades');
+        const balances = tx.objectStore('balances');
+        const meta = tx.objectStore('meta');
+
+        if (delta.reset) {
+            trades.clear();
+            balances.clear();
+            meta.delete('config');
+        }
+        delta.trades.forEach(trade => trades.put(trade));
+        delta.trades_deleted.forEach(id => trades.delete(id));
+        Object.entries(delta.balances).forEach(([symbol, amount]) => balances.put({ symbol, amount }));
+        delta.balances_deleted.forEach(symbol => balances.delete(symbol));
+
+        if (Object.keys(delta.config).length > 0) {
+            const configRequest = meta.get('config');
+            configRequest.onsuccess = () => {
+                meta.put(Object.assign({}, configRequest.result || {}, delta.config), 'config');
+            };
+        }
+        meta.put(delta.version, 'version');
+        await transactionDone(tx);
+    }
+
+    async function runSync() {
+        let since = await getMeta('version', 0);
+        let pages = 0;
+        while (true) {
+            const response = await fetch(`/api/sync?since=${since}`);
+            if (!response.ok) throw new Error(`Erro ${response.status} ao sincronizar`);
+            const delta = await response.json();
+            await applyDelta(delta);
+            pages += 1;
+            if (!delta.has_more) break;
+            since = delta.version;
+        }
+        console.log(`[SyncStore] Sincronizado até a versão ${await getMeta('version', 0)} (${pages} página(s)).`);
+        return true;
+    }
+
+    // Puxa o delta do servidor; retorna false (sem lançar) se offline ou se a sync falhar
+    async function sync() {
+        if (isOffline()) return false;
+        if (!syncPromise) {
+            syncPromise = runSync()
+                .catch(error => {
+                    console.warn('[SyncStore] Falha na sincronização, usando dados locais:', error);
+                    return false;
+                })
+                .finally(() => { syncPromise = null; });
+        }
+        return syncPromise;
+    }
+
+    async function getTrades() {
+        const db = await openDb();
+        return requestToPromise(db.transaction('trades').objectStore('trades').getAll());
+    }
+
+    function byTimestampDesc(a, b) {
+        return (b.timestamp || '').localeCompare(a.timestamp || '');
+    }
+
+    // Mesmos filtros de /api/trades (histórico) e /api/positions
+    async function getClosedTrades() {
+        const trades = await getTrades();
+        return trades.filter(trade => trade.exit_price !== null && trade.exit_price !== undefined).sort(byTimestampDesc);
+    }
+
+    async function getOpenPositions() {
+        const trades = await getTrades();
+        return trades.filter(trade =>
+            trade.entry_price !== null && trade.entry_price !== undefined &&
+            trade.size !== null && trade.size !== undefined && trade.size !== 0 &&
+            (trade.exit_price === null || trade.exit_price === undefined)
+        ).sort(byTimestampDesc);
+    }
+
+    async function getBalances() {
+        const db = await openDb();
+        const rows = await requestToPromise(db.transaction('balances').objectStore('balances').getAll());
+        const balances = {};
+        rows.forEach(row => { balances[row.symbol] = row.amount; });
+        return balances;
+    }
+
+    async function getConfig(name) {
+        const config = await getMeta('config', {});
+        return config[name];
+    }
+
+    return { sync, isOffline, getClosedTrades, getOpenPositions, getBalances, getConfig };
+})();
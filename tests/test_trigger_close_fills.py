@@ -0,0 +1,77 @@
+""" Fechamento por TP/SL de trades com fills (POST trigger_close e PATCH action=trigger_close). """
+import os
+import sys
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix='tracker-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'app.db')}"
+os.environ['REQUEST_GUARD_DB'] = os.path.join(_tmp, 'guard.db')
+os.environ['RESULT_CACHE_DB'] = os.path.join(_tmp, 'result_cache.db')
+os.environ['ANALYTICS_SNAPSHOT_DIR'] = os.path.join(_tmp, 'analytics')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as tracker
+from werkzeug.security import generate_password_hash
+
+
+@pytest.fixture(scope='module')
+def client():
+    tracker.app.config['TESTING'] = True
+    tracker.RATE_LIMITS = {'default': (100000, 1000.0)}
+    tracker.DUPLICATE_WINDOW_SECONDS = 0
+    with tracker.app.app_context():
+        tracker.db.create_all()
+        tracker.db.session.add(tracker.User(id='1', email='u1@test', password_hash=generate_password_hash('pw', method='pbkdf2:sha256')))
+        tracker.db.session.commit()
+    client = tracker.app.test_client()
+    assert client.post('/login', data={'email': 'u1@test', 'password': 'pw'}).status_code == 302
+    return client
+
+
+def open_trade_with_partial_exit(client):
+    """ Long de 2 @ 100 com uma saída parcial de 1 @ 110 (um lote de 1 continua aberto). """
+    response = client.post('/api/trades', json={'symbol': 'SOL', 'side': 'long', 'size': 2, 'entry_price': 100,
+                                                'take_profit': 120, 'stop_loss': 90})
+    assert response.status_code == 201, response.get_data(as_text=True)
+    trade = response.get_json()
+    trade_id = trade.get('trade', trade)['id']
+    response = client.post(f'/api/trades/{trade_id}/fills', json={'kind': 'exit', 'price': 110, 'quantity': 1})
+    assert response.status_code == 201, response.get_data(as_text=True)
+    return trade_id
+
+
+def assert_closed_from_fills(client, trade_id):
+    fills = client.get(f'/api/trades/{trade_id}/fills').get_json()
+    trade = fills['trade']
+    assert trade['exit_price'] is not None
+    assert trade['pnl'] == pytest.approx(30.0) # 1 x (110 - 100) + 1 x (120 - 100)
+    assert trade['calculated_fee'] == pytest.approx(sum(fill['fee'] for fill in fills['fills']))
+    assert trade['take_profit'] is None and trade['stop_loss'] is None
+    assert fills['open_lots'] == []
+    assert [(fill['kind'], fill['quantity'], fill['price']) for fill in fills['fills']][-1] == ('exit', 1.0, 120.0)
+
+
+def test_trigger_close_route_exits_open_lots(client):
+    trade_id = open_trade_with_partial_exit(client)
+    response = client.post(f'/api/trades/{trade_id}/trigger_close', json={'trigger_price': 120})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.get_json()['pnl'] == pytest.approx(30.0)
+    assert_closed_from_fills(client, trade_id)
+
+
+def test_batch_trigger_close_exits_open_lots(client):
+    trade_id = open_trade_with_partial_exit(client)
+    response = client.patch('/api/trades', json={'items': [{'id': trade_id, 'action': 'trigger_close', 'exit_price': 120}]})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    result = response.get_json()['results'][0]
+    assert result['status'] == 'trigger_closed'
+    assert result['trade']['pnl'] == pytest.approx(30.0)
+    assert_closed_from_fills(client, trade_id)
+
+
+def test_batch_update_of_trade_with_fills_is_rejected(client):
+    trade_id = open_trade_with_partial_exit(client)
+    response = client.patch('/api/trades', json={'items': [{'id': trade_id, 'pnl': 5}]})
+    assert response.get_json()['results'][0]['status'] == 'error'